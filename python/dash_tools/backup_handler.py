@@ -1,11 +1,16 @@
 """Simple handling of backup of media files.
 
 Creates a file with _bup ending if not already avaliable.
+For edits that are applied as byte patches, a journal with _jrnl ending
+holds only the bytes that are overwritten, and can roll the edit back.
 """
 import os
+import struct
 from shutil import copy2
 
 BACKUP_FILE_SUFFIX = "_bup"
+JOURNAL_FILE_SUFFIX = "_jrnl"
+JOURNAL_MAGIC = "MP4JRNL1"
 
 
 class BackupError(Exception):
@@ -22,3 +27,59 @@ def make_backup(filepath):
         copy2(filepath, backup_path)
     except IOError as err:
         raise BackupError("IOError %s" % err)
+
+
+def apply_patches(filepath, patches):
+    "Write the (offset, bytes) patches into filepath in place and sync it."
+    with open(filepath, "r+b") as fh:
+        for offset, data in patches:
+            fh.seek(offset)
+            fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def make_journal(filepath, patches):
+    """Save the bytes that patches will overwrite in filepath to a journal.
+
+    The journal is synced before returning, so it can roll back a patch run
+    that was interrupted. Raise BackupError if a journal already exists."""
+    journal_path = filepath + JOURNAL_FILE_SUFFIX
+    if os.path.exists(journal_path):
+        raise BackupError("Journal file %s already exists" % journal_path)
+    try:
+        with open(filepath, "rb") as ifh:
+            with open(journal_path, "wb") as ofh:
+                ofh.write(JOURNAL_MAGIC)
+                for offset, data in patches:
+                    ifh.seek(offset)
+                    original = ifh.read(len(data))
+                    ofh.write(struct.pack(">QI", offset, len(original)))
+                    ofh.write(original)
+                ofh.flush()
+                os.fsync(ofh.fileno())
+    except IOError as err:
+        raise BackupError("IOError %s" % err)
+
+
+def restore_from_journal(filepath):
+    """Write back the original bytes from the journal of filepath and remove it.
+
+    A journal that was cut short by a crash is restored as far as it goes,
+    since the patches that it does not cover were never applied."""
+    journal_path = filepath + JOURNAL_FILE_SUFFIX
+    with open(journal_path, "rb") as ifh:
+        if ifh.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise BackupError("%s is not a journal file" % journal_path)
+        patches = []
+        while True:
+            header = ifh.read(12)
+            if len(header) < 12:
+                break
+            offset, size = struct.unpack(">QI", header)
+            original = ifh.read(size)
+            if len(original) < size:
+                break
+            patches.append((offset, original))
+    apply_patches(filepath, patches)
+    os.remove(journal_path)
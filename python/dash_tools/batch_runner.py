@@ -0,0 +1,172 @@
+"""Run a per-file function over many files in a pool of worker processes.
+
+Tools that process one segment at a time plug in with add_batch_arguments()
+and run_batch(). Each file is processed independently, so an error in one
+file is reported and the batch goes on with the rest.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines
+MAX_CHUNK_SIZE = 64
+# Waiting with a timeout makes the pool iterator interruptible by Ctrl-C
+ONE_YEAR = 365 * 24 * 3600
+
+
+def positive_int(value):
+    "argparse type for an integer of at least 1."
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not %s" % value)
+    return number
+
+
+def add_batch_arguments(parser):
+    "Add the common batch options to an ArgumentParser."
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=positive_int, default=None,
+                        help="files handed to a worker at a time")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="no progress reporting")
+
+
+def run_task(task):
+    """Call func(*args) and return (args, result, error).
+
+    error is None on success, otherwise the formatted traceback."""
+    func, args = task
+    try:
+        return args, func(*args), None
+    except Exception:  # pylint: disable=broad-except
+        return args, None, traceback.format_exc()
+
+
+def run_chunk(chunk):
+    "Run a list of tasks in one worker and return their outcomes."
+    return [run_task(task) for task in chunk]
+
+
+def file_size(path):
+    "Return the size of path, or 0 if it cannot be read."
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def chunk_size_for(nr_tasks, jobs):
+    "Return a chunk size giving each worker a few chunks, up to MAX_CHUNK_SIZE."
+    return max(1, min(MAX_CHUNK_SIZE, nr_tasks // (4 * jobs)))
+
+
+class BatchResult(object):
+    "Results and failures of a batch, with throughput numbers."
+
+    def __init__(self):
+        self.results = []  # (args, result)
+        self.failures = []  # (args, traceback)
+        self.nr_bytes = 0
+        self.start_time = time.time()
+        self.elapsed = 0.0
+
+    def add(self, args, result, error):
+        "Add the outcome of one task."
+        if error is None:
+            self.results.append((args, result))
+        else:
+            self.failures.append((args, error))
+        self.nr_bytes += file_size(args[0])
+        self.elapsed = time.time() - self.start_time
+
+    def __len__(self):
+        return len(self.results) + len(self.failures)
+
+    def rate(self):
+        "Return (files per second, MB per second)."
+        if self.elapsed <= 0:
+            return 0.0, 0.0
+        return len(self) / self.elapsed, self.nr_bytes / self.elapsed / 1e6
+
+
+def run_batch(func, tasks, jobs=None, chunk_size=None, quiet=False):
+    """Call func(*args) for each args tuple in tasks and return a BatchResult.
+
+    The first element of each args tuple is the input file. func must be a
+    module-level function, so that it can be sent to the worker processes.
+    With jobs=1, everything runs in this process."""
+    tasks = [(func, tuple(args)) for args in tasks]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(tasks)))
+    if chunk_size is None:
+        chunk_size = chunk_size_for(len(tasks), jobs)
+    assert chunk_size >= 1, "chunk_size must be at least 1"
+    batch = BatchResult()
+    last_report = batch.start_time
+    pool = None
+    # The pool gets whole chunks, since the iterator of imap_unordered only
+    # takes a timeout (which keeps Ctrl-C working) for a chunk size of 1.
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    if jobs == 1:
+        outcome_chunks = (run_chunk(chunk) for chunk in chunks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        outcome_chunks = pool.imap_unordered(run_chunk, chunks)
+    try:
+        for _ in range(len(chunks)):
+            if pool is None:
+                outcomes = next(outcome_chunks)
+            else:
+                outcomes = outcome_chunks.next(ONE_YEAR)
+            for args, result, error in outcomes:
+                batch.add(args, result, error)
+                if error is not None:
+                    print "ERROR in %s:\n%s" % (args[0], error)
+            if not quiet and time.time() - last_report > PROGRESS_INTERVAL:
+                last_report = time.time()
+                print "%d/%d files, %.1f files/s, %.1f MB/s" % ((len(batch), len(tasks)) +
+                                                                batch.rate())
+                sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if not quiet:
+        print "%d files (%d failed) in %.1fs, %.1f files/s, %.1f MB/s" % (
+            (len(batch), len(batch.failures), batch.elapsed) + batch.rate())
+    return batch
@@ -0,0 +1,197 @@
+"""Benchmark mp4 parsing and filtering on synthetic files.
+
+Generates fragmented and progressive files with synthetic_mp4, times parsing,
+searching, description and the MP4Filter subclasses on them, and writes the
+results as JSON so that runs of different releases can be compared.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import fix_sync_sample_flags
+import mp4
+import mp4filter
+import sample_tables
+import synthetic_mp4 as synth
+
+try:
+    from dash_tools import __version__
+except ImportError:  # Run from the source directory
+    __version__ = None
+
+# name: (generator, keyword arguments at scale 1)
+SCENARIOS = {
+    'fragmented': (synth.make_fragmented, {}),
+    'fragmented_defaults': (synth.make_fragmented,
+                            {'trun_flags': synth.DATA_OFFSET_PRESENT |
+                                           synth.FIRST_SAMPLE_FLAGS_PRESENT}),
+    'fragmented_encrypted': (synth.make_fragmented, {'encrypted': True}),
+    'fragmented_emsg': (synth.make_fragmented, {'emsg_per_fragment': 4}),
+    'progressive': (synth.make_progressive, {}),
+}
+
+# Arguments that grow with the scale factor
+SCALED_ARGUMENTS = ('nr_fragments', 'nr_samples')
+DEFAULT_SIZES = {'nr_fragments': 10, 'nr_samples': 3000}
+
+
+def scenario_arguments(name, scale):
+    "Return the generator keyword arguments of a scenario at a scale."
+    generator, kwargs = SCENARIOS[name]
+    kwargs = dict(kwargs)
+    for arg in SCALED_ARGUMENTS:
+        if arg in generator.func_code.co_varnames[:generator.func_code.co_argcount]:
+            kwargs[arg] = int(DEFAULT_SIZES[arg] * scale)
+    return kwargs
+
+
+def open_and_close(path):
+    "Open a file with mp4.open and release its mapping again."
+    mp4.open(path, use_index_cache=False).close()
+
+
+def fragmented_cases(path, data):
+    "Return the (name, function) pairs timed on a fragmented file."
+    return [
+        ('mp4.parse', lambda: mp4.mp4(data)),
+        ('mp4.open', lambda: open_and_close(path)),
+        ('find', lambda: mp4.mp4(data).find('moof.traf.trun')),
+        ('find_all', lambda: mp4.mp4(data).find_all('moof.traf.trun')),
+        ('description', lambda: mp4.mp4(data).description()),
+        ('BoxIndex', lambda: mp4.BoxIndex(data, len(data))),
+        ('BoxIndex.summaries', lambda: mp4.BoxIndex(data, len(data)).summaries),
+        ('InitFilter', lambda: mp4filter.InitFilter(data=data).filter_top_boxes()),
+        ('SidxFilter', lambda: mp4filter.SidxFilter(data=data).filter_top_boxes()),
+        ('TfdtFilter', lambda: mp4filter.TfdtFilter(path, offset=1000).filter_top_boxes()),
+        ('ShiftCompositionTimeOffset',
+         lambda: mp4filter.ShiftCompositionTimeOffset(path).filter_top_boxes()),
+        ('TrunFilter', lambda: fix_sync_sample_flags.TrunFilter(path).filter_top_boxes()),
+    ]
+
+
+def progressive_cases(path, data):
+    "Return the (name, function) pairs timed on a progressive file."
+    return [
+        ('mp4.parse', lambda: mp4.mp4(data)),
+        ('mp4.open', lambda: open_and_close(path)),
+        ('find', lambda: mp4.mp4(data).find('moov.trak.mdia.minf.stbl.stsz')),
+        ('description', lambda: mp4.mp4(data).description()),
+        ('BoxIndex', lambda: mp4.BoxIndex(data, len(data))),
+        ('SampleIndex', lambda: sample_tables.SampleIndex(mp4.mp4(data).find('moov.trak'))),
+    ]
+
+
+def time_case(func, repeat):
+    "Return the sorted wall-clock times of repeat calls."
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    times.sort()
+    return times
+
+
+def run_scenario(name, scale, repeat, work_dir, verbose=False):
+    "Generate the file of a scenario and time all its cases."
+    generator, _ = SCENARIOS[name]
+    kwargs = scenario_arguments(name, scale)
+    data = generator(**kwargs)
+    path = os.path.join(work_dir, name + '.mp4')
+    with open(path, 'wb') as ofh:
+        ofh.write(data)
+    if name == 'progressive':
+        cases = progressive_cases(path, data)
+    else:
+        cases = fragmented_cases(path, data)
+    results = {}
+    for case_name, func in cases:
+        times = time_case(func, repeat)
+        results[case_name] = {'best': times[0], 'median': times[len(times) // 2]}
+        if verbose:
+            print "%-22s %-28s %8.4fs" % (name, case_name, times[0])
+    return {'parameters': kwargs, 'file_size': len(data), 'results': results}
+
+
+def run(scenarios, scale=1.0, repeat=5, verbose=False):
+    "Run scenarios and return the result dictionary."
+    old_verbose = mp4.VERBOSE
+    mp4.VERBOSE = 0
+    work_dir = tempfile.mkdtemp(prefix='dash_tools_benchmark')
+    try:
+        output = {'dash_tools_version': __version__,
+                  'python_version': platform.python_version(),
+                  'platform': platform.platform(),
+                  'scale': scale,
+                  'repeat': repeat,
+                  'scenarios': {}}
+        for name in scenarios:
+            output['scenarios'][name] = run_scenario(name, scale, repeat, work_dir, verbose)
+    finally:
+        mp4.VERBOSE = old_verbose
+        shutil.rmtree(work_dir)
+    return output
+
+
+def main():
+    "Command-line function."
+    parser = ArgumentParser(description="Benchmark mp4 parsing and filtering "
+                                        "on synthetic files")
+    parser.add_argument("scenarios", nargs="*", default=sorted(SCENARIOS),
+                        help="scenarios to run (default all): %s" % ", ".join(sorted(SCENARIOS)))
+    parser.add_argument("-s", "--scale", type=float, default=1.0,
+                        help="scale the number of fragments and samples")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="number of runs of each case (default 5)")
+    parser.add_argument("-o", "--output", help="write JSON results to file instead of stdout")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error("Unknown scenario %s" % name)
+    output = run(args.scenarios, args.scale, args.repeat, args.verbose)
+    if args.output:
+        with open(args.output, 'wb') as ofh:
+            json.dump(output, ofh, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print
+
+
+if __name__ == "__main__":
+    main()
@@ -32,10 +32,11 @@
 
 import sys
 from structops import uint32_to_str, str_to_uint32
+from backup_handler import apply_patches
 
 def change_brands(indata, major_brand, compatibility_brands, minor_version=0):
     "Change brands in input string indata and return new string."
-    size = str_to_uint32(indata)
+    size = str_to_uint32(indata[:4])
     ftyp = indata[4:8]
     assert ftyp == "ftyp"
     in_major_brand = indata[8:12]
@@ -63,10 +64,17 @@ def main():
     out_filename = sys.argv[2]
     major_brand = sys.argv[3]
     compatibility_brands = sys.argv[4:]
-    indata = open(in_filename, "rb").read()
-    outdata = change_brands(indata, major_brand, compatibility_brands)
-    ofh = open(out_filename, "wb")
-    ofh.write(outdata)
+    with open(in_filename, "rb") as ifh:
+        ftyp = ifh.read(8)
+        ftyp += ifh.read(str_to_uint32(ftyp[:4]) - 8)
+        new_ftyp = change_brands(ftyp, major_brand, compatibility_brands)
+        if in_filename == out_filename and len(new_ftyp) == len(ftyp):  # Patch ftyp in place
+            apply_patches(in_filename, [(0, new_ftyp)])
+            return
+        rest = ifh.read()
+    with open(out_filename, "wb") as ofh:
+        ofh.write(new_ftyp)
+        ofh.write(rest)
 
 
 if __name__ == "__main__":
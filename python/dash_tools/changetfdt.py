@@ -33,6 +33,15 @@
 import sys
 import os
 import mp4filter
+from batch_runner import run_batch
+
+
+def retime_file(infile_name, outfile_name, offset):
+    "Add offset to tfdt of infile_name and write to outfile_name (patched if the same)."
+    tfilter = mp4filter.TfdtFilter(infile_name, offset)
+    if infile_name != outfile_name or tfilter.patch_file() is None:
+        tfilter.filter_to_file(outfile_name)
+
 
 def main():
     "Change base_media_decode_time in tfdt on multiple segment files."
@@ -41,31 +50,24 @@ def main():
     if len(argv) == 2:
         infile = argv[1]
         tfilter = mp4filter.TfdtFilter(infile)
-        tfilter.filter_top_boxes()
+        tfilter.filter_plan()
         tfdt = tfilter.get_tfdt_value()
         print tfdt
     else:
         offset = int(argv[1])
         in_nr = int(argv[2])
         out_nr = int(argv[3])
-        more = True
-        nr_files_processed = 0
-        while more:
-            infile_name = "%d.m4s" % in_nr
-            outfile_name = "%d.m4s" % out_nr
-            if os.path.exists(infile_name):
-                tfilter = mp4filter.TfdtFilter(infile_name, offset)
-                tfilter.filter_top_boxes()
-                ofh = open(outfile_name, "wb")
-                data = tfilter.output
-                ofh.write(data)
-                ofh.close()
-                in_nr += 1
-                out_nr += 1
-                nr_files_processed += 1
-            else:
-                more = False
-                print "Processed %d files" % nr_files_processed
+        tasks = []
+        while os.path.exists("%d.m4s" % in_nr):
+            tasks.append(("%d.m4s" % in_nr, "%d.m4s" % out_nr, offset))
+            in_nr += 1
+            out_nr += 1
+        # Renumbering within an overlapping range must keep the old order
+        in_names = set(task[0] for task in tasks)
+        overlapping = any(task[1] in in_names and task[1] != task[0] for task in tasks)
+        batch = run_batch(retime_file, tasks, jobs=1 if overlapping else None)
+        print "Processed %d files" % len(batch.results)
+        sys.exit(len(batch.failures) > 0)
 
 
 if __name__ == "__main__":
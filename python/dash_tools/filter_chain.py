@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Run a chain of MP4 filters over files in one pass.
+
+Example: clean, retime and strip sidx from a ladder of segments
+
+    filter_chain.py clean,tfdt,sidx --tfdt-offset 90000 -o out */*.m4s
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import sys
+from argparse import ArgumentParser
+
+import fix_sync_sample_flags
+import mediacleaner
+import mp4filter
+from batch_runner import add_batch_arguments, run_batch
+
+# Stage name: (description, function from options to a new filter)
+STAGES = {
+    'clean': ("drop skip, free and sidx boxes; set trackID with --track-id",
+              lambda opts: mediacleaner.MediaCleanFilter(new_track_id=opts.track_id)),
+    'tfdt': ("add --tfdt-offset to tfdt and set mfhd sequence number to --seq-nr",
+             lambda opts: mp4filter.TfdtFilter(None, opts.tfdt_offset, opts.seq_nr)),
+    'sidx': ("remove sidx",
+             lambda opts: mp4filter.SidxFilter()),
+    'shift-cto': ("shift trun composition time offsets to start at 0",
+                  lambda opts: mp4filter.ShiftCompositionTimeOffset(None)),
+    'sync-flags': ("set the non-sync sample flag in trun",
+                   lambda opts: fix_sync_sample_flags.TrunFilter(None)),
+    'live-init': ("set init segment durations to unknown",
+                  lambda opts: mp4filter.InitLiveFilter()),
+}
+
+
+def make_pipeline(stage_names, options, file_name=None, data=None):
+    "Return a FilterPipeline with new stages in the given order."
+    stages = [STAGES[name][1](options) for name in stage_names]
+    return mp4filter.FilterPipeline(stages, file_name, data)
+
+
+def process_file(file_name, stage_names, options):
+    """Filter file_name into options.output_dir, or in place if that is not set.
+
+    In place, a size-preserving chain is applied as patches."""
+    pipeline = make_pipeline(stage_names, options, file_name)
+    if options.output_dir is None:
+        if pipeline.patch_file(journal=options.journal) is not None:
+            return "patched"
+        pipeline.filter_to_file(file_name)
+        return "rewritten"
+    out_name = os.path.join(options.output_dir, os.path.basename(file_name))
+    pipeline.filter_to_file(out_name)
+    return out_name
+
+
+def stage_help():
+    "Return a description of the stages for command-line help."
+    return "; ".join("%s: %s" % (name, STAGES[name][0]) for name in sorted(STAGES))
+
+
+def add_stage_arguments(parser):
+    "Add the chain argument and the stage options to an ArgumentParser."
+    parser.add_argument("chain", help="stages to run, e.g. clean,tfdt,sidx")
+    parser.add_argument("--track-id", dest="track_id", type=int)
+    parser.add_argument("--tfdt-offset", dest="tfdt_offset", type=int)
+    parser.add_argument("--seq-nr", dest="seq_nr", type=int)
+
+
+def parse_chain(parser, chain):
+    "Return the stage names of a comma-separated chain, or exit with a parser error."
+    stage_names = chain.split(",")
+    for name in stage_names:
+        if name not in STAGES:
+            parser.error("Unknown stage %s" % name)
+    return stage_names
+
+
+def main():
+    "Command-line function."
+    parser = ArgumentParser(description="Run a comma-separated chain of filters over "
+                                        "files with one read and one write per file. "
+                                        "Stages are %s." % stage_help())
+    add_stage_arguments(parser)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output-dir", dest="output_dir",
+                        help="write to this directory instead of changing files in place")
+    parser.add_argument("--journal", action="store_true",
+                        help="journal in-place patches for restore_from_bup")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+
+    stage_names = parse_chain(parser, args.chain)
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    batch = run_batch(process_file, [(file_name, stage_names, args) for file_name in args.files],
+                      args.jobs, args.chunk_size, args.quiet)
+    if not args.quiet:
+        for (file_name, _, _), result in sorted(batch.results):
+            print "%s -> %s" % (file_name, result)
+    sys.exit(len(batch.failures) > 0)
+
+
+if __name__ == "__main__":
+    main()
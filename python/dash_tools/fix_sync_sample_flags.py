@@ -31,70 +31,41 @@
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import sys
 import argparse
 
 import mp4filter
-from structops import str_to_uint32, uint32_to_str
+from batch_runner import add_batch_arguments, run_batch
+from trun_codec import TrunCodec
 
 
 class TrunFilter(mp4filter.MP4Filter):
     """Process trun and set the non-sync sample flag of samples."""
 
+    box_handlers = {"moof.traf.trun": "process_trun"}
+
     def __init__(self, file_name, offset=None):
         super(TrunFilter, self).__init__(file_name)
         self.offset = offset
-        self.relevant_boxes = ["moof"]
-
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("moof", "moof.traf"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size],
-                                         file_pos + len(output), path)
-                pos += size
-        elif path == "moof.traf.trun":
-            output = self.process_trun(data, output)
-        else:
-            output = data
-        return output
-
-    def process_trun(self, data, output):
-        """Adjust time of tfdt if offset set."""
-        version_and_flags = str_to_uint32(data[8:12])
-        # version = version_and_flags >> 24
-        flags = version_and_flags & 0xffffff
-        sample_count = str_to_uint32(data[12:16])
-        offset = 16
-        if flags & 0x1:  # data_offset_present
-            offset += 4
-        if flags & 0x4:  # first_sample_flags
-            offset += 4
-        output += data[:offset]
-        for i in range(sample_count):
-            if flags & 0x100:  # sample_duration present
-                output += data[offset:offset + 4]
-                offset += 4
-            if flags & 0x200:  # sample_size present
-                output += data[offset:offset + 4]
-                offset += 4
-            if flags & 0x400:  # sample_flags present
-                sample_flags = str_to_uint32(data[offset:offset + 4])
-                if sample_flags != 0x2000000:  # Depends on other samples
-                    sample_flags |= 0x10000
-                output += uint32_to_str(sample_flags)
-                offset += 4
-            if flags & 0x800:  # composition_time_offset present
-                output += data[offset:offset + 4]
-                offset += 4
-        return output
+
+    def process_trun(self, data):
+        """Set the non-sync flag of samples that depend on others."""
+        #pylint: disable=no-self-use
+        trun = TrunCodec(data)
+        if trun.sample_flags is None:
+            return data
+        trun.mark_non_sync_samples()
+        return trun.encode()
+
+
+def fix_file(filepath, outputdir):
+    "Write filepath with fixed trun flags to outputdir and return the output size."
+    tfilter = TrunFilter(filepath)
+    filename = os.path.split(filepath)[1]
+    outpath = os.path.join(outputdir, filename)
+    size = tfilter.filter_to_file(outpath)
+    print('%s -> %s  %dB' % (filepath, outpath, size))
+    return size
 
 
 def main():
@@ -104,17 +75,12 @@ def main():
                                                  "to ISO segments.")
     parser.add_argument('-o', '--outputdir', required=True)
     parser.add_argument('infile', nargs='+')
+    add_batch_arguments(parser)
     args = parser.parse_args()
 
-    for filepath in args.infile:
-        tfilter = TrunFilter(filepath)
-        tfilter.filter_top_boxes()
-        output = tfilter.output
-        filename = os.path.split(filepath)[1]
-        outpath = os.path.join(args.outputdir, filename)
-        print('%s -> %s  %dB' % (filepath, outpath, len(output)))
-        with open(outpath, 'wb') as ofh:
-            ofh.write(output)
+    batch = run_batch(fix_file, [(filepath, args.outputdir) for filepath in args.infile],
+                      args.jobs, args.chunk_size, args.quiet)
+    sys.exit(len(batch.failures) > 0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+"""Parsed init segment metadata, cached per process.
+
+get_init_info() parses the moov of an init segment (or of a file with a
+moov, like an OnDemand track) once and returns an InitInfo with the
+timescale, handler type, trex defaults and protection info of each track
+and the pssh boxes. The results are kept in an LRU cache keyed by path,
+mtime and size for files, and by content hash for data, so tools that
+handle many media segments of one representation parse its init once.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import mp4
+
+INIT_CACHE_SIZE = 64
+
+_init_cache = OrderedDict()
+
+
+def find_box(parent, path):
+    "Return the first box at path below parent, or None (mp4 find() gives [])."
+    return parent.find(path) or None
+
+
+class TrackInfo(object):
+    "Metadata of one trak, with the trex defaults of its track_id from trexs."
+
+    def __init__(self, trak, trexs=None):
+        tkhd = find_box(trak, 'tkhd')
+        mdhd = find_box(trak, 'mdia.mdhd')
+        hdlr = find_box(trak, 'mdia.hdlr')
+        self.track_id = tkhd.track_id if tkhd is not None else None
+        self.timescale = mdhd.timescale if mdhd is not None else None
+        self.handler_type = hdlr.handler_type if hdlr is not None else None
+        self.default_sample_description_index = None
+        self.default_sample_duration = None
+        self.default_sample_size = None
+        self.default_sample_flags = None
+        trex = trexs.get(self.track_id) if trexs else None
+        if trex is not None:
+            self.default_sample_description_index = trex.default_sample_description_index
+            self.default_sample_duration = trex.default_sample_duration
+            self.default_sample_size = trex.default_sample_size
+            self.default_sample_flags = trex.default_sample_flags
+        self.protection = self._find_protection(trak)
+
+    @staticmethod
+    def _find_protection(trak):
+        """Return a dict with the original format, scheme and tenc values of the
+        first protected sample entry, or None if the track is not protected."""
+        stsd = find_box(trak, 'mdia.minf.stbl.stsd')
+        if stsd is None:
+            return None
+        for entry in stsd.children:
+            sinf = find_box(entry, 'sinf')
+            if sinf is None:
+                continue
+            protection = {'format': None, 'scheme': None, 'is_encrypted': None,
+                          'iv_size': None, 'kid': None}
+            frma = find_box(sinf, 'frma')
+            if frma is not None:
+                protection['format'] = frma.fmap[frma.offset + 8:frma.offset + 12]
+            schm = find_box(sinf, 'schm')
+            if schm is not None:
+                protection['scheme'] = schm.fmap[schm.offset + 12:schm.offset + 16]
+            tenc = find_box(sinf, 'schi.tenc')
+            if tenc is not None:
+                protection['is_encrypted'] = tenc.is_encrypted
+                protection['iv_size'] = tenc.iv_size
+                protection['kid'] = ''.join("%02X" % ord(x) for x in tenc.key_id)
+            return protection
+        return None
+
+
+class InitInfo(object):
+    """Metadata of the tracks in a moov.
+
+    tracks maps track_id to TrackInfo in file order. pssh is a list of
+    dicts with system_id, kids and data_size of the pssh boxes in moov.
+    The track properties are those of the first track, which is the only
+    one in a CMAF track."""
+
+    def __init__(self, root):
+        self.tracks = OrderedDict()
+        self.pssh = []
+        moov = find_box(root, 'moov')
+        if moov is None:
+            return
+        trexs = dict((trex.track_id, trex) for trex in moov.find_all('mvex.trex'))
+        for trak in moov.find_all('trak'):
+            track = TrackInfo(trak, trexs)
+            self.tracks[track.track_id] = track
+        for pssh in moov.find_all('pssh'):
+            self.pssh.append({'system_id': pssh.system_id, 'kids': pssh.kids,
+                              'data_size': pssh.data_size})
+
+    @property
+    def track_ids(self):
+        "Return the track ids in file order."
+        return self.tracks.keys()
+
+    @property
+    def first_track(self):
+        "Return the TrackInfo of the first track, or None if there is no track."
+        for track in self.tracks.itervalues():
+            return track
+        return None
+
+    @property
+    def timescale(self):
+        "Return the timescale of the first track."
+        track = self.first_track
+        return track.timescale if track is not None else None
+
+    @property
+    def handler_type(self):
+        "Return the handler type of the first track."
+        track = self.first_track
+        return track.handler_type if track is not None else None
+
+
+def get_init_info(file_name=None, data=None):
+    """Return the InitInfo of an init segment given as file_name or data.
+
+    A file is memory-mapped and only its moov is parsed."""
+    if data is None:
+        stat = os.stat(file_name)
+        key = (os.path.abspath(file_name), stat.st_mtime, stat.st_size)
+    else:
+        key = hashlib.sha1(data).digest()
+    info = _init_cache.pop(key, None)
+    if info is None:
+        if data is None:
+            root = mp4.open(file_name, use_index_cache=False)
+            try:
+                info = InitInfo(root)
+            finally:
+                root.close()
+        else:
+            info = InitInfo(mp4.mp4(data, recurse=False))
+        if len(_init_cache) >= INIT_CACHE_SIZE:
+            _init_cache.popitem(last=False)
+    _init_cache[key] = info
+    return info
+
+
+def clear_init_cache():
+    "Drop all cached InitInfo."
+    _init_cache.clear()
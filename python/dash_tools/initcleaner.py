@@ -32,10 +32,12 @@
 
 import sys
 import os
+from argparse import ArgumentParser
 
 from structops import uint32_to_str, str_to_uint32
+from batch_runner import add_batch_arguments, run_batch
 from mp4filter import MP4Filter
-from backup_handler import make_backup, BackupError
+from backup_handler import make_backup, BackupError, BACKUP_FILE_SUFFIX
 
 class InitCleanFilter(MP4Filter):
     """Process an init file and clean it.
@@ -45,46 +47,17 @@ class InitCleanFilter(MP4Filter):
     skip and free boxes on top level are removed
     """
 
+    box_handlers = {"skip": "remove_box",
+                    "free": "remove_box",
+                    "moov.mvhd": "process_mvhd",  # Set movie duration
+                    "moov.trak.tkhd": "process_tkhd",  # Set trak duration
+                    "moov.trak.mdia.mdhd": "process_mdhd"}  # Set media duration
+
     def __init__(self, file_name=None, data=None, new_track_id=None):
         MP4Filter.__init__(self, file_name, data)
         self.new_track_id = new_track_id
-        self.relevant_boxes = ['ftyp', 'moov', 'free', 'skip']
         self.movie_timescale = None
 
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("skip", "free"):
-            print "Removing %s box" % box_type # Just let output="" to drop these boxes
-        elif path in ("moov", "moov.trak", "moov.trak.mdia"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos + size], file_pos + len(output), path)
-                pos += size
-        elif path == "moov.mvhd": # Set movie duration
-            output = self.process_mvhd(data)
-        elif path == "moov.trak.tkhd": # Set trak duration
-            output = self.process_tkhd(data)
-        elif path == "moov.trak.mdia.mdhd": # Set media duration
-            version = ord(data[8])
-            if version == 1:
-                output += data[:32]
-                output += '\x00'*8 # duration
-                output += data[40:]
-            else: # version = 0
-                output += data[:24]
-                output += '\x00'*4 # duration
-                output += data[28:]
-        else:
-            output = data
-        return output
-
     def process_mvhd(self, data):
         "Process the mvhd box and set timescale."
         output = ""
@@ -101,6 +74,14 @@ class InitCleanFilter(MP4Filter):
             output += data[28:]
         return output
 
+    def process_mdhd(self, data):
+        "Process mdhd and set duration to 0."
+        #pylint: disable=no-self-use
+        version = ord(data[8])
+        if version == 1:
+            return data[:32] + '\x00'*8 + data[40:]
+        return data[:24] + '\x00'*4 + data[28:]
+
     def process_tkhd(self, data):
         "Process tkhd and set flags, trackId and duration."
         version = ord(data[8])
@@ -132,29 +113,31 @@ class InitCleanFilter(MP4Filter):
         return output
 
 
+def clean_file(file_name, track_id=None):
+    "Make a backup of file_name and filter the backup into file_name."
+    try:
+        make_backup(file_name)
+    except BackupError:
+        print "Backup-file already exists. Skipping file %s" % file_name
+        return
+    init_cleaner = InitCleanFilter(new_track_id=track_id)
+    print "Processing %s" % file_name
+    with open(file_name + BACKUP_FILE_SUFFIX, "rb") as ifh:
+        with open(file_name, "wb") as ofh:
+            init_cleaner.filter_stream(ifh, ofh)
+
+
 def main():
     "Command-line function."
-    from optparse import OptionParser
-    parser = OptionParser()
-    parser.add_option("--id", dest="track_id", type="int", help="set new trackID")
-
-    (options, args) = parser.parse_args()
-
-    if len(args) < 1:
-        parser.error("Wrong number of arguments")
-        sys.exit(1)
-    for file_name in args:
-        try:
-            make_backup(file_name)
-        except BackupError:
-            print "Backup-file already exists. Skipping file %s" % file_name)
-            continue
-        init_cleaner = InitCleanFilter(file_name, new_track_id=options.track_id)
-        print "Processing %s" % file_name
-        output = init_cleaner.filter_top_boxes()
-        os.rename(file_name, bup_name)
-        with open(file_name, "wb") as ofh:
-            ofh.write(output)
+    parser = ArgumentParser()
+    parser.add_argument("--id", dest="track_id", type=int, help="set new trackID")
+    parser.add_argument("files", nargs="+")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+
+    batch = run_batch(clean_file, [(file_name, args.track_id) for file_name in args.files],
+                      args.jobs, args.chunk_size, args.quiet)
+    sys.exit(len(batch.failures) > 0)
 
 
 if __name__ == "__main__":
@@ -41,9 +41,12 @@ import signal
 import urllib2
 import urlparse
 
+import mp4
 import mpdparser
+from init_info import get_init_info
 
 CREATE_DIRS = True
+CHUNK_SIZE = 64 * 1024
 
 
 class FileWriter(object):
@@ -79,11 +82,26 @@ class FileWriter(object):
             ofh.write(data)
 
 
-def fetch_file(url):
-    "Fetch a specific file via http and return as string."
+def fetch_file(url, parser=None):
+    """Fetch a specific file via http and return as string.
+
+    If parser (an mp4.StreamParser) is given, it is fed every chunk as it
+    arrives, so that boxes can be inspected before the download is done."""
     try:
         start_time = time.time()
-        data = urllib2.urlopen(url).read()
+        response = urllib2.urlopen(url)
+        if parser is None:
+            data = response.read()
+        else:
+            chunks = []
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                parser.feed(chunk)
+            parser.close()
+            data = ''.join(chunks)
         size = len(data)
         end_time = time.time()
         start_time_tuple = time.gmtime(start_time)
@@ -96,13 +114,17 @@ def fetch_file(url):
 
 
 class Fetcher(object):
-    "Fetching a complete live DASH session. Must be stopped with interrupt."
+    """Fetching a complete live DASH session. Must be stopped with interrupt.
+
+    box_callback(a_box, track) is called for each top-level box of the media
+    segments as it arrives, with the TrackInfo of the representation's init."""
 
-    def __init__(self, mpd, base_url=None, file_writer=None, verbose=False):
+    def __init__(self, mpd, base_url=None, file_writer=None, verbose=False, box_callback=None):
         self.mpd = mpd
         self.base_url = base_url
         self.file_writer = file_writer
         self.verbose = verbose
+        self.box_callback = box_callback
         self.fetches = None
         self.threads = []
         self.interrupted = False
@@ -154,7 +176,14 @@ class Fetcher(object):
             init_url = os.path.join(fetch['base_url'], fetch['init'])
             data = fetch_file(init_url)
             self.file_writer.write_file(fetch['init'], data)
-            thread = FetchThread("SegmentFetcher_%s" % fetch['id'], fetch, self.file_writer, number_segments, self)
+            fetch['init_info'] = get_init_info(data=data)
+            if self.verbose:
+                track = fetch['init_info'].first_track
+                if track is not None:
+                    print "%s: track_id=%s timescale=%s handler=%s" % (
+                        fetch['init'], track.track_id, track.timescale, track.handler_type)
+            thread = FetchThread("SegmentFetcher_%s" % fetch['id'], fetch, self.file_writer, number_segments, self,
+                                 self.box_callback)
             self.threads.append(thread)
             thread.start()
         self.keep_running()
@@ -170,13 +199,15 @@ class Fetcher(object):
 class FetchThread(Thread):
     "Thread that fetches media segments."
 
-    def __init__(self, name, fetch, file_writer, nr_segments_to_fetch=-1, fetcher=None):
+    def __init__(self, name, fetch, file_writer, nr_segments_to_fetch=-1, fetcher=None, box_callback=None):
         self.fetch = fetch
         Thread.__init__(self, name=name)
         self.interrupted = False
         self.file_writer = file_writer
         self.nr_segment_to_fetch = nr_segments_to_fetch
         self.parent = fetcher
+        self.box_callback = box_callback
+        self.track = fetch['init_info'].first_track
 
     def interrupt(self):
         "Interrupt this thread."
@@ -201,7 +232,10 @@ class FetchThread(Thread):
     def fetch_media_segment(self, number):
         "Fetch a media segment given its number."
         media_url = self.make_media_url(number)
-        return fetch_file(media_url)
+        parser = None
+        if self.box_callback:
+            parser = mp4.StreamParser(lambda a_box: self.box_callback(a_box, self.track))
+        return fetch_file(media_url, parser)
 
     def store_segment(self, data, number):
         "Store the segment to file."
@@ -231,6 +265,23 @@ class FetchThread(Thread):
                 break
 
 
+def print_box(a_box, track=None):
+    """Print a top-level box as soon as it has been received.
+
+    For a moof, the decode time is also given in seconds with the timescale
+    of track, the TrackInfo of the init segment."""
+    print "  %s %dB at %d" % (a_box.type, a_box.size, a_box.stream_offset)
+    if a_box.type != 'moof' or track is None:
+        return
+    tfhd = a_box.find('traf.tfhd')
+    if tfhd and tfhd.track_id != track.track_id:
+        print "WARNING: track_id %d in moof, but %d in init" % (tfhd.track_id, track.track_id)
+    tfdt = a_box.find('traf.tfdt')
+    if tfdt and track.timescale:
+        print "    decode time %d = %.3fs" % (tfdt.decode_time,
+                                             tfdt.decode_time * 1.0 / track.timescale)
+
+
 def download(mpd_url=None, mpd_str=None, base_url=None, base_dst="", number_segments=-1, verbose=False):
     "Download MPD if url specified and then start downloading segments."
     if mpd_url:
@@ -239,7 +290,8 @@ def download(mpd_url=None, mpd_str=None, base_url=None, base_dst="", number_segm
         file_writer = FileWriter(base_dst)
         file_writer.write_file(file_name, mpd_str)
     mpd_parser = mpdparser.ManifestParser(mpd_str)
-    fetcher = Fetcher(mpd_parser.mpd, base_url, file_writer, verbose)
+    box_callback = verbose and print_box or None
+    fetcher = Fetcher(mpd_parser.mpd, base_url, file_writer, verbose, box_callback)
     if verbose:
         print fetcher.fetches
     fetcher.start_fetch(number_segments)
@@ -32,52 +32,26 @@
 
 import sys
 import os
+from argparse import ArgumentParser
 from structops import uint32_to_str, str_to_uint32
+from batch_runner import add_batch_arguments, run_batch
 from mp4filter import MP4Filter
-from backup_handler import make_backup, BackupError
+from backup_handler import make_backup, BackupError, BACKUP_FILE_SUFFIX
 
 
 class MediaCleanFilter(MP4Filter):
     """Process a media segment file. Drop skip, free, and sidx boxes on top level.
     """
+
+    box_handlers = {"skip": "remove_box",
+                    "free": "remove_box",
+                    "sidx": "remove_box",
+                    "moof.traf.tfhd": "process_tfhd"}
+
     # pylint: disable=unused-argument
     def __init__(self, file_name=None, data=None, new_track_id=None, new_default_sample_duration=None):
         MP4Filter.__init__(self, file_name, data)
         self.new_track_id = new_track_id
-        self.relevant_boxes = ['styp', 'moof', 'free', 'skip', 'sidx']
-        self.composite_boxes = ['moof', 'moof.traf']
-
-    # pylint: disable=unused-argument
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("skip", "free", "sidx"):
-            print "Removing %s box" % box_type # Just let output="" to drop these boxes
-        elif path in self.composite_boxes:
-            output = self.process_composite_box(path, data)
-        elif path == "moof.traf.tfhd": # Set movie duration
-            output = self.process_tfhd(data)
-        else:
-            output = data
-        return output
-
-    def process_composite_box(self, path, data):
-        "Process a composite box."
-        #pylint: disable=unused-variable
-        container_size, container_box_type = self.check_box(data[0:8])
-        inner_data = ""
-        pos = 8
-        while pos < len(data):
-            size, box_type = self.check_box(data[pos:pos + 8])
-            inner_data += self.filterbox(box_type, data[pos:pos+size], None, path)
-            pos += size
-        new_container_size = 8 + len(inner_data)
-        #Note. If this has changed, make sure that offsets are changes appropriately
-        return uint32_to_str(new_container_size) + container_box_type + inner_data
 
     def process_tfhd(self, data):
         "Process the mvhd box and set timescale."
@@ -94,29 +68,33 @@ class MediaCleanFilter(MP4Filter):
         return output
 
 
+def clean_file(file_name, track_id=None, dur=None):
+    "Make a backup of file_name and filter the backup into file_name."
+    try:
+        make_backup(file_name)
+    except BackupError:
+        print "Backup-file already exists. Skipping file %s" % file_name
+        return
+    init_cleaner = MediaCleanFilter(new_track_id=track_id)
+    print "Processing %s" % file_name
+    with open(file_name + BACKUP_FILE_SUFFIX, "rb") as ifh:
+        with open(file_name, "wb") as ofh:
+            init_cleaner.filter_stream(ifh, ofh)
+
+
 def main():
     "Command-line function."
-    from optparse import OptionParser
-    parser = OptionParser()
-    parser.add_option("--id", dest="track_id", type="int", help="set new trackID")
-    parser.add_option("--dur", dest="dur", type="int", help="set new default_sample_duration")
+    parser = ArgumentParser()
+    parser.add_argument("--id", dest="track_id", type=int, help="set new trackID")
+    parser.add_argument("--dur", dest="dur", type=int, help="set new default_sample_duration")
+    parser.add_argument("files", nargs="+")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
 
-    (options, args) = parser.parse_args()
+    batch = run_batch(clean_file, [(file_name, args.track_id, args.dur) for file_name in args.files],
+                      args.jobs, args.chunk_size, args.quiet)
+    sys.exit(len(batch.failures) > 0)
 
-    if len(args) < 1:
-        parser.error("Wrong number of arguments")
-        sys.exit(1)
-    for file_name in args:
-        try:
-            make_backup(file_name)
-        except BackupError:
-            print "Backup-file already exists. Skipping file %s" % file_name)
-            continue
-        init_cleaner = MediaCleanFilter(file_name, new_track_id=options.track_id)
-        print "Processing %s" % file_name
-        output = init_cleaner.filter_top_boxes()
-        with open(file_name, "wb") as ofh:
-            ofh.write(output)
 
 if __name__ == "__main__":
     main()
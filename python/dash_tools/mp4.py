@@ -40,20 +40,71 @@ MP4 box parser
 #pylint: disable=expression-not-assigned
 #pylint: disable=unused-variable
 
+import array
 import base64
 import binascii
 import bisect
-import functools
+import hashlib
+import io
+import json
+import mmap
+import os
 
 import struct
+import sys
 from struct import unpack
 
+from structops import UINT64_TYPECODE, running_sums
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 VERBOSE = 0
 REGISTERED_BOXES = {}
+COMPILED_PATHS = {}
+MAX_COMPILED_PATHS = 1024
+
+INDEX_CACHE_SUFFIX = '.mp4idx'
+INDEX_CACHE_MAGIC = 'MP4IDX01'
+INDEX_CACHE_HASH_SIZE = 65536
+
+CONTAINER_BOXES = frozenset(['root',
+                             'moov',
+                             'moof',
+                             'trak',
+                             'traf',
+                             'tfad',
+                             'mvex',
+                             'mdia',
+                             'minf',
+                             'dinf',
+                             'stbl',
+                             'mfra',
+                             'udta',
+                             #'meta',
+                             'stsd',
+                             'sinf',
+                             'schi',
+                             'encv',
+                             'enca',
+                             'avc1',
+                             'hev1',
+                             'hvc1',
+                             'mp4a',
+                             'ec_3',
+                             'vttc'])
 
 FILTER = ''.join([(len(repr(chr(character))) == 3) and chr(character) or '.' for character in range(256)])
 
 
+def unpack_uint24(data, offset):
+    "Big-endian unsigned 24-bit value at offset in data."
+    high, low = struct.unpack_from('>BH', data, offset)
+    return high << 16 | low
+
+
 def str_to_uint32(string4):
     "4-character string to unsigned int32."
     return unpack(">I", string4)[0]
@@ -70,17 +121,48 @@ def dump_hex(src, length=8):
     return ''.join(result)
 
 
-def parse_generator(data, fmt=''):
-    """ parse_generator """
-    offset = 0
+def parse_generator(data, fmt='', offset=0, end=None):
+    """Generator unpacking values from data[offset:end] without slicing.
+
+    Send the struct format of the next value to get it (fmt is reused if
+    nothing is sent); iteration stops at end, default the end of data."""
+    if end is None:
+        end = len(data)
     ret = None
-    while offset < len(data):
+    while offset < end:
         if fmt:
             ret = struct.unpack_from(fmt, data, offset)
             offset += struct.calcsize(fmt)
         fmt = (yield ret) or fmt
 
 
+def parse_box_header(data, offset=0):
+    """Return (size, box_type, header_size) for the box header at offset.
+
+    Returns None if data ends before the header does. A size of 0 means
+    that the box extends to the end of the file."""
+    if len(data) - offset < 8:
+        return None
+    size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:   # Extended size
+        if len(data) - offset < 16:
+            return None
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    # Need to set allowed characters for some boxes
+    if box_type == 'ac-3':
+        box_type = 'ac_3'
+    elif box_type == 'ec-3':
+        box_type = 'ec_3'
+    return size, box_type, header_size
+
+
+def box_class_for(box_type):
+    "Return the registered *_box class for box_type, or box if there is none."
+    return REGISTERED_BOXES.get('%s_box' % box_type.replace(' ', '_'), box)
+
+
 def match_attribute(obj, crit):
     """ match_attribute """
     key, value = crit.split('=')
@@ -99,6 +181,38 @@ def match_box(obj, criteria='xxxx'):
         return obj.type == criteria[:4] and match_attribute(obj, criteria[5:-1])
 
 
+def compile_attribute(crit):
+    """ compile_attribute """
+    key, value = crit.split('=')
+    return lambda obj: str(getattr(obj, key)) == value
+
+
+def compile_path(path):
+    """Compile a dotted box path into a tuple of steps and cache it.
+
+    Each step is (box_type, predicate) where predicate is None or
+    compiled from 'atom[attr=val]' notation. An empty part, as in
+    'traf.tfhd[track_id=1]..trun', is None and steps to the parent.
+    The cache is cleared once it holds MAX_COMPILED_PATHS paths, since
+    paths with attribute values (track ids) are unbounded."""
+    steps = COMPILED_PATHS.get(path)
+    if steps is None:
+        if len(COMPILED_PATHS) >= MAX_COMPILED_PATHS:
+            COMPILED_PATHS.clear()
+        parts = []
+        for part in path.split('.'):
+            if not part:
+                parts.append(None)
+            elif len(part) == 4:
+                parts.append((part, None))
+            elif part.find('[') != -1:
+                parts.append((part[:4], compile_attribute(part[5:-1])))
+            else:
+                parts.append((part, lambda obj: False))
+        steps = COMPILED_PATHS[path] = tuple(parts)
+    return steps
+
+
 class box(object):
     def __init__(self, fmap, box_type, size, offset, parent=None):
         self.fmap = fmap
@@ -106,7 +220,10 @@ class box(object):
         self.size = size
         self.offset = offset
         # self.size, self.type = struct.unpack('>i4s', fmap[offset:offset+8])
-        self.children = []
+        self._children = []
+        self._children_parsed = False
+        self._child_index = None
+        self._box_index = None
         self.parent = parent
         if VERBOSE > 2:
             print ' - parsed \'%s\' offset:%d size:%d' % (box_type, offset, size)
@@ -121,35 +238,34 @@ class box(object):
 
     @property
     def is_container(self):
-        return self.type in ['root',
-                             'moov',
-                             'moof',
-                             'trak',
-                             'traf',
-                             'tfad',
-                             'mvex',
-                             'mdia',
-                             'minf',
-                             'dinf',
-                             'stbl',
-                             'mfra',
-                             'udta',
-                             #'meta',
-                             'stsd',
-                             'sinf',
-                             'schi',
-                             'encv',
-                             'enca',
-                             'avc1',
-                             'hev1',
-                             'hvc1',
-                             'mp4a',
-                             'ec_3',
-                             'vttc'] or self.__class__ == mp4
+        return self.type in CONTAINER_BOXES or self.__class__ is mp4
 
     @property
     def is_unparsed(self):
-        return self.is_container and not self.children and self.size >= 16
+        return self.is_container and not self._children_parsed and self.size >= 16
+
+    @property
+    def children(self):
+        # Containers expand their children on first access
+        if self.is_unparsed:
+            self.parse_children(recurse=False)
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
+        self._children_parsed = True
+        self._child_index = None
+
+    def children_of_type(self, box_type):
+        "Return the children of type box_type, using a per-container index."
+        index = self._child_index
+        if index is None:
+            index = {}
+            for child in self.children:
+                index.setdefault(child.type, []).append(child)
+            self._child_index = index
+        return index.get(box_type, ())
 
     @property
     def root(self):
@@ -175,42 +291,57 @@ class box(object):
 
     def find(self, path, return_first=True):
         # print('%s Searching for: %s\n' % (str(self), path))
-        queue = [(self, path.split('.'))]
+        steps = compile_path(path)
+        last = len(steps) - 1
         matches = []
-        while queue:
-            obj, parts = queue.pop(0)
+        stack = [(self, 0)]
+        while stack:
+            obj, depth = stack.pop()
             # print('testing %s[%d:%d]' % (obj.path, obj.offset, obj.endpos))
-            # check if children are parsed
-            if obj.is_unparsed:
-                # print(' - parsing children')
-                obj.parse_children(recurse=False)
-
-            # matching child?
-            if parts[0]:
-                matching_children = filter(functools.partial(match_box, criteria=parts[0]), obj.children)
+            # matching child? (children are parsed on first access)
+            step = steps[depth]
+            if step is None:
+                matching_children = obj.parent and [obj.parent] or []
             else:
-                matching_children = [obj.parent]
+                box_type, predicate = step
+                matching_children = obj.children_of_type(box_type)
+                if predicate:
+                    matching_children = [child for child in matching_children if predicate(child)]
 
             if matching_children:
                 # print('found %d matching children' % (len(matching_children)))
-                if len(parts) == 1:
-                    matches += matching_children
-
+                if depth == last:
                     if return_first:
-                        return matches[0]
+                        return matching_children[0]
+                    matches.extend(matching_children)
                 else:
-                    new_items = [(child, parts[1:]) for child in matching_children]
-                    queue = new_items + queue
-                    # for child in matching_children:
-                    #     queue.append((child, parts[1:]))
+                    # depth first, in child order
+                    stack.extend((child, depth + 1) for child in reversed(matching_children))
 
         # print(' = matches [%s]' % (', '.join([obj.path for obj in matches])))
         return matches
 
+    def _add_child(self, new_box):
+        self._children.append(new_box)
+        if self._child_index is not None:
+            # siblings may already have been looked up while parsing
+            self._child_index.setdefault(new_box.type, []).append(new_box)
+
     def parse_children(self, stops=None, recurse=True):
         if not self.is_container:
             return
 
+        self._children = []
+        self._children_parsed = True
+        self._child_index = None
+
+        if self._box_index is not None:
+            # Made by a BoxIndex, which already knows the children
+            index, position = self._box_index
+            for i in index.children(position):
+                self._add_child(index.get(i))
+            return
+
         if not stops:
             stops = []
 
@@ -218,35 +349,19 @@ class box(object):
         end_offset = self.offset + self.size
 
         while next_offset < end_offset:
-            box_class = box
-            size, box_type = struct.unpack('>i4s', self.fmap[next_offset:next_offset+8])
+            size, box_type, _ = parse_box_header(self.fmap, next_offset)
 
             #print 'type=', box_type, 'len=', size
 
-            # Need to set allowed characters for some boxes
-            if box_type == 'ac-3':
-                box_type = 'ac_3'
-            elif box_type == 'ec-3':
-                box_type = 'ec_3'
-
-            if size == 1:   # Extended size
-                size = struct.unpack('>Q', self.fmap[next_offset+8:next_offset+16])[0]
             if size > self.size or size < 8:
                 print 'WARNING: Box \'%s\' in \'%s\' at offset %d has faulty size %d (> %d or < 8)' % \
                     (box_type, self.path, next_offset, size, self.size - 7)
                 #raise Exception
                 return
 
-            box_class_name = '%s_box' % box_type.replace(' ', '_')
-            if box_class_name in REGISTERED_BOXES.keys():
-                box_class = REGISTERED_BOXES[box_class_name]
-                # debug_msg_exit('%s_box' % box_type + ':' + globals()['%s_box' % box_type].__name__)
-            else:
-                #print 'no box:', box_class_name
-                pass
-
+            box_class = box_class_for(box_type)
             new_box = box_class(self.fmap, box_type, size, next_offset, self)
-            self.children += [new_box]
+            self._add_child(new_box)
             #next_offset = new_box.endpos
             next_offset += size
 
@@ -276,11 +391,11 @@ class full_box(box):
         box.__init__(self, *args)
         if self.type == 'uuid':
             self.extended_type = self.fmap[self.offset+8:self.offset+24]
-            self.version = struct.unpack('B', self.fmap[self.offset+24:self.offset+25])[0]
-            self.flags = struct.unpack('>i', '\x00'+self.fmap[self.offset+25:self.offset+28])[0]
+            version_flags = struct.unpack_from('>I', self.fmap, self.offset+24)[0]
         else:
-            self.version = struct.unpack('B', self.fmap[self.offset+8:self.offset+9])[0]
-            self.flags = struct.unpack('>i', '\x00'+self.fmap[self.offset+9:self.offset+12])[0]
+            version_flags = struct.unpack_from('>I', self.fmap, self.offset+8)[0]
+        self.version = version_flags >> 24
+        self.flags = version_flags & 0xffffff
 
     def description(self):
         return '\'%s\' [%d:%d] ver:%d flags:0x%x %s\n' % \
@@ -342,6 +457,398 @@ class mp4(box):
     def childpos(self):
         return self.offset
 
+    def close(self):
+        """Release the underlying file mapping, if any."""
+        if isinstance(self.fmap, mmap.mmap):
+            self.fmap.close()
+
+
+def map_file(path):
+    "Return a read-only memory map of the file at path ('' if it is empty)."
+    with io.open(path, 'rb') as ifh:
+        if not os.fstat(ifh.fileno()).st_size:
+            return ''
+        return mmap.mmap(ifh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def open(path, use_index_cache=True):
+    """Open an mp4 file memory-mapped, without reading it into memory.
+
+    Only the top-level box headers are parsed up front. Containers parse
+    their children the first time find() or children touches them.
+    If a valid index cache (see BoxIndex.save) is found next to the file,
+    the box layout is taken from it instead of from the box headers.
+    Call close() on the returned root when done."""
+    fmap = map_file(path)
+    if use_index_cache:
+        index = BoxIndex.load(path, fmap)
+        if index is not None:
+            return index.root
+    return mp4(fmap, recurse=False)
+
+
+def file_identity(path, fmap):
+    """Return size, mtime and a hash of the first and last bytes of a file.
+
+    This is what an index cache is validated against."""
+    stat = os.stat(path)
+    digest = hashlib.sha1(str(stat.st_size))
+    digest.update(fmap[:INDEX_CACHE_HASH_SIZE])
+    digest.update(fmap[-INDEX_CACHE_HASH_SIZE:])
+    return {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'hash' : digest.hexdigest()}
+
+
+class BoxIndex(object):
+    """Flat index of all boxes in a file, built in one scan.
+
+    Box i is described by offsets[i], sizes[i], types[i] (the four-cc as
+    uint32), parents[i] (-1 for top-level boxes) and depths[i]. They are
+    array columns in file order, so a parent always precedes its children.
+    The *_box object for a box is only made when get(i) asks for it."""
+
+    columns = (('offsets', 'L'), ('sizes', 'L'), ('types', 'I'), ('parents', 'l'), ('depths', 'H'))
+
+    def __init__(self, fmap, size=0, scan=True):
+        self.fmap = fmap
+        self.size = size or len(fmap)
+        for name, typecode in self.columns:
+            setattr(self, name, array.array(typecode))
+        self.root = mp4(fmap, self.size, recurse=False)
+        self.root._box_index = (self, -1)
+        self._boxes = {}
+        self._summaries = None
+        if scan:
+            self._scan()
+
+    @classmethod
+    def from_file(cls, path):
+        "Index a memory-mapped file. Call close() when done."
+        return cls(map_file(path))
+
+    @classmethod
+    def cached(cls, path, write=False):
+        """Index a memory-mapped file, from its index cache if that is valid.
+
+        With write, a new index cache is saved if there was no valid one."""
+        fmap = map_file(path)
+        index = cls.load(path, fmap)
+        if index is None:
+            index = cls(fmap)
+            if write:
+                try:
+                    index.save(path)
+                except (IOError, OSError), exc:
+                    print 'WARNING: Could not write index cache for %s: %s' % (path, exc)
+        return index
+
+    @classmethod
+    def load(cls, path, fmap):
+        """Return the index of the file at path mapped in fmap, from the
+        index cache next to it. Return None if there is no cache, or if
+        the file or the platform do not match the cache."""
+        try:
+            with io.open(path + INDEX_CACHE_SUFFIX, 'rb') as ifh:
+                if ifh.read(len(INDEX_CACHE_MAGIC)) != INDEX_CACHE_MAGIC:
+                    return None
+                header_size = struct.unpack('>I', ifh.read(4))[0]
+                header = json.loads(ifh.read(header_size))
+                if header['identity'] != file_identity(path, fmap) or \
+                   header['byteorder'] != sys.byteorder:
+                    return None
+                index = cls(fmap, scan=False)
+                for name, typecode in cls.columns:
+                    column = getattr(index, name)
+                    if header['itemsizes'][name] != column.itemsize:
+                        return None
+                    column.fromstring(ifh.read(header['count'] * column.itemsize))
+                    if len(column) != header['count']:
+                        return None
+        except (IOError, ValueError, KeyError, struct.error):
+            return None
+        index._summaries = header['summaries']
+        return index
+
+    def save(self, path):
+        """Save the index and its summaries next to the file at path.
+
+        The cache is written to a temporary file that is then renamed."""
+        columns = [getattr(self, name) for name, _ in self.columns]
+        header = json.dumps({'identity' : file_identity(path, self.fmap),
+                             'byteorder' : sys.byteorder,
+                             'count' : len(self),
+                             'itemsizes' : dict((name, column.itemsize) for (name, _), column
+                                                in zip(self.columns, columns)),
+                             'summaries' : self.summaries})
+        cache_path = path + INDEX_CACHE_SUFFIX
+        try:
+            with io.open(cache_path + '.tmp', 'wb') as ofh:
+                ofh.write(INDEX_CACHE_MAGIC)
+                ofh.write(struct.pack('>I', len(header)))
+                ofh.write(header)
+                for column in columns:
+                    ofh.write(column.tostring())
+            os.rename(cache_path + '.tmp', cache_path)
+        except:
+            if os.path.exists(cache_path + '.tmp'):
+                os.remove(cache_path + '.tmp')
+            raise
+
+    @property
+    def summaries(self):
+        """Values that verifiers need from sidx, moov and every moof.
+
+        Only JSON types are used, so that they can be saved with the index."""
+        if self._summaries is None:
+            self._summaries = self._summarize()
+        return self._summaries
+
+    def _summarize(self):
+        summaries = {'timescale' : None, 'default_sample_duration' : None,
+                     'sidx' : None, 'fragments' : []}
+        mdhd = self.find('moov.trak.mdia.mdhd')
+        if mdhd is not None:
+            summaries['timescale'] = self.get(mdhd).timescale
+        trex = self.find('moov.mvex.trex')
+        if trex is not None:
+            summaries['default_sample_duration'] = self.get(trex).default_sample_duration
+        sidx = self.find('sidx')
+        if sidx is not None:
+            sidx = self.get(sidx)
+            summaries['sidx'] = {'offset' : sidx.offset,
+                                 'size' : sidx.size,
+                                 'timescale' : sidx.timescale,
+                                 'first_pres_time' : sidx.first_pres_time,
+                                 'first_offset' : sidx.first_offset,
+                                 'references' : [[ref['referenced-size'], ref['subsegment-duration']]
+                                                 for ref in sidx.references]}
+        for moof in self.find_all('moof'):
+            fragment = {'moof' : moof, 'decode_time' : None, 'nr_truns' : 0}
+            tfdt = self.find('traf.tfdt', moof)
+            if tfdt is not None:
+                fragment['decode_time'] = self.get(tfdt).decode_time
+            truns = self.find_all('traf.trun', moof)
+            fragment['nr_truns'] = len(truns)
+            if truns:
+                trun = self.get(truns[0])
+                fragment['sample_count'] = trun.sample_count
+                fragment['duration'] = trun.total_duration
+                fragment['first_cto'] = trun.first_cto
+            summaries['fragments'].append(fragment)
+        return summaries
+
+    def close(self):
+        """Release the underlying file mapping, if any."""
+        self.root.close()
+
+    def _scan(self):
+        offsets, sizes, types, parents, depths = \
+            self.offsets, self.sizes, self.types, self.parents, self.depths
+        # Siblings left to scan when descending into a container
+        stack = []
+        pos, end, parent, depth = 0, self.size, -1, 0
+        while True:
+            while pos < end:
+                header = parse_box_header(self.fmap, pos)
+                if header is None:
+                    print 'WARNING: Truncated box header at offset %d' % pos
+                    break
+                size, box_type, _ = header
+                if size == 0:
+                    size = end - pos
+                if size > end - pos or size < 8:
+                    print 'WARNING: Box \'%s\' at offset %d has faulty size %d (> %d or < 8)' % \
+                        (box_type, pos, size, end - pos)
+                    break
+                index = len(offsets)
+                offsets.append(pos)
+                sizes.append(size)
+                types.append(str_to_uint32(box_type))
+                parents.append(parent)
+                depths.append(depth)
+                pos += size
+                if box_type in CONTAINER_BOXES:
+                    stack.append((pos, end, parent, depth))
+                    pos, end = CHILD_OFFSETS.get(box_type, 8) + offsets[index], pos
+                    parent, depth = index, depth + 1
+            if not stack:
+                break
+            pos, end, parent, depth = stack.pop()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def box_type(self, index):
+        "Return the type of box index as a string."
+        return struct.pack('>I', self.types[index])
+
+    def children(self, index=-1):
+        "Return the indices of the children of box index (-1 for top level)."
+        start, stop = index + 1, len(self.offsets)
+        if index >= 0:
+            depth = self.depths[index]
+            stop = start
+            while stop < len(self.offsets) and self.depths[stop] > depth:
+                stop += 1
+        parents = self.parents
+        return [i for i in xrange(start, stop) if parents[i] == index]
+
+    def find(self, path, index=-1, return_first=True):
+        """Return the indices of boxes at a dotted type path below box index.
+
+        Like box.find(), but without attribute predicates or parent steps.
+        With return_first, the first index or None is returned."""
+        matches = [index]
+        for part in path.split('.'):
+            box_type = str_to_uint32(part)
+            matches = [i for parent in matches for i in self.children(parent)
+                       if self.types[i] == box_type]
+        if return_first:
+            return matches[0] if matches else None
+        return matches
+
+    def find_all(self, path, index=-1):
+        return self.find(path, index, return_first=False)
+
+    def get(self, index):
+        "Return the *_box object for box index, made and cached on first use."
+        obj = self._boxes.get(index)
+        if obj is None:
+            parent = self.parents[index]
+            parent_obj = parent < 0 and self.root or self.get(parent)
+            box_type = self.box_type(index)
+            obj = box_class_for(box_type)(self.fmap, box_type, self.sizes[index],
+                                          self.offsets[index], parent_obj)
+            obj._box_index = (self, index)
+            self._boxes[index] = obj
+        return obj
+
+
+class StreamParser(object):
+    """Incremental parser for top-level boxes arriving in arbitrary chunks.
+
+    Each box is returned from feed() and passed to box_callback as soon as
+    all of its bytes have arrived. Completed boxes are instances of the
+    regular *_box classes under a root of their own, and stream_offset
+    gives their position in the whole stream.
+
+    Payloads of box types in passthrough (mdat by default) are never
+    buffered. A header-only box is emitted once the header is complete
+    and the payload is handed to payload_callback(box, data) chunk by
+    chunk, so passthrough types should not parse their payload."""
+
+    def __init__(self, box_callback=None, payload_callback=None, passthrough=('mdat',)):
+        self.box_callback = box_callback
+        self.payload_callback = payload_callback
+        self.passthrough = frozenset(passthrough)
+        self.stream_offset = 0
+        self._pending = []
+        self._pending_size = 0
+        self._needed = 0
+        self._payload_box = None
+        self._payload_left = 0
+
+    def feed(self, data):
+        "Feed the next chunk of the stream. Return the boxes completed by it."
+        boxes = []
+        if self._pending:
+            self._pending.append(data)
+            self._pending_size += len(data)
+            if self._pending_size < self._needed:
+                return boxes
+            data = ''.join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self._payload_box is not None:
+                # size 0 passthrough boxes run to the end of the stream
+                nr_bytes = end - pos
+                if self._payload_left >= 0:
+                    nr_bytes = min(nr_bytes, self._payload_left)
+                    self._payload_left -= nr_bytes
+                if self.payload_callback:
+                    self.payload_callback(self._payload_box, data[pos:pos + nr_bytes])
+                if not self._payload_left:
+                    self._payload_box = None
+                pos += nr_bytes
+                self.stream_offset += nr_bytes
+                continue
+
+            header = parse_box_header(data, pos)
+            if header is None:
+                # 8 bytes make a header, unless it turns out to have a largesize
+                self._needed = 8 if end - pos < 8 else 16
+            else:
+                size, box_type, header_size = header
+                self._check_size(size, box_type, header_size)
+                if box_type in self.passthrough:
+                    boxes.append(self._emit(data[pos:pos + header_size], box_type, size or header_size))
+                    self._payload_box = boxes[-1]
+                    self._payload_left = size - header_size if size else -1
+                    if not self._payload_left:
+                        self._payload_box = None
+                    pos += header_size
+                    self.stream_offset += header_size
+                    continue
+                if size and end - pos >= size:
+                    boxes.append(self._emit(data[pos:pos + size], box_type, size))
+                    pos += size
+                    self.stream_offset += size
+                    continue
+                self._needed = size or sys.maxint
+            self._pending = [data[pos:]]
+            self._pending_size = end - pos
+            break
+        return boxes
+
+    def close(self):
+        """Signal the end of the stream. Return the final box if it had size 0.
+
+        Anything else left over is a truncated box and is dropped with a
+        warning."""
+        boxes = []
+        if self._pending:
+            data = ''.join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            pos = 0
+            while pos < len(data):
+                header = parse_box_header(data, pos)
+                if header is None or header[0] > len(data) - pos:
+                    print 'WARNING: Truncated box at stream offset %d (%d bytes)' % \
+                        (self.stream_offset, len(data) - pos)
+                    break
+                self._check_size(*header)
+                size = header[0] or len(data) - pos
+                boxes.append(self._emit(data[pos:pos + size], header[1], size))
+                pos += size
+                self.stream_offset += size
+        elif self._payload_left > 0:
+            print 'WARNING: Box \'%s\' at stream offset %d is missing %d payload bytes' % \
+                (self._payload_box.type, self._payload_box.stream_offset, self._payload_left)
+        self._payload_box = None
+        self._payload_left = 0
+        return boxes
+
+    def _check_size(self, size, box_type, header_size):
+        "Raise ValueError for a size that does not even cover the box header."
+        if size and size < header_size:
+            raise ValueError("Box '%s' at stream offset %d has faulty size %d" %
+                             (box_type, self.stream_offset, size))
+
+    def _emit(self, data, box_type, size):
+        "Make a box of the completed bytes in data and report it."
+        root = mp4(data, recurse=False)
+        box_class = box_class_for(box_type)
+        new_box = box_class(data, box_type, size, 0, root)
+        root.children = [new_box]
+        new_box.stream_offset = self.stream_offset
+        if self.box_callback:
+            self.box_callback(new_box)
+        return new_box
+
 
 class moov_box(box):
     def __init__(self, fmap, box_type, size, offset, parent=None):
@@ -351,7 +858,7 @@ class moov_box(box):
 class mvhd_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.creation_time = i.send(self.version and '>Q' or '>I')[0]
         self.modification_time = i.send(self.version and '>Q' or '>I')[0]
@@ -371,14 +878,14 @@ class pssh_box(full_box):
 
         self.kids = []
         if self.version > 0:
-            KID_count = struct.unpack('>I', self.fmap[self.offset+o:self.offset+o+4])[0]
+            KID_count = struct.unpack_from('>I', self.fmap, self.offset+o)[0]
             o += 4
             for k in range(KID_count):
                 kid = ''.join(["%02X"%ord(x) for x in self.fmap[self.offset+o:self.offset+o+16]])
                 o += 16
                 self.kids.append(kid)
 
-        self.data_size = struct.unpack('>I', self.fmap[self.offset+o:self.offset+o+4])[0]
+        self.data_size = struct.unpack_from('>I', self.fmap, self.offset+o)[0]
         o += 4
 
     @property
@@ -408,7 +915,7 @@ class saiz_box(full_box):
         if self.flags and 1:
             offset += 8
 
-        return struct.unpack('>B', self.fmap[self.offset+offset:self.offset+offset+1])[0]
+        return struct.unpack_from('>B', self.fmap, self.offset+offset)[0]
 
     @property
     def sample_count(self):
@@ -416,7 +923,7 @@ class saiz_box(full_box):
         if self.flags and 1:
             offset += 8
 
-        return struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
 
     def sample_info_size(self, index):
         if self.default_sample_info_size != 0:
@@ -428,7 +935,7 @@ class saiz_box(full_box):
 
         sample_offset = self.offset + info_offset_base + index
 
-        return struct.unpack('>B', self.fmap[sample_offset:sample_offset+1])[0]
+        return struct.unpack_from('>B', self.fmap, sample_offset)[0]
 
     @property
     def decoration(self):
@@ -455,17 +962,17 @@ class saio_box(full_box):
         if self.flags and 1:
             offset += 8
 
-        return struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
 
     def entry_offset(self, index):
         offset = 16
         if self.flags and 1:
             offset += 8
             offset += index * 8
-            return struct.unpack('>Q', self.fmap[self.offset+offset:self.offset+offset+8])[0]
+            return struct.unpack_from('>Q', self.fmap, self.offset+offset)[0]
         else:
             offset += index * 4
-            return struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            return struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
 
     @property
     def decoration(self):
@@ -492,7 +999,7 @@ class sbgp_box(full_box):
 
     @property
     def entries(self):
-        return struct.unpack('>I', self.fmap[self.offset+16:self.offset+20])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+16)[0]
 
     def group_entry(self, index):
         base_offset = 20 + (self.version and 4 or 0)
@@ -501,8 +1008,8 @@ class sbgp_box(full_box):
             return 0, 0
 
         offset = self.offset + entry_offset
-        sample_count = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-        group_description_index = struct.unpack('>I', self.fmap[offset+4:offset+8])[0]
+        sample_count = struct.unpack_from('>I', self.fmap, offset)[0]
+        group_description_index = struct.unpack_from('>I', self.fmap, offset+4)[0]
 
         return sample_count, group_description_index
 
@@ -532,7 +1039,7 @@ class sgpd_box(full_box):
     @property
     def entries(self):
         o = (self.version and 4 or 0)
-        return struct.unpack('>I', self.fmap[self.offset+o+16:self.offset+o+20])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+o+16)[0]
 
     def entry(self, index):
         base_offset = 20 + (self.version and 4 or 0)
@@ -542,8 +1049,8 @@ class sgpd_box(full_box):
 
         offset = self.offset + entry_offset
 
-        is_encrypted = struct.unpack('>i', '\x00'+self.fmap[offset:offset+3])[0]
-        iv_size = struct.unpack('>b', self.fmap[offset+3:offset+4])[0]
+        is_encrypted = unpack_uint24(self.fmap, offset)
+        iv_size = struct.unpack_from('>b', self.fmap, offset+3)[0]
 
         kid = self.fmap[offset+4:offset+20]
 
@@ -577,7 +1084,7 @@ class sgpd_box(full_box):
 class senc_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.sample_count = i.send('>I')[0]
         self.samples = []
@@ -708,13 +1215,13 @@ class genc_box(full_box):
                     if sample_info_size > iv_size:
                         a = sample_offset + iv_size
                         b = a + 2
-                        sub_sample_count = struct.unpack('>h', self.fmap[a : b])[0]
+                        sub_sample_count = struct.unpack_from('>h', self.fmap, a)[0]
                         entry = entry + ' #sub samples:{0}'.format(sub_sample_count)
                         for s in range(sub_sample_count):
                             sub_sample_offset = sample_offset+iv_size+2+s*6
                             off = sub_sample_offset
-                            clear_data_size = struct.unpack('>H', self.fmap[off:off + 2])[0]
-                            encrypted_data_size = struct.unpack('>I', self.fmap[off + 2 : off + 6])[0]
+                            clear_data_size = struct.unpack_from('>H', self.fmap, off)[0]
+                            encrypted_data_size = struct.unpack_from('>I', self.fmap, off + 2)[0]
                             entry = entry + '\n - - sub sample:{0:03d} clear chunk:{1} encrypted chunk:{2}'\
                                 .format(s, clear_data_size, encrypted_data_size)
                 entries.append(entry + '\n')
@@ -729,7 +1236,7 @@ class SampleEntry(box):
 
     @property
     def data_reference_index(self):
-        return struct.unpack('>H', self.fmap[self.offset+14:self.offset+16])[0]
+        return struct.unpack_from('>H', self.fmap, self.offset+14)[0]
 
 
 def getDescriptorLen(i):
@@ -750,7 +1257,7 @@ class esds_box(box):
 
         self.cfg = ''
 
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
         vf = i.send('>I')[0]
         tag1 = i.send('>B')[0]
@@ -796,9 +1303,9 @@ class esds_box(box):
 class mp4a_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        self.channels = struct.unpack('>h', self.fmap[self.offset+24:self.offset+26])[0]
-        self.sample_size = struct.unpack('>h', self.fmap[self.offset+26:self.offset+28])[0]
-        self.sample_rate = struct.unpack('>I', self.fmap[self.offset+32:self.offset+36])[0] >> 16
+        self.channels = struct.unpack_from('>h', self.fmap, self.offset+24)[0]
+        self.sample_size = struct.unpack_from('>h', self.fmap, self.offset+26)[0]
+        self.sample_rate = struct.unpack_from('>I', self.fmap, self.offset+32)[0] >> 16
         self.decoration = 'index:{0} channels:{1} sample size:{2} sample rate:{3}'\
             .format(self.data_reference_index, self.channels, self.sample_size, self.sample_rate)
 
@@ -810,9 +1317,9 @@ class mp4a_box(SampleEntry):
 class ac_3_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        channels = struct.unpack('>h', self.fmap[self.offset+24:self.offset+26])[0]
-        sample_size = struct.unpack('>h', self.fmap[self.offset+26:self.offset+28])[0]
-        sample_rate = struct.unpack('>I', self.fmap[self.offset+32:self.offset+36])[0] >> 16
+        channels = struct.unpack_from('>h', self.fmap, self.offset+24)[0]
+        sample_size = struct.unpack_from('>h', self.fmap, self.offset+26)[0]
+        sample_rate = struct.unpack_from('>I', self.fmap, self.offset+32)[0] >> 16
         self.decoration = 'index:{0} channels:{1} sample size:{2} sample rate:{3}'\
             .format(self.data_reference_index, channels, sample_size, sample_rate)
 
@@ -824,9 +1331,9 @@ class ac_3_box(SampleEntry):
 class ec_3_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        channels = struct.unpack('>h', self.fmap[self.offset+24:self.offset+26])[0]
-        sample_size = struct.unpack('>h', self.fmap[self.offset+26:self.offset+28])[0]
-        sample_rate = struct.unpack('>I', self.fmap[self.offset+32:self.offset+36])[0] >> 16
+        channels = struct.unpack_from('>h', self.fmap, self.offset+24)[0]
+        sample_size = struct.unpack_from('>h', self.fmap, self.offset+26)[0]
+        sample_rate = struct.unpack_from('>I', self.fmap, self.offset+32)[0] >> 16
         self.decoration = 'index:{0} channels:{1} sample size:{2} sample rate:{3}'\
             .format(self.data_reference_index, channels, sample_size, sample_rate)
 
@@ -880,8 +1387,8 @@ class enca_box(mp4a_box):
 class mp4v_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        width = struct.unpack('>h', self.fmap[self.offset+32:self.offset+34])[0]
-        height = struct.unpack('>h', self.fmap[self.offset+34:self.offset+36])[0]
+        width = struct.unpack_from('>h', self.fmap, self.offset+32)[0]
+        height = struct.unpack_from('>h', self.fmap, self.offset+34)[0]
         self.decoration = 'index:{0} width:{1} height:{2}'\
             .format(self.data_reference_index, width, height)
 
@@ -891,13 +1398,13 @@ class avcx_box(SampleEntry):
         SampleEntry.__init__(self, *args)
         #print dump_hex(self.fmap[self.offset:self.offset+self.size])
 
-        self.width = struct.unpack('>h', self.fmap[self.offset+32:self.offset+34])[0]
-        self.height = struct.unpack('>h', self.fmap[self.offset+34:self.offset+36])[0]
-        res_hori = struct.unpack('>I', self.fmap[self.offset+36:self.offset+40])[0]
-        res_vert = struct.unpack('>I', self.fmap[self.offset+40:self.offset+44])[0]
-        frame_count = struct.unpack('>h', self.fmap[self.offset+48:self.offset+50])[0]
+        self.width = struct.unpack_from('>h', self.fmap, self.offset+32)[0]
+        self.height = struct.unpack_from('>h', self.fmap, self.offset+34)[0]
+        res_hori = struct.unpack_from('>I', self.fmap, self.offset+36)[0]
+        res_vert = struct.unpack_from('>I', self.fmap, self.offset+40)[0]
+        frame_count = struct.unpack_from('>h', self.fmap, self.offset+48)[0]
         compressor = str(self.fmap[self.offset+50:self.offset+82])
-        depth = struct.unpack('>h', self.fmap[self.offset+82:self.offset+84])[0]
+        depth = struct.unpack_from('>h', self.fmap, self.offset+82)[0]
 
         self.decoration = 'index:{0} width:{1} height:{2} hori_res:{3:x} vert_res:{4:x} compressor:{5} depth={6:x}'\
             .format(self.data_reference_index, self.width, self.height, res_hori, res_vert, compressor, depth)
@@ -937,7 +1444,7 @@ class encv_box(avc1_box):
 class avcC_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.version = i.send('>B')[0]
@@ -996,7 +1503,7 @@ def read_hex(reader, bytes):
 class hvcC_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.c = {}
@@ -1083,7 +1590,7 @@ class stsd_box(full_box):
 
     @property
     def entry_count(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     @property
     def childpos(self):
@@ -1111,8 +1618,8 @@ class schm_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
         type = self.fmap[self.offset+12:self.offset+16]
-        major_version = struct.unpack('>H', self.fmap[self.offset+16:self.offset+18])[0]
-        minor_version = struct.unpack('>H', self.fmap[self.offset+18:self.offset+20])[0]
+        major_version = struct.unpack_from('>H', self.fmap, self.offset+16)[0]
+        minor_version = struct.unpack_from('>H', self.fmap, self.offset+18)[0]
         self.decoration = 'type:{0} version:{1}.{2}'.format(type, major_version, minor_version)
 
 
@@ -1127,11 +1634,11 @@ class tenc_box(full_box):
 
     @property
     def is_encrypted(self):
-        return struct.unpack('>i', '\x00'+self.fmap[self.offset+12:self.offset+15])[0]
+        return unpack_uint24(self.fmap, self.offset+12)
 
     @property
     def iv_size(self):
-        return struct.unpack('>b', self.fmap[self.offset+15:self.offset+16])[0]
+        return struct.unpack_from('>b', self.fmap, self.offset+15)[0]
 
     @property
     def key_id(self):
@@ -1150,7 +1657,7 @@ class tenc_box(full_box):
 class tkhd_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.creation_time = i.send(self.version and '>Q' or '>I')[0]
         self.modification_time = i.send(self.version and '>Q' or '>I')[0]
@@ -1176,7 +1683,7 @@ class tkhd_box(full_box):
 class mdhd_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.creation_time = i.send(self.version and '>Q' or '>I')[0]
         self.modification_time = i.send(self.version and '>Q' or '>I')[0]
@@ -1197,7 +1704,7 @@ class mdhd_box(full_box):
 class hdlr_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         i.send('>I')[0] # pre_defined
         handler_type = ''
@@ -1240,7 +1747,7 @@ class moof_box(box):
 class trex_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size], '>I')
+        i = parse_generator(self.fmap, '>I', self.offset+12, self.offset+self.size)
         self.track_id = i.next()[0]
         self.default_sample_description_index = i.next()[0]
         self.default_sample_duration = i.next()[0]
@@ -1253,7 +1760,7 @@ class trex_box(full_box):
 class mfhd_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
-        self.seqno = struct.unpack('>i', self.fmap[self.offset+12:self.offset+16])[0]
+        self.seqno = struct.unpack_from('>i', self.fmap, self.offset+12)[0]
 
     def get_track_duration(self, track_id, timescale):
         truns = self.find('.traf.tfhd[track_id=%d]..trun' % track_id, return_first=False)
@@ -1310,28 +1817,28 @@ class tfhd_box(full_box):
         offset = 16
 
         if self.has_base_data_offset:
-            self.base_data_offset = struct.unpack('>Q', self.fmap[self.offset + offset : self.offset + offset + 8])[0]
+            self.base_data_offset = struct.unpack_from('>Q', self.fmap, self.offset + offset)[0]
             msg = msg + ' base_data_offset:%d' % self.base_data_offset
             offset = offset + 8
 
         if self.has_sample_description_index:
             self.sample_description_index = \
-                struct.unpack('>I', self.fmap[self.offset + offset : self.offset + offset + 4])[0]
+                struct.unpack_from('>I', self.fmap, self.offset + offset)[0]
             msg = msg + ' sample_description_index:%d' % self.sample_description_index
             offset = offset + 4
 
         if self.has_default_sample_duration:
-            self.default_sample_duration = struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            self.default_sample_duration = struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
             msg = msg + ' default_sample_duration:%d' % self.default_sample_duration
             offset = offset + 4
 
         if self.has_default_sample_size:
-            self.default_sample_size = struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            self.default_sample_size = struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
             msg = msg + ' default_sample_size:%d' % self.default_sample_size
             offset = offset + 4
 
         if self.has_default_sample_flags:
-            self.default_sample_flags = struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            self.default_sample_flags = struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
             msg = msg + ' default_sample_flags:%d' % self.default_sample_flags
             offset = offset + 4
 
@@ -1339,7 +1846,7 @@ class tfhd_box(full_box):
 
     @property
     def track_id(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     @property
     def decoration(self):
@@ -1358,32 +1865,29 @@ class trun_box(full_box):
         self.has_sample_composition_time_offset = self.flags & 0x0800
         self.first_cto = 0  # Can be used to calculate first presentation time
 
-        # self.sample_count = struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        # self.sample_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
         self.data_offset = 0
         self.first_sample_flags = 0
-        self.decoration = 'size:%d' % self.sample_count
+        self._decoration = 'size:%d' % self.sample_count
         # self.decorators = {'size':self.sample_count}
 
         self.sample_array_offset = 16
         if self.has_data_offset:
-            self.data_offset = struct.unpack('>i', \
-                self.fmap[self.offset+self.sample_array_offset:self.offset + self.sample_array_offset + 4])[0]
+            self.data_offset = struct.unpack_from('>i', self.fmap, self.offset+self.sample_array_offset)[0]
             self.sample_array_offset += 4
-            self.decoration += ' offset:%d' % self.data_offset
+            self._decoration += ' offset:%d' % self.data_offset
 
         if self.has_first_sample_flags:
-            self.first_sample_flags = struct.unpack('>I', \
-                self.fmap[self.offset+self.sample_array_offset:self.offset+self.sample_array_offset+4])[0]
+            self.first_sample_flags = struct.unpack_from('>I', self.fmap, self.offset+self.sample_array_offset)[0]
             self.sample_array_offset += 4
-            self.decoration += ' fs_flags:%d' % self.first_sample_flags
+            self._decoration += ' fs_flags:%d' % self.first_sample_flags
 
         self.sample_row_size = (self.has_sample_duration and 4) + \
             (self.has_sample_size and 4) + (self.has_sample_flags and 4) + \
             (self.has_sample_composition_time_offset and 4)
-        if self.has_sample_duration:
-            self.total_duration = sum([struct.unpack_from('>I', self.fmap, self.offset + self.sample_array_offset + i * self.sample_row_size)[0] for i in range(self.sample_count)])
-        else:
-            self.total_duration = self.parent.find('tfhd').default_sample_duration * self.sample_count
+        self._columns = None
+        self._decode_times = None
+        self._total_duration = None
         # Note. One may need to go all the way to trex to find the default
         # values
 
@@ -1394,7 +1898,16 @@ class trun_box(full_box):
                       (self.has_sample_flags and 4))
             self.first_cto = struct.unpack_from('>i', self.fmap, offset)[0]  # Interpret as signed (works for version 0 (unsigned) as well)
 
-        self.decoration += ' tdur:%d' % self.total_duration
+    @property
+    def decoration(self):
+        return self._decoration + ' tdur:%d' % self.total_duration
+
+    @property
+    def total_duration(self):
+        "Sum of the sample durations, computed on first use."
+        if self._total_duration is None:
+            self._total_duration = sum(self.durations)
+        return self._total_duration
 
     #@property
     #def has_data_offset(self):
@@ -1407,23 +1920,120 @@ class trun_box(full_box):
 
     @property
     def sample_count(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+
+    @property
+    def row_format(self):
+        "struct format of one sample row (without byte order)."
+        cto_format = self.version and 'i' or 'I'
+        return ''.join([self.has_sample_duration and 'I' or '',
+                        self.has_sample_size and 'I' or '',
+                        self.has_sample_flags and 'I' or '',
+                        self.has_sample_composition_time_offset and cto_format or ''])
+
+    def _decode_columns(self):
+        "Decode all sample rows with one bulk unpack into array columns."
+        count = self.sample_count
+        row_format = self.row_format
+        width = len(row_format)
+        values = ()
+        if width:
+            values = struct.unpack_from('>' + row_format * count, self.fmap,
+                                        self.offset + self.sample_array_offset)
+
+        tfhd = self.parent and self.parent.find('tfhd')
+        default_duration = tfhd and tfhd.default_sample_duration or 0
+        default_size = tfhd and tfhd.default_sample_size or 0
+        default_flags = tfhd and tfhd.default_sample_flags or 0
+
+        col = 0
+        columns = {}
+        for name, present, typecode, default in (
+                ('durations', self.has_sample_duration, 'I', default_duration),
+                ('sizes', self.has_sample_size, 'I', default_size),
+                ('sample_flags', self.has_sample_flags, 'I', default_flags),
+                ('composition_offsets', self.has_sample_composition_time_offset,
+                 self.version and 'i' or 'I', 0)):
+            if present:
+                columns[name] = array.array(typecode, values[col::width])
+                col += 1
+            else:
+                columns[name] = array.array(typecode, [default]) * count
+        if self.has_first_sample_flags and not self.has_sample_flags and count:
+            columns['sample_flags'][0] = self.first_sample_flags
+        self._columns = columns
+
+    def _column(self, name):
+        if self._columns is None:
+            self._decode_columns()
+        return self._columns[name]
+
+    @property
+    def durations(self):
+        "Sample durations (tfhd default if not in trun)."
+        return self._column('durations')
+
+    @property
+    def sizes(self):
+        "Sample sizes (tfhd default if not in trun)."
+        return self._column('sizes')
+
+    @property
+    def sample_flags(self):
+        "Sample flags (first_sample_flags or tfhd default if not in trun)."
+        return self._column('sample_flags')
+
+    @property
+    def composition_offsets(self):
+        "Sample composition time offsets (0 if not in trun)."
+        return self._column('composition_offsets')
+
+    @property
+    def decode_times(self):
+        "Sample decode times starting at the tfdt baseMediaDecodeTime."
+        if self._decode_times is None:
+            tfdt = self.parent and self.parent.find('tfdt')
+            time = tfdt and tfdt.decode_time or 0
+            self._decode_times = running_sums(time, self.durations, self.sample_count)
+        return self._decode_times
+
+    def numpy_columns(self):
+        """Return the sample columns as NumPy arrays.
+
+        Columns present in the trun are strided views into the box data
+        without any copying. Requires NumPy."""
+        if numpy is None:
+            raise ImportError('numpy is needed for numpy_columns()')
+        count = self.sample_count
+        cto_dtype = self.version and '>i4' or '>u4'
+        fields = [(name, dtype) for name, present, dtype in (
+            ('durations', self.has_sample_duration, '>u4'),
+            ('sizes', self.has_sample_size, '>u4'),
+            ('sample_flags', self.has_sample_flags, '>u4'),
+            ('composition_offsets', self.has_sample_composition_time_offset, cto_dtype))
+                  if present]
+        columns = {}
+        if fields:
+            rows = numpy.frombuffer(self.fmap, dtype=numpy.dtype(fields), count=count,
+                                    offset=self.offset + self.sample_array_offset)
+            for name, dtype in fields:
+                columns[name] = rows[name]
+        for name in ('durations', 'sizes', 'sample_flags', 'composition_offsets'):
+            if name not in columns:
+                columns[name] = numpy.array(self._column(name))
+        columns['decode_times'] = numpy.array(self.decode_times)
+        return columns
 
     def sample_entry(self, i):
         row = {}
-        offset = self.offset + self.sample_array_offset + i * self.sample_row_size
         if self.has_sample_duration:
-            row['duration'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-            offset += 4
+            row['duration'] = self.durations[i]
         if self.has_sample_size:
-            row['size'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-            offset += 4
+            row['size'] = self.sizes[i]
         if self.has_sample_flags:
-            row['flags'] = '0x%x' % struct.unpack('>I', self.fmap[offset:offset+4])[0]
-            offset += 4
+            row['flags'] = '0x%x' % self.sample_flags[i]
         if self.has_sample_composition_time_offset:
-            row['time_offset'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-            offset += 4
+            row['time_offset'] = self.composition_offsets[i]
 
         return row
 
@@ -1444,21 +2054,7 @@ class trun_box(full_box):
 
         if VERBOSE > 1:
             for i in range(self.sample_count):
-                row = {}
-                offset = self.offset + self.sample_array_offset + i * self.sample_row_size
-                if self.has_sample_duration:
-                    row['duration'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-                    offset += 4
-                if self.has_sample_size:
-                    row['size'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-                    offset += 4
-                if self.has_sample_flags:
-                    row['flags'] = '0x%x' % struct.unpack('>I', self.fmap[offset:offset+4])[0]
-                    offset += 4
-                if self.has_sample_composition_time_offset:
-                    row['time_offset'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-                    offset += 4
-
+                row = self.sample_entry(i)
                 ret += ' - ' + ' '.join(['%s:%s' % (k, v) for k, v in row.iteritems()]) + '\n'
 
         return ret
@@ -1472,23 +2068,23 @@ class tfra_box(full_box):
 
     @property
     def track_id(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     @property
     def length_size_of_traf_num(self):
-        return (struct.unpack('>B', self.fmap[self.offset+19])[0] & 0x30) >> 4
+        return (struct.unpack_from('>B', self.fmap, self.offset+19)[0] & 0x30) >> 4
 
     @property
     def length_size_of_trun_num(self):
-        return (struct.unpack('>B', self.fmap[self.offset+19])[0] & 0x0C) >> 2
+        return (struct.unpack_from('>B', self.fmap, self.offset+19)[0] & 0x0C) >> 2
 
     @property
     def length_size_of_sample_num(self):
-        return struct.unpack('>B', self.fmap[self.offset+19])[0] & 0x03
+        return struct.unpack_from('>B', self.fmap, self.offset+19)[0] & 0x03
 
     @property
     def number_of_entry(self):
-        return struct.unpack('>I', self.fmap[self.offset+20:self.offset+24])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+20)[0]
 
     @property
     def end_time(self):
@@ -1511,7 +2107,7 @@ class tfra_box(full_box):
         # sys.stderr.write(str(locals())+'\n')
         # sys.stderr.write('start:{row_start} len:{row_length}\n'.format(**locals()))
 
-        p = parse_generator(self.fmap[row_start:row_start+row_length], intro_format)
+        p = parse_generator(self.fmap, intro_format, row_start, row_start+row_length)
         time = p.next()[0]
         moof_offset = p.next()[0]
         traf = p.send(['>B', '>H', '>BH', '>I'][self.length_size_of_traf_num])[-1]
@@ -1531,7 +2127,7 @@ class tfra_box(full_box):
         self.random_access_moof_offset = []
         for i in range(self.number_of_entry):
             row_start = self.offset + 24 + (row_length * i)
-            time, moof_offset = struct.unpack(intro_format, self.fmap[row_start:row_start+intro_length])
+            time, moof_offset = struct.unpack_from(intro_format, self.fmap, row_start)
 
             if not self.random_access_moof_offset or self.random_access_moof_offset[-1] != moof_offset:
                 self.random_access_time.append(time)
@@ -1625,7 +2221,7 @@ class tfra_box(full_box):
 class mfro_box(full_box):
     @property
     def decoration(self):
-        return 'size:%d' % struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return 'size:%d' % struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
 
 class stbl_box(box):
@@ -1634,119 +2230,181 @@ class stbl_box(box):
 
 
 class stts_box(full_box):
+    """Decoding time to sample table.
+
+    The runs are kept as array columns together with the 1-based number
+    and decode time of the first sample of each run, so that lookups are
+    bisections over the runs. unroll() builds the old per-sample array."""
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'sample_count' : i.send('>I')[0], 'sample_delta' : i.send('>I')[0]})
-
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+        values = struct.unpack_from('>%dI' % (2 * self.entry_count), self.fmap, self.offset+16)
+        self.sample_counts = array.array('I', values[0::2])
+        self.sample_deltas = array.array('I', values[1::2])
+        self.first_samples = array.array('L')
+        self.first_times = array.array(UINT64_TYPECODE)
+        sample, time = 1, 0
+        for count, delta in zip(self.sample_counts, self.sample_deltas):
+            self.first_samples.append(sample)
+            self.first_times.append(time)
+            sample += count
+            time += count * delta
+        self.sample_count = sample - 1
+        self.total_duration = time
         self.array = []
-        self.unroll()
 
     def entry(self, index):
-        return self._entries[index]
+        return {'sample_count' : self.sample_counts[index], 'sample_delta' : self.sample_deltas[index]}
+
+    def _run(self, idx):
+        if not 0 < idx <= self.sample_count:
+            raise IndexError('sample %d not in stts (1..%d)' % (idx, self.sample_count))
+        return bisect.bisect_right(self.first_samples, idx) - 1
+
+    def time_for_sample(self, idx):
+        "Decode time of 1-based sample idx."
+        run = self._run(idx)
+        return self.first_times[run] + (idx - self.first_samples[run]) * self.sample_deltas[run]
+
+    def delta_for_sample(self, idx):
+        "Duration of 1-based sample idx."
+        return self.sample_deltas[self._run(idx)]
+
+    def sample_for_time(self, time):
+        """1-based number of the sample being decoded at time.
+
+        Times past the end give the last sample."""
+        run = bisect.bisect_right(self.first_times, time) - 1
+        if run < 0 or not self.sample_count:
+            raise IndexError('time %d not in stts' % time)
+        # runs of zero samples share first time with the next run
+        while not self.sample_counts[run]:
+            run -= 1
+        delta = self.sample_deltas[run]
+        offset = delta and (time - self.first_times[run]) // delta or 0
+        return self.first_samples[run] + min(offset, self.sample_counts[run] - 1)
 
     def unroll(self):
+        self.array = [{'time' : 0, 'delta' : 0}]
         time = 0
-        self.array.append({'time' : 0, 'delta' : 0})
-        for entry in self._entries:
-            delta = entry['sample_delta']
-            for i in range(entry['sample_count']):
+        for count, delta in zip(self.sample_counts, self.sample_deltas):
+            for i in range(count):
                 self.array.append({'time' : time, 'delta' : delta})
                 time = time + delta
 
 
 class ctts_box(full_box):
+    """Composition time to sample table, kept as runs like stts_box.
+
+    Offsets are signed for version 1."""
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'sample_count' : i.send('>I')[0], 'sample_offset' : i.send('>I')[0]})
-
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+        values = struct.unpack_from('>' + (self.version and 'Ii' or 'II') * self.entry_count,
+                                    self.fmap, self.offset+16)
+        self.sample_counts = array.array('I', values[0::2])
+        self.sample_offsets = array.array(self.version and 'i' or 'I', values[1::2])
+        self.first_samples = array.array('L')
+        sample = 1
+        for count in self.sample_counts:
+            self.first_samples.append(sample)
+            sample += count
+        self.sample_count = sample - 1
         self.array = []
-        self.unroll()
 
     def entry(self, index):
-        return self._entries[index]
+        return {'sample_count' : self.sample_counts[index], 'sample_offset' : self.sample_offsets[index]}
+
+    def cto_for_sample(self, idx):
+        "Composition time offset of 1-based sample idx."
+        if not 0 < idx <= self.sample_count:
+            raise IndexError('sample %d not in ctts (1..%d)' % (idx, self.sample_count))
+        return self.sample_offsets[bisect.bisect_right(self.first_samples, idx) - 1]
 
     def unroll(self):
-        self.array.append(0)
-        for entry in self._entries:
-            offset = entry['sample_offset']
-            for i in range(entry['sample_count']):
-                self.array.append(offset)
+        self.array = [0]
+        for count, offset in zip(self.sample_counts, self.sample_offsets):
+            self.array.extend([offset] * count)
 
 
 class stss_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'sample_number' : i.send('>I')[0]})
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+        self.sample_numbers = array.array('I', struct.unpack_from('>%dI' % self.entry_count,
+                                                                  self.fmap, self.offset+16))
 
     def entry(self, index):
-        return self._entries[index]
+        return {'sample_number' : self.sample_numbers[index]}
+
     def has_index(self, index):
-        for i in self._entries:
-            if i['sample_number'] == index:
-                return True
-        return False
+        i = bisect.bisect_left(self.sample_numbers, index)
+        return i < self.entry_count and self.sample_numbers[i] == index
 
 
 class stsz_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.sample_size = i.send('>I')[0]
-        self.sample_count = i.send('>I')[0]
+        self.sample_size, self.sample_count = struct.unpack_from('>II', self.fmap, self.offset+12)
         self.decoration = 'sample_size=' + str(self.sample_size) + ' sample_count=' + str(self.sample_count)
-        self._entries = []
+        self.entry_sizes = array.array('I')
         if self.sample_size == 0:
-            for j in range(self.sample_count):
-                self._entries.append({'entry_size' : i.send('>I')[0]})
+            self.entry_sizes.extend(struct.unpack_from('>%dI' % self.sample_count, self.fmap, self.offset+20))
 
     def entry(self, index):
-        return self._entries[index]
+        return {'entry_size' : self.entry_sizes[index]}
 
 
 class stsc_box(full_box):
+    """Sample to chunk table.
+
+    The runs are kept as array columns together with the 1-based number
+    of the first sample of each run. The last run covers all following
+    chunks. unroll() builds the old per-sample array."""
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
         self.decoration = 'entry_count=' + str(self.entry_count)
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'first_chunk' : i.send('>I')[0], \
-                                  'samples_per_chunk' : i.send('>I')[0], \
-                                  'sample_description_index' : i.send('>I')[0]})
-
+        values = struct.unpack_from('>%dI' % (3 * self.entry_count), self.fmap, self.offset+16)
+        self.first_chunks = array.array('I', values[0::3])
+        self.samples_per_chunks = array.array('I', values[1::3])
+        self.sample_description_indices = array.array('I', values[2::3])
+        self.first_samples = array.array('L')
+        sample = 1
+        for run, first_chunk in enumerate(self.first_chunks):
+            self.first_samples.append(sample)
+            if run + 1 < self.entry_count:
+                sample += (self.first_chunks[run + 1] - first_chunk) * self.samples_per_chunks[run]
         self.array = []
-        self.unroll()
 
     def entry(self, index):
-        return self._entries[index]
+        return {'first_chunk' : self.first_chunks[index],
+                'samples_per_chunk' : self.samples_per_chunks[index],
+                'sample_description_index' : self.sample_description_indices[index]}
+
+    def chunk_for_sample(self, idx):
+        "Return the 1-based chunk of 1-based sample idx and its 0-based index in it."
+        run = bisect.bisect_right(self.first_samples, idx) - 1
+        if idx < 1 or run < 0:
+            raise IndexError('sample %d not in stsc' % idx)
+        # runs of empty chunks share first sample with the next run
+        while run > 0 and not self.samples_per_chunks[run]:
+            run -= 1
+        chunk, index = divmod(idx - self.first_samples[run], self.samples_per_chunks[run])
+        return self.first_chunks[run] + chunk, index
+
+    def first_sample_of_chunk(self, chunk):
+        "Return the 1-based number of the first sample in 1-based chunk."
+        run = bisect.bisect_right(self.first_chunks, chunk) - 1
+        if chunk < 1 or run < 0:
+            raise IndexError('chunk %d not in stsc' % chunk)
+        return self.first_samples[run] + (chunk - self.first_chunks[run]) * self.samples_per_chunks[run]
 
     def unroll(self):
-        self.array.append([0, 0, 0])
+        self.array = [[0, 0, 0]]
         last_chunk = 0
         last_num_samples = 0
-        for entry in self._entries:
-            first_chunk = entry['first_chunk']
-            samples_per_chunk = entry['samples_per_chunk']
-            sample_description_index = entry['sample_description_index']
-
+        for first_chunk, samples_per_chunk in zip(self.first_chunks, self.samples_per_chunks):
             for i in range(last_chunk + 1, first_chunk):
                 for j in range(last_num_samples):
                     self.array.append([i, j, last_num_samples])
@@ -1760,6 +2418,8 @@ class stsc_box(full_box):
         #print self.array
 
     def get_unrolled(self, idx):
+        if not self.array:
+            return self.chunk_for_sample(idx)
         if idx < len(self.array):
             return self.array[idx][0], self.array[idx][1]
         else:
@@ -1778,26 +2438,30 @@ class stsc_box(full_box):
 
 
 class stco_box(full_box):
+    offset_format = 'I'
+    offset_typecode = 'I'
+
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
         self.decoration = 'entry_count=' + str(self.entry_count)
-        self._entries = []
-        for j in range(self.entry_count):
-            val = i.send('>I')
-            self._entries.append({'chunk_offset' : val[0]})
+        self.chunk_offsets = array.array(self.offset_typecode, struct.unpack_from(
+            '>%d%s' % (self.entry_count, self.offset_format), self.fmap, self.offset+16))
 
     def entry(self, index):
-        return self._entries[index]
+        return {'chunk_offset' : self.chunk_offsets[index]}
+
+
+class co64_box(stco_box):
+    offset_format = 'Q'
+    offset_typecode = UINT64_TYPECODE
 
 
 class ftyp_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
 
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.major_brand = i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0]
@@ -1818,7 +2482,7 @@ class styp_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
 
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.major_brand = i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0]
@@ -1838,7 +2502,7 @@ class styp_box(box):
 class tfma_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.entry_count = i.send('>I')[0]
@@ -1874,7 +2538,7 @@ class tfad_box(box):
 class sidx_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.reference_track_id = i.send('>I')[0]
@@ -1945,7 +2609,7 @@ class meta_box(box):
 class tfdt_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.decode_time = i.send(self.version and '>Q' or '>I')[0]
@@ -1958,7 +2622,7 @@ class tfdt_box(full_box):
 class afra_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         byte1 = i.send('>B')[0]
@@ -2024,7 +2688,7 @@ class afra_box(full_box):
 class asrt_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.quality_entry_count = i.send('>B')[0]
@@ -2067,7 +2731,7 @@ class asrt_box(full_box):
 class afrt_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.time_scale = i.send('>I')[0]
@@ -2135,7 +2799,7 @@ def read_string(parser):
 class abst_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         #print dump_hex(self.fmap[self.offset:self.offset+self.size])
@@ -2488,7 +3152,7 @@ class sdtp_box(full_box):
         msg = 'samples:{0}'.format(samples)
         base_offset = self.offset + 12
         for i in range(samples):
-            v = struct.unpack('>B', self.fmap[base_offset+i:base_offset + 1 + i])[0]
+            v = struct.unpack_from('>B', self.fmap, base_offset+i)[0]
             is_lead = (v & 0xc0) >> 6
             depends_on = (v & 0x30) >> 4
             dependend_on = (v & 0x0c) >> 2
@@ -2508,7 +3172,7 @@ class emsg_box(full_box):
         full_box.__init__(self, *args)
         #print dump_hex(self.fmap[self.offset:self.offset+self.size])
 
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.scheme_id_uri = read_string(i)
@@ -2540,5 +3204,13 @@ for key in keys:
         REGISTERED_BOXES[key] = globals()[key]
 
 
+class _BoxAtZero(object):
+    "Stand-in used to read where box classes start their children."
+    offset = 0
+
+CHILD_OFFSETS = dict((box_type, box_class_for(box_type).childpos.fget(_BoxAtZero))
+                     for box_type in CONTAINER_BOXES if box_type != 'root')
+
+
 if __name__ == '__main__':
     pass
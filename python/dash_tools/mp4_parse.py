@@ -44,9 +44,13 @@ import mp4
 
 def fetch(url, key=None):
     if not url.startswith('http'):
-        data = open(url, 'rb').read()
-        print 'read data of length: {0}'.format(len(data))
+        # Memory-map local files so that large files can be inspected
+        root = mp4.open(url)
+        root.key = key
+        print 'read data of length: {0}'.format(root.size)
         print '--'
+        print root.description()
+        root.close()
     else:
         url_parts = urlparse.urlparse(url)
         conn = httplib.HTTPConnection(url_parts.netloc)
@@ -65,11 +69,11 @@ def fetch(url, key=None):
         print 'fetched data of length: {0}'.format(len(data))
         print '--'
 
-    if data:
-        root = mp4.mp4(data, len(data), key=key) 
-        print root.description()
-    else:
-        print data
+        if data:
+            root = mp4.mp4(data, len(data), key=key) 
+            print root.description()
+        else:
+            print data
 
 def main():
     parser = optparse.OptionParser(usage='%prog <file path>|<http url>')
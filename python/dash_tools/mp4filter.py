@@ -32,29 +32,178 @@ The filter is streamlined for DASH or other content with one track per file.
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
-from structops import str_to_uint32, str_to_sint32, uint32_to_str, sint32_to_str
+import os
+from cStringIO import StringIO
+
+import mp4
+from backup_handler import apply_patches, make_journal
+from init_info import get_init_info
+from offset_fixup import PositionMap, align_boxes, fix_box, fix_moof
+from structops import str_to_uint32, uint32_to_str
 from structops import str_to_uint64, uint64_to_str
+from trun_codec import TrunCodec
+
+COPY_BLOCK_SIZE = 1024 * 1024
+PATCH_BLOCK_SIZE = 16
 
 
 def get_timescale(file_name=None, data=None):
-    "Get timescale from track box."
-    init_filter = InitFilter(file_name, data)
-    init_filter.filter_top_boxes()
-    return init_filter.get_track_timescale()
+    "Get timescale from track box, parsing each init segment once per process."
+    timescale = get_init_info(file_name, data).timescale
+    return timescale if timescale is not None else -1
+
+
+class OutputPlan(object):
+    """Filter output as a list of fragments.
+
+    A fragment is either an (offset, size) range of the input data or a string
+    of new bytes. Input ranges are only read when the plan is written, so
+    boxes that are not filtered, like mdat, never need to be held in memory."""
+
+    def __init__(self):
+        self.fragments = []
+        self.size = 0
+
+    def add_range(self, offset, size):
+        "Add a range of the input, merging it with a directly preceding range."
+        if size <= 0:
+            return
+        self.size += size
+        if self.fragments and isinstance(self.fragments[-1], tuple):
+            last_offset, last_size = self.fragments[-1]
+            if last_offset + last_size == offset:
+                self.fragments[-1] = (last_offset, last_size + size)
+                return
+        self.fragments.append((offset, size))
+
+    def add_bytes(self, data):
+        "Add new bytes."
+        if data:
+            self.size += len(data)
+            self.fragments.append(data)
+
+    def tostring(self, source):
+        "Return the output as a string, with ranges taken from source."
+        return "".join(source[f[0]:f[0] + f[1]] if isinstance(f, tuple) else f
+                       for f in self.fragments)
+
+    def patches(self, source):
+        """Return the plan as a list of (offset, bytes) patches of source.
+
+        This is only possible if every input range stays at its offset and
+        the size does not change, so that each run of new bytes replaces
+        input of the same size. Otherwise, None is returned. Only the parts
+        that differ from source, in blocks of PATCH_BLOCK_SIZE, are patched."""
+        if self.size != len(source):
+            return None
+        patches = []
+        pos = 0
+        for fragment in self.fragments:
+            if isinstance(fragment, tuple):
+                if fragment[0] != pos:
+                    return None
+                pos += fragment[1]
+                continue
+            original = source[pos:pos + len(fragment)]
+            patch_start = None
+            for start in range(0, len(fragment), PATCH_BLOCK_SIZE):
+                end = start + PATCH_BLOCK_SIZE
+                if fragment[start:end] != original[start:end]:
+                    if patch_start is None:
+                        patch_start = start
+                elif patch_start is not None:
+                    patches.append((pos + patch_start, fragment[patch_start:start]))
+                    patch_start = None
+            if patch_start is not None:
+                patches.append((pos + patch_start, fragment[patch_start:]))
+            pos += len(fragment)
+        return patches
+
+    def write(self, ofh, source):
+        """Write the output to the file object ofh, with ranges taken from source.
+
+        Small fragments are gathered into writes of up to COPY_BLOCK_SIZE and
+        large ranges are copied in blocks of that size."""
+        pending = []
+        pending_size = 0
+        for fragment in self.fragments:
+            if isinstance(fragment, tuple):
+                offset, size = fragment
+                if pending_size + size <= COPY_BLOCK_SIZE:
+                    pending.append(source[offset:offset + size])
+                    pending_size += size
+                    continue
+                if pending:
+                    ofh.write("".join(pending))
+                    pending = []
+                    pending_size = 0
+                end = offset + size
+                while offset < end:
+                    ofh.write(source[offset:min(offset + COPY_BLOCK_SIZE, end)])
+                    offset += COPY_BLOCK_SIZE
+            else:
+                pending.append(fragment)
+                pending_size += len(fragment)
+                if pending_size >= COPY_BLOCK_SIZE:
+                    ofh.write("".join(pending))
+                    pending = []
+                    pending_size = 0
+        if pending:
+            ofh.write("".join(pending))
+
+
+class HandlerNode(object):
+    """Node of the tree of box paths that have handlers.
+
+    Built from a box_handlers dict of {"moof.traf.tfdt": "method_name"}.
+    A node either has a handler, or children with handlers further down."""
+
+    def __init__(self, box_handlers=None):
+        self.handler = None
+        self.children = {}
+        for path, handler in (box_handlers or {}).items():
+            node = self
+            for box_type in path.split("."):
+                node = node.children.setdefault(box_type, HandlerNode())
+            node.handler = handler
+
+
+HANDLER_TREES = {}  # class: HandlerNode
 
 
 class MP4Filter(object):
     """Base class for filters.
 
-    Call filter_top_boxes() to get a filtered version of the file."""
+    Call filter_top_boxes() to get a filtered version of the file, or
+    filter_to_file() to write it without building it in memory.
+    An input file is memory-mapped, not read. filter_stream() instead reads
+    from a file object, and needs neither file_name nor data.
+    Edits that keep all box sizes can be applied to the input file with
+    patch_file().
+
+    A subclass either overrides filterbox(), or lists the methods that
+    handle box paths in box_handlers. A handler gets the box data and returns
+    the new box data ("" to drop it). Only the containers on the way to a
+    handler are descended into; other boxes are passed on unparsed, and
+    container sizes are updated if the contents change size.
+
+    Filters leave trun, saio, tfhd and sidx offsets at their input values.
+    If boxes change size, these are rewritten for the output with
+    offset_fixup, unless fix_offsets is False. filter_stream() can only fix
+    moof boxes, since a sidx is written before the boxes it references."""
+
+    box_handlers = {}
+    fix_offsets = True
 
     def __init__(self, file_name=None, data=None):
+        self.file_name = file_name
         if file_name is not None:
-            self.data = open(file_name, "rb").read()
+            self.data = mp4.map_file(file_name)
         else:
             self.data = data
         self.output = ""
-        self.relevant_boxes = [] # Boxes at top-level to filter_top_boxes
+        # Boxes at top-level to filter_top_boxes
+        self.relevant_boxes = sorted(self.handler_tree().children)
         self.top_level_boxes = []  # List of top_level boxes (size, type)
         #print "MP4Filter with %s" % file_name
 
@@ -65,27 +214,252 @@ class MP4Filter(object):
         box_type = data[4:8]
         return (size, box_type)
 
-    def filter_top_boxes(self):
-        "Top level box parsing. The lower-level parsing is done in self.filterbox(). "
-        self.output = ""
-        pos = 0
-        while pos < len(self.data):
+    def filter_plan(self):
+        """Top level box parsing into an OutputPlan.
+
+        Only the boxes in self.relevant_boxes are read and passed to
+        self.filterbox(). The others become input ranges of the plan.
+        If any box changed size, offsets into the file are fixed with
+        fix_plan_offsets()."""
+        boxes = []
+        data_size = len(self.data)
+        pos = out_size = 0
+        while pos < data_size:
             size, box_type = self.check_box(self.data[pos:pos + 8])
+            if size == 0:  # Box extends to end of file
+                size = data_size - pos
+            elif size == 1:  # Extended size
+                size = str_to_uint64(self.data[pos + 8:pos + 16])
+            if size < 8:
+                print "WARNING: bad box size %d at %d, copying the rest" % (size, pos)
+                boxes.append([pos, data_size - pos, None, None])
+                break
             self.top_level_boxes.append((size, box_type))
-            box_data = self.data[pos:pos+size]
             if box_type in self.relevant_boxes:
-                self.output += self.filterbox(box_type, box_data,
-                                              len(self.output))
+                output = self.filterbox(box_type, self.data[pos:pos + size], out_size)
+                out_size += len(output)
             else:
-                self.output += box_data
+                output = None
+                out_size += size
+            boxes.append([pos, size, box_type, output])
             pos += size
+        if self.fix_offsets and any(output is not None and len(output) != size
+                                    for _, size, _, output in boxes):
+            self.fix_plan_offsets(boxes)
+        plan = OutputPlan()
+        for pos, size, _, output in boxes:
+            if output is None:
+                plan.add_range(pos, size)
+            else:
+                plan.add_bytes(output)
+        return plan
+
+    def fix_plan_offsets(self, boxes):
+        """Fix the offset fields of moof and sidx boxes after size changes.
+
+        boxes is a list of [offset, size, box_type, output] for the top-level
+        boxes, where output is None for boxes copied as they are. Untouched
+        moof and sidx boxes get new output only if their fields change."""
+        position_map = PositionMap()
+        out_pos = 0
+        for pos, size, _, output in boxes:
+            if output is None:
+                position_map.add(pos, size, out_pos, size)
+                out_pos += size
+            else:
+                align_boxes(position_map, self.data[pos:pos + size], pos, output, out_pos)
+                out_pos += len(output)
+        out_pos = 0
+        for box in boxes:
+            pos, size, box_type, output = box
+            data = output if output is not None else self.data[pos:pos + size]
+            if data:
+                fixed = fix_box(box_type, data, pos, out_pos, position_map)
+                if fixed is not None and fixed != data:
+                    box[3] = fixed
+            out_pos += len(data)
+
+    def filter_top_boxes(self):
+        "Top level box parsing. The lower-level parsing is done in self.filterbox(). "
+        self.output = self.filter_plan().tostring(self.data)
         self.finalize()
         return self.output
 
+    def filter_to_file(self, file_name):
+        """Filter and write the output to file_name. Return the output size.
+
+        The output goes to a temporary file that is renamed, so file_name may
+        be the input file. A subclass that overrides finalize() works on
+        self.output, so its output is built in memory first."""
+        tmp_name = file_name + ".tmp"
+        with open(tmp_name, "wb") as ofh:
+            if not self.finalizes_output():
+                plan = self.filter_plan()
+                plan.write(ofh, self.data)
+                size = plan.size
+            else:
+                self.filter_top_boxes()
+                ofh.write(self.output)
+                size = len(self.output)
+        os.rename(tmp_name, file_name)
+        return size
+
+    def filter_patches(self):
+        """Return the filter output as (offset, bytes) patches of the input.
+
+        None is returned if the output has boxes of other sizes or at other
+        positions than the input, or if the class overrides finalize()."""
+        if self.finalizes_output():
+            return None
+        return self.filter_plan().patches(self.data)
+
+    def patch_file(self, journal=False):
+        """Apply a size-preserving edit to the input file in place.
+
+        With journal set, the overwritten bytes are first saved with
+        backup_handler.make_journal(), so the edit can be rolled back with
+        restore_from_journal(). Return the list of patches, or None if the
+        edit is not size-preserving and the file has been left untouched."""
+        patches = self.filter_patches()
+        if patches:
+            if journal:
+                make_journal(self.file_name, patches)
+            apply_patches(self.file_name, patches)
+        return patches
+
+    def filter_stream(self, ifh, ofh):
+        """Filter the file object ifh into the file object ofh. Return the output size.
+
+        Only the top-level box headers and the boxes in self.relevant_boxes
+        are read as a whole. Other boxes are copied in blocks of
+        COPY_BLOCK_SIZE, so memory use does not grow with mdat sizes. ifh
+        does not need to be seekable. A subclass that overrides finalize()
+        gets its output collected in self.output and written at the end."""
+        if self.finalizes_output():
+            collector = StringIO()
+            self._filter_stream(ifh, collector)
+            self.output = collector.getvalue()
+            self.finalize()
+            ofh.write(self.output)
+            return len(self.output)
+        return self._filter_stream(ifh, ofh)
+
+    def _filter_stream(self, ifh, ofh):
+        "Filter box by box from ifh to ofh, and return the number of bytes written."
+        position_map = PositionMap()
+        in_pos = out_size = 0
+        while True:
+            header = ifh.read(8)
+            if not header:
+                break
+            if len(header) < 8:
+                print "WARNING: %d bytes after last box" % len(header)
+                ofh.write(header)
+                out_size += len(header)
+                break
+            size, box_type = self.check_box(header)
+            if size == 1:  # Extended size
+                header += ifh.read(8)
+                size = str_to_uint64(header[8:16])
+            self.top_level_boxes.append((size, box_type))
+            if box_type in self.relevant_boxes:
+                if size == 0:  # Box extends to end of file
+                    box_data = header + ifh.read()
+                else:
+                    box_data = header + ifh.read(size - len(header))
+                box_output = self.filterbox(box_type, box_data, out_size)
+                align_boxes(position_map, box_data, in_pos, box_output, out_size)
+                if self.fix_offsets and box_type == 'moof' and position_map.moved:
+                    box_output = fix_moof(box_output, in_pos, out_size, position_map)
+                ofh.write(box_output)
+                in_pos += len(box_data)
+                out_size += len(box_output)
+                continue
+            position_map.add(in_pos, size, out_size, size)
+            in_pos += size
+            ofh.write(header)
+            out_size += len(header)
+            remaining = size - len(header) if size != 0 else None
+            while remaining is None or remaining > 0:
+                block_size = COPY_BLOCK_SIZE if remaining is None else min(remaining,
+                                                                          COPY_BLOCK_SIZE)
+                block = ifh.read(block_size)
+                if not block:
+                    if remaining:
+                        print "WARNING: %s box truncated by %d bytes" % (box_type, remaining)
+                    break
+                ofh.write(block)
+                out_size += len(block)
+                if remaining is not None:
+                    remaining -= len(block)
+        return out_size
+
+    def finalizes_output(self):
+        "Return True if the class overrides finalize(), which needs self.output."
+        return type(self).finalize.im_func is not MP4Filter.finalize.im_func
+
     def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively. Override in subclass."
+        "Filter box or tree of boxes recursively with box_handlers, or override in subclass."
+        #pylint: disable=unused-argument
+        node = self.handler_tree()
+        for parent_type in path.split(".") if path else ():
+            node = node.children.get(parent_type)
+            if node is None:
+                return data
+        node = node.children.get(box_type)
+        if node is None:
+            return data
+        return self.filter_node(node, data)
+
+    @classmethod
+    def handler_tree(cls):
+        "Return the HandlerNode tree of the class box_handlers, built once per class."
+        tree = HANDLER_TREES.get(cls)
+        if tree is None:
+            tree = HANDLER_TREES[cls] = HandlerNode(cls.box_handlers)
+        return tree
+
+    def filter_node(self, node, data):
+        "Filter box data at node. Children without handlers below are copied as they are."
+        if node.handler is not None:
+            return getattr(self, node.handler)(data)
+        size, container_type = self.check_box(data)
+        header_size = 16 if size == 1 else 8
+        parts = [data[:header_size]]
+        changed = False
+        pos = header_size
+        while pos < len(data):
+            size, box_type = self.check_box(data[pos:pos + 8])
+            if size == 1:
+                size = str_to_uint64(data[pos + 8:pos + 16])
+            elif size == 0:
+                size = len(data) - pos
+            child = node.children.get(box_type)
+            if child is None:
+                parts.append(data[pos:pos + size])
+            else:
+                child_output = self.filter_node(child, data[pos:pos + size])
+                changed |= len(child_output) != size
+                parts.append(child_output)
+            pos += size
+        if changed:
+            new_size = sum(len(part) for part in parts)
+            if header_size == 8:
+                parts[0] = uint32_to_str(new_size) + container_type
+            else:
+                parts[0] = data[:8] + uint64_to_str(new_size)
+        return "".join(parts)
+
+    def drop_box(self, data):
+        "Handler that removes the box."
         #pylint: disable=unused-argument,no-self-use
-        return data
+        return ""
+
+    def remove_box(self, data):
+        "Handler that removes the box and says so."
+        #pylint: disable=no-self-use
+        print "Removing %s box" % data[4:8]
+        return ""
 
     def finalize(self):
         "Hook to do final adjustments."
@@ -95,36 +469,23 @@ class MP4Filter(object):
 class InitFilter(MP4Filter):
     "Filter init file and extract track timescale."
 
+    box_handlers = {"moov.trak.mdia.mdhd": "process_mdhd",
+                    "moov.trak.mdia.hdlr": "process_hdlr"}
+
     def __init__(self, file_name=None, data=None):
         MP4Filter.__init__(self, file_name, data)
-        self.relevant_boxes = ['moov']
         self.track_timescale = -1
         self.handler_type = None
 
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("moov", "moov.trak", "moov.trak.mdia"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size], file_pos + len(output), path)
-                pos += size
-        elif path == "moov.trak.mdia.mdhd": # Find timescale
-            self.track_timescale = str_to_uint32(data[20:24])
-            #print "Found track_timescale=%d" % self.track_timescale
-            output = data
-        elif path == "moov.trak.mdia.hdlr": # Find track type
-            self.handler_type = data[16:20]
-            output = data
-        else:
-            output = data
-        return output
+    def process_mdhd(self, data):
+        "Find timescale."
+        self.track_timescale = str_to_uint32(data[20:24])
+        return data
+
+    def process_hdlr(self, data):
+        "Find track type."
+        self.handler_type = data[16:20]
+        return data
 
     def get_track_timescale(self):
         "Return track timescale."
@@ -138,151 +499,65 @@ class InitFilter(MP4Filter):
 class InitLiveFilter(MP4Filter):
     "Process an init file and set the durations to maxint."
 
+    box_handlers = {"moov.mvhd": "process_mvhd",
+                    "moov.trak.tkhd": "process_tkhd",
+                    "moov.trak.mdia.mdhd": "process_mdhd"}
+
     def __init__(self, file_name=None, data=None):
         MP4Filter.__init__(self, file_name, data)
-        self.relevant_boxes = ['moov']
         self.movie_timescale = -1
 
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        #pylint: disable=too-many-branches
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("moov", "moov.trak", "moov.trak.mdia"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos + size], file_pos + len(output), path)
-                pos += size
-        elif path == "moov.mvhd": # Set movie duration
-            version = ord(data[8])
-            if version == 1:
-                self.movie_timescale = str_to_uint32(data[28:32])
-                output += data[:32]
-                output += '\xff'*8 # duration
-                output += data[40:]
-            else: # version = 0
-                self.movie_timescale = str_to_uint32(data[20:24])
-                output += data[:24]
-                output += '\xff'*4 # duration
-                output += data[28:]
-        elif path == "moov.trak.tkhd": # Set trak duration
-            version = ord(data[8])
-            if version == 1:
-                output += data[:36]
-                output += '\xff'*8 # duration
-                output += data[44:]
-            else: # version = 0
-                output += data[:28]
-                output += '\xff'*4 # duration
-                output += data[32:]
-        elif path == "moov.trak.mdia.mdhd": # Set media duration
-            version = ord(data[8])
-            if version == 1:
-                output += data[:32]
-                output += '\xff'*8 # duration
-                output += data[40:]
-            else: # version = 0
-                output += data[:24]
-                output += '\xff'*4 # duration
-                output += data[28:]
-        else:
-            output = data
-        return output
+    def process_mvhd(self, data):
+        "Set movie duration."
+        version = ord(data[8])
+        if version == 1:
+            self.movie_timescale = str_to_uint32(data[28:32])
+            return data[:32] + '\xff'*8 + data[40:]
+        else: # version = 0
+            self.movie_timescale = str_to_uint32(data[20:24])
+            return data[:24] + '\xff'*4 + data[28:]
+
+    def process_tkhd(self, data):
+        "Set trak duration."
+        #pylint: disable=no-self-use
+        version = ord(data[8])
+        if version == 1:
+            return data[:36] + '\xff'*8 + data[44:]
+        else: # version = 0
+            return data[:28] + '\xff'*4 + data[32:]
+
+    def process_mdhd(self, data):
+        "Set media duration."
+        #pylint: disable=no-self-use
+        version = ord(data[8])
+        if version == 1:
+            return data[:32] + '\xff'*8 + data[40:]
+        else: # version = 0
+            return data[:24] + '\xff'*4 + data[28:]
 
 
 class SidxFilter(MP4Filter):
     "Remove sidx from file."
 
-    def __init__(self, file_name=None, data=None):
-        MP4Filter.__init__(self, file_name, data)
-        self.relevant_boxes = ['sidx']
-
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Remove sidx, leave other boxes."
-        if box_type == "sidx":
-            output = ""
-        else:
-            output = data
-        return output
+    box_handlers = {"sidx": "drop_box"}
 
 
 class ShiftCompositionTimeOffset(MP4Filter):
     "Shift composition_time_offest in trun boxes to start at 0."
 
+    box_handlers = {"moof.traf.trun": "process_trun"}
+
     def __init__(self, file_name):
         MP4Filter.__init__(self, file_name)
-        self.relevant_boxes = ["moof"]
-
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("moof", "moof.traf"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size], file_pos + len(output), path)
-                pos += size
-        elif path == "moof.traf.trun": # Down at trun level
-            output = self.process_trun(data, output)
-        else:
-            output = data
-        return output
 
-    def process_trun(self, data, output):
+    def process_trun(self, data):
         """Adjust composition_time_offset to start at 0 if present."""
-        version_and_flags = str_to_uint32(data[8:12])
-        version = version_and_flags >> 24
-        flags = version_and_flags & 0x00ffffff
-
-        cto_present = flags & 0x000800   # composition_time_offset_present
-
-        if not cto_present:
+        #pylint: disable=no-self-use
+        trun = TrunCodec(data)
+        if trun.composition_offsets is None:
             return data   # Nothing to do
-
-        output = data[:8] + '\x01' + data[9:12]  # Full header version 1
-
-        sample_count = str_to_uint32(data[12:16])
-        offset = 16
-
-        if flags & 0x000001:  # data-offset-present
-            offset += 4
-
-        if flags & 0x000004:  # first-sample-flags-present
-            offset += 4
-
-        output += data[12:offset]
-        cto_shift = None
-
-        optional_bytes_before_cto = 0
-        if flags & 0x000100:  # sample-duration-present
-            optional_bytes_before_cto += 4
-        if flags & 0x000200:  # sample-size-present
-            optional_bytes_before_cto += 4
-        if flags & 0x000400:  # sample-flags-present
-            optional_bytes_before_cto += 4
-
-        for i in range(sample_count):
-            output += data[offset:offset + optional_bytes_before_cto]
-            offset += optional_bytes_before_cto
-
-            cto = str_to_sint32(data[offset:offset + 4])
-            if i == 0:
-                cto_shift = -cto
-            cto += cto_shift
-            output += sint32_to_str(cto)
-            offset += 4
-
-        return output
+        trun.shift_cto()
+        return trun.encode()
 
 
 class TfdtFilter(MP4Filter):
@@ -291,66 +566,82 @@ class TfdtFilter(MP4Filter):
     In addition, set sequence number if provided and drop sidx box.
     """
 
+    box_handlers = {"moof.mfhd": "process_mfhd",
+                    "moof.traf.tfdt": "process_tfdt",
+                    "sidx": "drop_box"}
+
     def __init__(self, file_name, offset=None, seq_nr=None):
         MP4Filter.__init__(self, file_name)
         self.offset = offset
         self.seq_nr = seq_nr
-        self.relevant_boxes = ["moof", "sidx"]
         self.tfdt = None
 
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("moof", "moof.traf"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size], file_pos + len(output), path)
-                pos += size
-        elif path == "moof.traf.tfdt": # Down at tfdt level
-            output = self.process_tfdt(data, output)
-        elif path == "moof.mfhd": # Down at mfhd
-            output = self.process_mfhd(data, output)
-        elif path == "sidx":
-            pass # Just drop sidx
-        else:
-            output = data
-        return output
-
-    def process_tfdt(self, data, output):
+    def process_tfdt(self, data):
         """Adjust time of tfdt if offset set."""
         version = ord(data[8])
         if version == 0: # 32-bit baseMediaDecodeTime
             tfdt = str_to_uint32(data[12:16])
             if self.offset != None:
                 tfdt += self.offset
-                output += data[:12] + uint32_to_str(tfdt) + data[16:]
+                output = data[:12] + uint32_to_str(tfdt) + data[16:]
             else:
-                output += data
+                output = data
         else:
-            output = data[:12]
             tfdt = str_to_uint64(data[12:20])
             if self.offset != None:
                 tfdt += self.offset
-                output += uint64_to_str(tfdt)
+                output = data[:12] + uint64_to_str(tfdt)
             else:
-                output += data
+                output = data
         self.tfdt = tfdt
         return output
 
-    def process_mfhd(self, data, output):
+    def process_mfhd(self, data):
         "Set the sequence number in mfhd."
         if self.seq_nr is not None:
-            output += data[:12] + uint32_to_str(self.seq_nr)
-        else:
-            output += data
-        return output
+            return data[:12] + uint32_to_str(self.seq_nr)
+        return data
 
     def get_tfdt_value(self):
         "Return tfdt value."
         return self.tfdt
+
+
+class FilterPipeline(MP4Filter):
+    """Run several filters in one pass over a file.
+
+    Each top-level box is passed through the filterbox() of every stage that
+    has it in its relevant_boxes, in stage order, and the result is written
+    once. A stage that drops a box ends the chain for that box. The stages
+    are created without file_name and data, since the pipeline reads the
+    input."""
+
+    def __init__(self, stages, file_name=None, data=None):
+        MP4Filter.__init__(self, file_name, data)
+        self.stages = list(stages)
+        self.relevant_boxes = []
+        for stage in self.stages:
+            for box_type in stage.relevant_boxes:
+                if box_type not in self.relevant_boxes:
+                    self.relevant_boxes.append(box_type)
+
+    def filterbox(self, box_type, data, file_pos, path=""):
+        "Filter a top-level box through all interested stages."
+        for stage in self.stages:
+            if box_type in stage.relevant_boxes:
+                data = stage.filterbox(box_type, data, file_pos, path)
+                if not data:
+                    break
+        return data
+
+    def finalizes_output(self):
+        "Return True if any stage overrides finalize()."
+        return any(stage.finalizes_output() for stage in self.stages)
+
+    def finalize(self):
+        "Let the stages that override finalize() adjust the output in order."
+        for stage in self.stages:
+            if stage.finalizes_output():
+                stage.output = self.output
+                stage.finalize()
+                self.output = stage.output
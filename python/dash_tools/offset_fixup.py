@@ -0,0 +1,234 @@
+"""Fix offsets into the file after size-changing filter edits.
+
+When a filter changes the size of a box, everything after it moves. The
+size fields of the ancestor boxes are rewritten by MP4Filter.filter_node(),
+but fields that point to other parts of the file are not. A PositionMap
+maps input positions to output positions, and the fix functions rewrite
+from it
+
+ * trun data_offset and tfhd base_data_offset,
+ * saio offsets,
+ * sidx first_offset and referenced_size.
+
+Only the box headers and these fields are parsed, and only moof and sidx
+boxes are read, so untouched data is neither parsed nor re-serialized.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+from bisect import bisect_right
+
+from structops import str_to_uint32, uint32_to_str
+from structops import str_to_sint32, sint32_to_str
+from structops import str_to_uint64, uint64_to_str
+
+ALIGNED_CONTAINERS = ('moof', 'traf')
+
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_DEFAULT_BASE_IS_MOOF = 0x020000
+TRUN_DATA_OFFSET = 0x000001
+SAIO_AUX_INFO_TYPE = 0x000001
+
+
+class PositionMap(object):
+    """Map positions in the input to positions in the output.
+
+    The map is a list of segments (old_start, old_size, new_start, new_size),
+    added in input order. A position inside an edited segment keeps its
+    offset from the segment start, limited to the new size, so the start of
+    a shortened mdat payload still maps to the start of the new payload.
+    A position in a gap between segments maps to the start of the next
+    segment, and positions after the last segment move with its end.
+    moved is set once a segment has moved or changed size."""
+
+    def __init__(self):
+        self.old_starts = []
+        self.segments = []
+        self.moved = False
+
+    def add(self, old_start, old_size, new_start, new_size):
+        "Add a segment. Segments must be added in increasing old_start order."
+        self.old_starts.append(old_start)
+        self.segments.append((old_start, old_size, new_start, new_size))
+        self.moved |= old_start != new_start or old_size != new_size
+
+    def map(self, pos):
+        "Return the output position of the input position pos."
+        index = bisect_right(self.old_starts, pos) - 1
+        if index < 0:
+            if self.segments:
+                return self.segments[0][2]
+            return pos
+        old_start, old_size, new_start, new_size = self.segments[index]
+        if pos < old_start + old_size:
+            return new_start + min(pos - old_start, new_size)
+        if index + 1 < len(self.segments):  # In a gap
+            return self.segments[index + 1][2]
+        return new_start + new_size + pos - old_start - old_size
+
+
+def child_boxes(data, start, end):
+    "Return (box_type, pos, size) of the boxes in data[start:end]."
+    children = []
+    pos = start
+    while pos + 8 <= end:
+        size = str_to_uint32(data[pos:pos + 4])
+        if size == 1:
+            size = str_to_uint64(data[pos + 8:pos + 16])
+        elif size == 0:
+            size = end - pos
+        if size < 8:
+            break
+        children.append((data[pos + 4:pos + 8], pos, size))
+        pos += size
+    return children
+
+
+def align_boxes(position_map, old_data, old_pos, new_data, new_pos):
+    """Add segments for the box old_data at old_pos, rewritten to new_data at new_pos.
+
+    moof and traf boxes are matched child by child on box type, so that
+    positions inside an unchanged child, like the senc data that saio points
+    to, map exactly. A child that has no match was dropped by the filter."""
+    box_type = old_data[4:8]
+    if box_type not in ALIGNED_CONTAINERS or new_data[4:8] != box_type:
+        position_map.add(old_pos, len(old_data), new_pos, len(new_data))
+        return
+    header_size = 16 if str_to_uint32(old_data[:4]) == 1 else 8
+    position_map.add(old_pos, header_size, new_pos, header_size)
+    new_header_size = 16 if str_to_uint32(new_data[:4]) == 1 else 8
+    new_children = child_boxes(new_data, new_header_size, len(new_data))
+    index = 0
+    for child_type, pos, size in child_boxes(old_data, header_size, len(old_data)):
+        if index < len(new_children) and new_children[index][0] == child_type:
+            _, new_child_pos, new_size = new_children[index]
+            align_boxes(position_map, old_data[pos:pos + size], old_pos + pos,
+                        new_data[new_child_pos:new_child_pos + new_size],
+                        new_pos + new_child_pos)
+            index += 1
+        else:
+            if index < len(new_children):
+                next_pos = new_children[index][1]
+            else:
+                next_pos = len(new_data)
+            position_map.add(old_pos + pos, size, new_pos + next_pos, 0)
+
+
+def fix_moof(data, old_pos, new_pos, position_map):
+    """Return the moof data with offsets rewritten for its move from old_pos to new_pos.
+
+    The offset fields in data are input values. trun data offsets and saio
+    offsets are relative to the tfhd base_data_offset if present, and to the
+    start of the moof otherwise."""
+    output = bytearray(data)
+    moof_header = 16 if str_to_uint32(data[:4]) == 1 else 8
+    for box_type, traf_pos, traf_size in child_boxes(data, moof_header, len(data)):
+        if box_type != 'traf':
+            continue
+        old_base, new_base = old_pos, new_pos
+        for child_type, pos, size in child_boxes(data, traf_pos + 8, traf_pos + traf_size):
+            flags = str_to_uint32(data[pos + 8:pos + 12]) & 0xffffff
+            if child_type == 'tfhd' and flags & TFHD_BASE_DATA_OFFSET:
+                old_base = str_to_uint64(data[pos + 16:pos + 24])
+                new_base = position_map.map(old_base)
+                output[pos + 16:pos + 24] = uint64_to_str(new_base)
+            elif child_type == 'trun' and flags & TRUN_DATA_OFFSET:
+                data_offset = str_to_sint32(data[pos + 16:pos + 20])
+                data_offset = position_map.map(old_base + data_offset) - new_base
+                output[pos + 16:pos + 20] = sint32_to_str(data_offset)
+            elif child_type == 'saio':
+                _fix_saio(data, output, pos, old_base, new_base, position_map)
+    return str(output)
+
+
+def _fix_saio(data, output, pos, old_base, new_base, position_map):
+    "Rewrite the offsets of the saio box at pos in output."
+    version = ord(data[pos + 8])
+    flags = str_to_uint32(data[pos + 8:pos + 12]) & 0xffffff
+    pos += 12
+    if flags & SAIO_AUX_INFO_TYPE:
+        pos += 8
+    entry_count = str_to_uint32(data[pos:pos + 4])
+    pos += 4
+    for _ in range(entry_count):
+        if version == 0:
+            offset = str_to_uint32(data[pos:pos + 4])
+            offset = position_map.map(old_base + offset) - new_base
+            output[pos:pos + 4] = uint32_to_str(offset)
+            pos += 4
+        else:
+            offset = str_to_uint64(data[pos:pos + 8])
+            offset = position_map.map(old_base + offset) - new_base
+            output[pos:pos + 8] = uint64_to_str(offset)
+            pos += 8
+
+
+def fix_sidx(data, old_pos, new_pos, position_map):
+    """Return the sidx data with first_offset and referenced sizes rewritten.
+
+    The references are consecutive ranges of the input, starting first_offset
+    bytes after the end of the sidx box. Each range gets the size of its
+    mapped output range."""
+    output = bytearray(data)
+    version = ord(data[8])
+    if version == 0:
+        first_offset = str_to_uint32(data[24:28])
+        pos = 28
+    else:
+        first_offset = str_to_uint64(data[28:36])
+        pos = 36
+    old_end = old_pos + len(data)
+    new_end = new_pos + len(data)
+    ref_start = old_end + first_offset
+    new_first_offset = position_map.map(ref_start) - new_end
+    if version == 0:
+        output[24:28] = uint32_to_str(new_first_offset)
+    else:
+        output[28:36] = uint64_to_str(new_first_offset)
+    reference_count = str_to_uint32(data[pos:pos + 4]) & 0xffff
+    pos += 4
+    for _ in range(reference_count):
+        word = str_to_uint32(data[pos:pos + 4])
+        ref_size = word & 0x7fffffff
+        new_size = (position_map.map(ref_start + ref_size) -
+                    position_map.map(ref_start))
+        output[pos:pos + 4] = uint32_to_str((word & 0x80000000) | new_size)
+        ref_start += ref_size
+        pos += 12
+    return str(output)
+
+
+def fix_box(box_type, data, old_pos, new_pos, position_map):
+    "Return data with offsets fixed if box_type is moof or sidx, otherwise None."
+    if box_type == 'moof':
+        return fix_moof(data, old_pos, new_pos, position_map)
+    if box_type == 'sidx':
+        return fix_sidx(data, old_pos, new_pos, position_map)
+    return None
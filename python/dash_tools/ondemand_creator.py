@@ -37,8 +37,9 @@ from xml import sax
 from xml.sax import handler, saxutils, xmlreader
 from argparse import ArgumentParser
 
-from track_resegmenter import TrackResegmenter
+from track_resegmenter import resegment_file
 from backup_handler import make_backup, BackupError
+from batch_runner import add_batch_arguments, run_batch
 
 MP4BOX = "MP4Box"  # path to MP4Box of late-enough version.
 
@@ -90,11 +91,17 @@ class MPDSidxFilter(saxutils.XMLFilterBase):
 class DashOnDemandCreator(object):
     """Process output from batch_encoder and package as DASH OnDemand content.
 
-    Also fix audio segment durations to agree with video."""
+    Also fix audio segment durations to agree with video. The audio tracks
+    are resegmented in parallel by up to jobs processes (default: number
+    of cores), chunk_size tracks at a time."""
 
-    def __init__(self, config_file, directory, mpd_file_name):
+    def __init__(self, config_file, directory, mpd_file_name, jobs=None, chunk_size=None,
+                 quiet=False):
         self.directory = directory
         self.mpd_name = mpd_file_name
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.quiet = quiet
         self.tracks = {'video': [], 'audio': []}
         self.segment_duration_ms = None
         self._parse_config_file(config_file)
@@ -145,13 +152,19 @@ class DashOnDemandCreator(object):
         return os.path.join(self.directory, name)
 
     def resegment_audio_tracks(self, tracks, dur_ms):
-        sidx_ranges = {}
+        "Resegment the audio tracks in place in parallel, and return their new sidx ranges."
+        track_for_file = {}
         for track in tracks['audio']:
-            file_name = self.file_path('{0}_dashinit.mp4'.format(track))
-            # out_name = '{0}_dashout.mp4'.format(track)
-            resegmenter = TrackResegmenter(file_name, dur_ms, file_name)
-            resegmenter.resegment()
-            sidx_ranges[track] = resegmenter.sidx_range
+            track_for_file[self.file_path('{0}_dashinit.mp4'.format(track))] = track
+        tasks = [(file_name, dur_ms, file_name, False, False, self.quiet)
+                 for file_name in sorted(track_for_file)]
+        batch = run_batch(resegment_file, tasks, self.jobs, self.chunk_size, self.quiet)
+        if batch.failures:
+            raise ValueError("Resegmentation failed for %s" %
+                             ", ".join(args[0] for args, _ in batch.failures))
+        sidx_ranges = {}
+        for args, sidx_range in batch.results:
+            sidx_ranges[track_for_file[args[0]]] = sidx_range
         return sidx_ranges
 
     def _fix_sidx_ranges(self, input_file, output, sidx_for_representations):
@@ -209,10 +222,12 @@ def main():
                         dest="verbose",
                         help="Verbose mode")
 
+    add_batch_arguments(parser)
     args = parser.parse_args()
 
     dc = DashOnDemandCreator(args.config_file, args.directory,
-                             args.manifest_filename)
+                             args.manifest_filename, args.jobs, args.chunk_size,
+                             args.quiet)
     dc.process()
 
 
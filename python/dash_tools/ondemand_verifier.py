@@ -34,7 +34,7 @@ import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
 from collections import defaultdict, namedtuple, Counter, OrderedDict
 
-from mp4 import mp4
+import mp4
 
 log = logging.getLogger('__name__')
 
@@ -89,16 +89,24 @@ class MultipleTrunError(Exception):
 
 
 class CMAFTrack(object):
-    "Check and possibly fix a CMAF track."
-    def __init__(self, name, data):
+    """Check and possibly fix a CMAF track.
+
+    Give either the track data or an mp4.BoxIndex of it. The index can
+    come from an index cache (mp4.BoxIndex.cached()), in which case no
+    boxes need to be parsed at all."""
+    def __init__(self, name, data=None, index=None):
         self.name = name
-        self.root = mp4(data)
-        self.segment_data = self._find_subsegment_data(self.root)
-        self.sidx_segment_data = self._get_sidx_segment_data(self.root)
+        if index is None:
+            index = mp4.BoxIndex(data)
+        self.index = index
+        self.segment_data = self._find_subsegment_data(self.index)
+        self.sidx_segment_data = self._get_sidx_segment_data(self.index)
 
-    def _find_subsegment_data(self, mp4_root):
+    def _find_subsegment_data(self, index):
         "Find the segments and return size, offset, decode_time, duration"
-        timescale = mp4_root.find('moov.trak.mdia.mdhd').timescale
+        summaries = index.summaries
+        timescale = summaries['timescale']
+        fragments = iter(summaries['fragments'])
         segments = []
         segment = {}
         nr_segments = 0
@@ -106,35 +114,33 @@ class CMAFTrack(object):
                         'segments': segments,
                         'first_decode_time' : None,
                         'badness': 0}
-        for top_box in mp4_root.children:
-            if not segment and top_box.type in ('emsg', 'styp', 'moof'):
-                segment = {'size': 0, 'offset': top_box.offset}
+        for i in index.children():
+            box_type = index.box_type(i)
+            if not segment and box_type in ('emsg', 'styp', 'moof'):
+                segment = {'size': 0, 'offset': index.offsets[i]}
             if segment:
-                segment['size'] += top_box.size
-                if top_box.type == 'moof':
-                    tfdt = top_box.find('traf.tfdt')
-                    segment['decode_time'] = tfdt.decode_time
-                    truns = top_box.find_all('traf.trun')
-                    if len(truns) != 1:
+                segment['size'] += index.sizes[i]
+                if box_type == 'moof':
+                    fragment = next(fragments)
+                    segment['decode_time'] = fragment['decode_time']
+                    if fragment['nr_truns'] != 1:
                         raise MultipleTrunError("Multiple trun boxes (%d) in "
                                                 "one segment is against "
-                                                "CMAF" % len(truns))
-                    trun = truns[0]
+                                                "CMAF" % fragment['nr_truns'])
                     if nr_segments == 0:
-                        segment_data['first_decode_time'] = tfdt.decode_time
-                        segment_data['first_pres_time'] = (tfdt.decode_time +
-                                                           trun.first_cto)
-                    segment['duration'] = trun.total_duration
+                        segment_data['first_decode_time'] = fragment['decode_time']
+                        segment_data['first_pres_time'] = (fragment['decode_time'] +
+                                                           fragment['first_cto'])
+                    segment['duration'] = fragment['duration']
                     if segment['duration'] == 0:  # Must find values in trex
-                        trex = mp4_root.find('moov.mvex.trex')
-                        segment['duration'] = (trex.default_sample_duration *
-                                               trun.sample_count)
+                        segment['duration'] = (summaries['default_sample_duration'] *
+                                               fragment['sample_count'])
                     if nr_segments > 0:
                         last_seg = segments[-1]
                         badness = self._check_duration_consistency(
                             self.name, segment, last_seg, nr_segments)
                         segment_data['badness'] |= badness
-                elif top_box.type == 'mdat':
+                elif box_type == 'mdat':
                     segments.append(segment)
                     segment = {}
                     nr_segments += 1
@@ -151,25 +157,23 @@ class CMAFTrack(object):
             return BAD_NON_CONSISTENT_TFDT_TIMELIINE
         return 0
 
-    def _get_sidx_segment_data(self, mp4_root):
+    def _get_sidx_segment_data(self, index):
         "Return sidx segment data."
-        sidx = mp4_root.find('sidx')
+        sidx = index.summaries['sidx']
         if not sidx:
             return []
-        offset = sidx.size + sidx.offset + sidx.first_offset
-        pres_time = sidx.first_pres_time
+        offset = sidx['size'] + sidx['offset'] + sidx['first_offset']
+        pres_time = sidx['first_pres_time']
         sidx_segments = []
-        for ref in sidx.references:
-            size = ref['referenced-size']
-            duration = ref['subsegment-duration']
+        for size, duration in sidx['references']:
             sidx_segments.append({'size': size, 'offset': offset,
                                   'decode_time': pres_time,
                                   'duration': duration})
             offset += size
             pres_time += duration
-        sidx_data = {'timescale': sidx.timescale,
+        sidx_data = {'timescale': sidx['timescale'],
                      'segments': sidx_segments,
-                     'first_pres_time': sidx.first_pres_time}
+                     'first_pres_time': sidx['first_pres_time']}
         return sidx_data
 
 
@@ -268,12 +272,14 @@ def get_trackgroups_from_dash_manifest(manifest_path):
     return track_file_paths
 
 
-def check_alignment(manifest_path, verbose):
+def check_alignment(manifest_path, verbose, write_index=False):
     """Check alignment and return badness as mask.
 
     Compare sidx vs subsegment timestamp/sizes inside one track.
     Compare between representations inside on adaptation set.
     Compare between adaptation sets (for video and audio).
+    Track files are indexed from their index cache if it is valid, and
+    with write_index, missing or stale caches are (re)written.
     """
     badness = 0
     track_groups = get_trackgroups_from_dash_manifest(manifest_path)
@@ -287,11 +293,11 @@ def check_alignment(manifest_path, verbose):
         sidx_timescale = None
         for i, track_path in enumerate(track_group):
             name = os.path.basename(track_path)
+            index = mp4.BoxIndex.cached(track_path, write_index)
             try:
-                data = open(track_path, 'rb').read()
-            except IOError as e:
-                raise e
-            track = CMAFTrack(name, data)
+                track = CMAFTrack(name, index=index)
+            finally:
+                index.close()
             segment_data = track.segment_data
             if i == 0:  # Take one segment timeline per group
                 tg_segment_data[name] = segment_data
@@ -479,7 +485,7 @@ def setup_logging(log_level, log_to_stdout):
     logger.addHandler(log_handler)
 
 
-def check_asset(mpd_path, verbose):
+def check_asset(mpd_path, verbose, write_index=False):
     "Check a an asset defined by an MPD path."
     print "Checking %s" % mpd_path
     log.info("Checking %s" % mpd_path)
@@ -494,7 +500,7 @@ def check_asset(mpd_path, verbose):
                 print(e)
                 traceback.print_tb(sys.exc_traceback)
         else:
-            badness |= check_alignment(mpd_path, verbose)
+            badness |= check_alignment(mpd_path, verbose, write_index)
     except Exception, e:
         log.error(e)
         if verbose:
@@ -509,13 +515,14 @@ def check_asset(mpd_path, verbose):
     return badness
 
 
-def check_asset_tree(verbose, asset_dir, names):
+def check_asset_tree(options, asset_dir, names):
+    verbose, write_index = options
     badness = 0
     for name in names:
         path = os.path.join(asset_dir, name)
         base, ext = os.path.splitext(path)
         if ext == '.mpd':
-            badness |= check_asset(path, verbose)
+            badness |= check_asset(path, verbose, write_index)
 
 usage = """usage: %(prog)s [options] file/dir ...
 
@@ -558,15 +565,22 @@ def main():
                         action="store_true",
                         dest="verbose")
 
+    parser.add_argument("-w", "--write-index",
+                        action="store_true",
+                        dest="write_index",
+                        help="Write an index cache (.mp4idx) next to each "
+                             "track file, so that later runs on unchanged "
+                             "files skip parsing")
+
     args = parser.parse_args()
     setup_logging(args.log_level, args.log_to_stdout)
     badness = 0
     for asset_path in args.manifest_files:
         if os.path.isdir(asset_path):
             print("Traversing tree looking for mpd files at %s" % asset_path)
-            os.path.walk(asset_path, check_asset_tree, args.verbose)
+            os.path.walk(asset_path, check_asset_tree, (args.verbose, args.write_index))
         else:
-            asset_badness = check_asset(asset_path, args.verbose)
+            asset_badness = check_asset(asset_path, args.verbose, args.write_index)
             badness |= asset_badness
     sys.exit(badness)
 
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
-"""Restore files with ending BACKUP_ENDING to original files."""
+"""Restore files with ending BACKUP_FILE_SUFFIX to original files.
+
+Journal files (JOURNAL_FILE_SUFFIX) are rolled back into their original files.
+"""
 
 # The copyright in this software is being made available under the BSD License,
 # included below. This software may be subject to other third party and contributor
@@ -33,7 +36,8 @@
 import os
 import sys
 
-from backup_handler import BACKUP_ENDING
+from backup_handler import BACKUP_FILE_SUFFIX, JOURNAL_FILE_SUFFIX
+from backup_handler import restore_from_journal
 
 
 def main():
@@ -48,13 +52,18 @@ def main():
         parser.error("Wrong number of arguments")
         sys.exit(1)
     for file_name in args:
-        if file_name.endswith(BACKUP_ENDING):
-            old_name = file_name[:-len(BACKUP_ENDING)]
+        if file_name.endswith(BACKUP_FILE_SUFFIX):
+            old_name = file_name[:-len(BACKUP_FILE_SUFFIX)]
             print("moving %s to %s" % (file_name, old_name))
             if os.path.exists(old_name):
                 os.unlink(old_name)
             os.rename(file_name, old_name)
             continue
+        if file_name.endswith(JOURNAL_FILE_SUFFIX):
+            old_name = file_name[:-len(JOURNAL_FILE_SUFFIX)]
+            print("rolling back %s from %s" % (old_name, file_name))
+            restore_from_journal(old_name)
+            continue
 
 
 if __name__ == "__main__":
@@ -31,35 +31,16 @@ Utility file to handle sample table boxes in MP4 files
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import array
+import bisect
+
 import mp4
+from structops import uint64_array, running_sums
 
 def sample_to_chunk_and_index(stsc, idx):
-    #print 'idx=', idx
-    if stsc.array:
-        result = stsc.get_unrolled(idx)
-        #print result[0], result[1]
-        return result
-    
-    delta = 0
-    start_sample = 1
-    count = 0
-    for j in range(stsc.entry_count - 1):
-        if j + 1 == stsc.entry_count:
-            delta = 0
-            break
-        else:
-            delta = (stsc.entry(j + 1)['first_chunk'] - stsc.entry(j)['first_chunk']) * stsc.entry(j)['samples_per_chunk']
-        if idx >= start_sample and idx < start_sample + delta:
-            break
-        else:
-            start_sample += delta
-        count += 1
-    
-    chunk = stsc.entry(count)['first_chunk'] + (idx - start_sample) / stsc.entry(count)['samples_per_chunk']
-    index = (idx - start_sample) % stsc.entry(count)['samples_per_chunk']
-    #print chunk, index
-    return chunk, index
-    
+    "Return the chunk of 1-based sample idx and the index of the sample in it."
+    return stsc.get_unrolled(idx)
+
 def chunk_offset(stco, chunk):
     if 0 == chunk or stco.entry_count < chunk:
         return 0
@@ -73,45 +54,132 @@ def sample_size(stsz, idx):
     return 0
 
 def sample_time(stts, idx):
+    "Return decode time and duration of 1-based sample idx, (0, 0) if not in stts."
     if stts.array:
         return stts.array[idx]['time'], stts.array[idx]['delta']
-    
-    time = 0
-    duration = 0
-    last_sample = 0
-    for i in range(stts.entry_count):
-        duration = stts.entry(i)['sample_delta']
-        if idx <= last_sample + stts.entry(i)['sample_count']: 
-            time += (idx - last_sample - 1) * duration
-            last_sample += stts.entry(i)['sample_count']
-            return time, duration
-        else:
-            time += stts.entry(i)['sample_count'] * duration
-            last_sample += stts.entry(i)['sample_count']
-    return 0, 0
+    if not 0 < idx <= stts.sample_count:
+        return 0, 0
+    return stts.time_for_sample(idx), stts.delta_for_sample(idx)
 
 def sample_offset(ctts, idx):
+    "Return the composition time offset of 1-based sample idx, 0 if not in ctts."
     if not ctts:
         return 0
     if ctts.array:
         return ctts.array[idx]
-    
-    offset = 0
-    last_sample = 0
-    for i in range(ctts.entry_count):
-        offset = ctts.entry(i)['sample_offset']
-        if idx <= last_sample + ctts.entry(i)['sample_count']: 
-            last_sample += ctts.entry(i)['sample_count']
-            return offset
-        else:
-            last_sample += ctts.entry(i)['sample_count']
-    return 0
+    if not 0 < idx <= ctts.sample_count:
+        return 0
+    return ctts.cto_for_sample(idx)
 
 def offset_from_sample(stbl, idx):
     chunk, index = sample_to_chunk_and_index(stbl.find('stsc'), idx)
-    offset = chunk_offset(stbl.find('stco'), chunk)
+    offset = chunk_offset(stbl.find('stco') or stbl.find('co64'), chunk)
     #print 'chunk:', chunk, 'index:', index, 'offset:', offset
-    for i in range(idx - index, idx):
-        d = sample_size(stbl.find('stsz'), i)
-        offset += d
-    return offset
+    stsz = stbl.find('stsz')
+    if stsz.sample_size:
+        return offset + index * stsz.sample_size
+    return offset + sum(stsz.entry_sizes[idx - index - 1:idx - 1])
+
+
+class SampleIndex(object):
+    """Per-sample offset, size, decode time, composition time and sync flag
+    of a progressive (non-fragmented) track, built once from its tables.
+
+    Give a trak or its stbl. The columns are arrays indexed from 0, while
+    the methods take 1-based sample numbers like the tables above."""
+
+    def __init__(self, trak):
+        stbl = trak
+        self.timescale = None
+        if trak.type == 'trak':
+            stbl = trak.find('mdia.minf.stbl')
+            self.timescale = trak.find('mdia.mdhd').timescale
+        stsz = stbl.find('stsz')
+        self.sample_count = stsz.sample_count
+        if stsz.sample_size:
+            self.sizes = array.array('I', [stsz.sample_size]) * self.sample_count
+        else:
+            self.sizes = stsz.entry_sizes
+        self.offsets = self._make_offsets(stbl.find('stsc'), stbl.find('stco') or stbl.find('co64'))
+        self.decode_times = self._make_decode_times(stbl.find('stts'))
+        self.composition_offsets = self._make_composition_offsets(stbl.find('ctts'))
+        stss = stbl.find('stss')
+        if stss:
+            self.sync_samples = stss.sample_numbers
+            self.sync_flags = array.array('B', [0]) * self.sample_count
+            for sample in self.sync_samples:
+                self.sync_flags[sample - 1] = 1
+        else:
+            # Without stss, every sample is a sync sample
+            self.sync_samples = None
+            self.sync_flags = None
+
+    def _make_offsets(self, stsc, stco):
+        offsets = uint64_array()
+        sizes = self.sizes
+        nr_chunks = stco.entry_count
+        run_ends = list(stsc.first_chunks[1:]) + [nr_chunks + 1]
+        sample = 0
+        for first_chunk, end_chunk, samples_per_chunk in zip(stsc.first_chunks, run_ends,
+                                                             stsc.samples_per_chunks):
+            for chunk in xrange(first_chunk, min(end_chunk, nr_chunks + 1)):
+                chunk_sizes = sizes[sample:sample + samples_per_chunk]
+                offsets.extend(running_sums(stco.chunk_offsets[chunk - 1], chunk_sizes,
+                                            len(chunk_sizes)))
+                sample += samples_per_chunk
+        return offsets
+
+    def _make_decode_times(self, stts):
+        decode_times = uint64_array()
+        time = 0
+        for count, delta in zip(stts.sample_counts, stts.sample_deltas):
+            decode_times.extend(running_sums(time, delta, count))
+            time += count * delta
+        return decode_times
+
+    def _make_composition_offsets(self, ctts):
+        if not ctts:
+            return None
+        composition_offsets = array.array('l')
+        for count, offset in zip(ctts.sample_counts, ctts.sample_offsets):
+            composition_offsets.extend(array.array('l', [offset]) * count)
+        return composition_offsets
+
+    def offset(self, idx):
+        return self.offsets[idx - 1]
+
+    def size(self, idx):
+        return self.sizes[idx - 1]
+
+    def dts(self, idx):
+        return self.decode_times[idx - 1]
+
+    def cts(self, idx):
+        if self.composition_offsets is None:
+            return self.decode_times[idx - 1]
+        return self.decode_times[idx - 1] + self.composition_offsets[idx - 1]
+
+    def is_sync(self, idx):
+        if self.sync_flags is None:
+            return 0 < idx <= self.sample_count
+        return self.sync_flags[idx - 1] == 1
+
+    def sample_for_time(self, time):
+        "Return the last sample with decode time at or before time."
+        idx = bisect.bisect_right(self.decode_times, time)
+        if not idx:
+            raise IndexError('time %d is before the first sample' % time)
+        return idx
+
+    def sync_sample_before(self, idx):
+        "Return the last sync sample at or before sample idx."
+        if self.sync_samples is None:
+            return idx
+        pos = bisect.bisect_right(self.sync_samples, idx)
+        if not pos:
+            raise IndexError('no sync sample at or before sample %d' % idx)
+        return self.sync_samples[pos - 1]
+
+    def seek(self, time):
+        "Return the sync sample to start decoding from to present time."
+        return self.sync_sample_before(self.sample_for_time(time))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""Apply a filter chain to live segments as they arrive in a directory.
+
+The watch directory is polled. A segment is complete when its size and
+modification time have not changed for --settle seconds. Each complete
+segment is filtered once into the output directory, with the same relative
+path, and renamed into place when it is written. The processing time and the
+latency since the last write of the input are printed per segment.
+
+Init segments (files with "init" in the name) are parsed once per version
+and their track info is used for the media segments of the same
+representation: the segments in the same directory whose names start like
+the init segment name before "init". The info is needed by
+--tfdt-offset-seconds.
+
+Example: clean and retime a live ladder 10s later
+
+    segment_watcher.py clean,tfdt --tfdt-offset-seconds 10 live/ out/
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import copy
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from collections import deque
+
+import filter_chain
+from init_info import get_init_info
+
+SEGMENT_EXTENSIONS = ('.m4s', '.mp4', '.cmfv', '.cmfa', '.cmft')
+DEFAULT_POLL_INTERVAL = 0.2
+DEFAULT_SETTLE_TIME = 0.5
+DEFAULT_DONE_WINDOW = 60.0
+# A directory listed this soon after its mtime may change again within the same tick
+DIR_MTIME_MARGIN = 1.0
+LATENCY_WINDOW = 1000
+
+
+def is_init_segment(path):
+    "Return True if the file name marks an init segment."
+    return "init" in os.path.splitext(os.path.basename(path))[0]
+
+
+def init_prefix(path):
+    "Return the part of an init segment name before 'init'."
+    name = os.path.basename(path)
+    return name[:name.find("init")]
+
+
+class SegmentWatcher(object):
+    """Poll watch_dir and filter complete segments into output_dir.
+
+    listings maps a directory to (mtime, time listed, file names, subdirectory
+    names), so that only changed directories are listed again and only new
+    files are looked at. pending maps a path to (size, mtime, time first seen
+    with these). done maps a processed path to the (size, mtime) it was
+    processed with, or found with if its output is newer, and the time of
+    that. Entries older than done_window are dropped, and files changing
+    after that are no longer reported. init_paths is the set of init segments
+    seen. latencies holds the LATENCY_WINDOW latest latencies."""
+
+    def __init__(self, watch_dir, output_dir, stage_names, options,
+                 settle_time=DEFAULT_SETTLE_TIME, quiet=False,
+                 done_window=DEFAULT_DONE_WINDOW):
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.stage_names = stage_names
+        self.options = options
+        self.settle_time = settle_time
+        self.quiet = quiet
+        self.done_window = done_window
+        self.listings = {}
+        self.pending = {}
+        self.done = {}
+        self.init_paths = set()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.nr_processed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.failures = 0
+
+    def new_paths(self):
+        """Return the paths of the files that have appeared since the last call.
+
+        Directories whose mtime is unchanged since they were listed are not
+        listed again. The files that have gone are forgotten."""
+        new_paths = []
+        listings = {}
+        dir_paths = [self.watch_dir]
+        while dir_paths:
+            dir_path = dir_paths.pop()
+            listing = self.listings.get(dir_path)
+            try:
+                mtime = os.stat(dir_path).st_mtime
+                if listing is not None and listing[0] == mtime and \
+                        listing[1] - mtime >= DIR_MTIME_MARGIN:
+                    listings[dir_path] = listing
+                    dir_paths.extend(os.path.join(dir_path, name) for name in listing[3])
+                    continue
+                listed_at = time.time()
+                names = set(os.listdir(dir_path))
+            except OSError:  # Removed
+                continue
+            old_names, old_subdirs = listing[2:] if listing else (set(), set())
+            subdirs = old_subdirs & names
+            for name in names - old_names:
+                path = os.path.join(dir_path, name)
+                if os.path.isdir(path):
+                    subdirs.add(name)
+                else:
+                    new_paths.append(path)
+            for name in old_names - names:
+                self.forget(os.path.join(dir_path, name))
+            listings[dir_path] = (mtime, listed_at, names, subdirs)
+            dir_paths.extend(os.path.join(dir_path, name) for name in subdirs)
+        for dir_path in set(self.listings) - set(listings):
+            for name in self.listings[dir_path][2]:
+                self.forget(os.path.join(dir_path, name))
+        self.listings = listings
+        return new_paths
+
+    def forget(self, path):
+        "Drop the state of a file that has gone."
+        self.pending.pop(path, None)
+        self.done.pop(path, None)
+        self.init_paths.discard(path)
+
+    def scan(self, now=None):
+        """Return the paths that have become complete since the last scan.
+
+        Only new, pending and recently done files are looked at. Init
+        segments come first, so their info is cached before the media
+        segments that need it."""
+        if now is None:
+            now = time.time()
+        for path in self.new_paths():
+            file_name = os.path.basename(path)
+            if file_name.startswith(".") or \
+                    os.path.splitext(file_name)[1] not in SEGMENT_EXTENSIONS:
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:  # Removed since listed
+                continue
+            if self.is_up_to_date(path, mtime):
+                self.done[path] = (os.path.getsize(path), mtime, now)
+            else:
+                self.pending[path] = None
+        for path, (size, mtime, done_time) in self.done.items():
+            if now - done_time > self.done_window:
+                del self.done[path]
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.forget(path)
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                print "WARNING: %s changed after processing, not processed again" % path
+                self.done[path] = (stat.st_size, stat.st_mtime, done_time)
+        complete = []
+        for path, first_seen in self.pending.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.forget(path)
+                continue
+            version = (stat.st_size, stat.st_mtime)
+            if first_seen is None or first_seen[:2] != version:
+                self.pending[path] = version + (now,)
+            elif now - first_seen[2] >= self.settle_time and stat.st_size > 0:
+                complete.append(path)
+        complete.sort(key=lambda path: (not is_init_segment(path), path))
+        return complete
+
+    def is_up_to_date(self, path, mtime):
+        "Return True if the output of path was written after it, e.g. before a restart."
+        try:
+            return os.path.getmtime(self.output_path(path)) >= mtime
+        except OSError:
+            return False
+
+    def get_init_info(self, path):
+        "Return the InitInfo of the init segment at path, parsed once per mtime."
+        self.init_paths.add(path)
+        return get_init_info(path)
+
+    def find_init(self, path):
+        "Return the init segment of the representation of a media segment, or None."
+        dir_path = os.path.dirname(path)
+        name = os.path.basename(path)
+        best = None
+        for init_path in self.init_paths:
+            if os.path.dirname(init_path) == dir_path and \
+                    name.startswith(init_prefix(init_path)):
+                if best is None or len(init_prefix(init_path)) > len(init_prefix(best)):
+                    best = init_path
+        return best
+
+    def options_for(self, path):
+        """Return the stage options for a segment, or None if its init is needed but missing.
+
+        --tfdt-offset-seconds is converted with the timescale of the init."""
+        if self.options.tfdt_offset_seconds is None or is_init_segment(path):
+            return self.options
+        init_path = self.find_init(path)
+        if init_path is None:
+            return None
+        options = copy.copy(self.options)
+        timescale = self.get_init_info(init_path).timescale
+        options.tfdt_offset = int(round(self.options.tfdt_offset_seconds * timescale))
+        return options
+
+    def output_path(self, path):
+        "Return the output path of the input path."
+        return os.path.join(self.output_dir, os.path.relpath(path, self.watch_dir))
+
+    def process(self, path, now=None):
+        """Filter a complete segment. Return False if it has to wait for its init."""
+        if is_init_segment(path):
+            self.get_init_info(path)
+        options = self.options_for(path)
+        if options is None:
+            return False
+        size, mtime = self.pending.pop(path)[:2]
+        self.done[path] = (size, mtime, time.time() if now is None else now)
+        out_path = self.output_path(path)
+        out_dir = os.path.dirname(out_path)
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        start = time.time()
+        try:
+            pipeline = filter_chain.make_pipeline(self.stage_names, options, path)
+            pipeline.filter_to_file(out_path)
+        except Exception, e:  # pylint: disable=broad-except
+            self.failures += 1
+            print "ERROR: %s: %s" % (path, e)
+            return True
+        end = time.time() if now is None else now
+        latency = end - mtime
+        self.latencies.append(latency)
+        self.nr_processed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if not self.quiet:
+            print "%s -> %s in %.1f ms, %.1f ms after last write" % (
+                path, out_path, (time.time() - start) * 1000, latency * 1000)
+        return True
+
+    def poll(self, now=None):
+        "Scan once and process the complete segments. Return the number processed."
+        nr_processed = 0
+        for path in self.scan(now):
+            if self.process(path, now):
+                nr_processed += 1
+        return nr_processed
+
+    def run(self, interval=DEFAULT_POLL_INTERVAL, max_polls=None):
+        "Poll every interval seconds until interrupted or max_polls is reached."
+        nr_polls = 0
+        try:
+            while max_polls is None or nr_polls < max_polls:
+                self.poll()
+                nr_polls += 1
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        self.report()
+
+    def report(self):
+        "Print a latency summary. The median is over the latest segments."
+        if not self.nr_processed:
+            print "No segments processed"
+            return
+        latencies = sorted(self.latencies)
+        print "%d segments, %d failed. Latency after last write: mean %.1f ms, " \
+              "median %.1f ms, max %.1f ms" % (
+                  self.nr_processed, self.failures,
+                  self.total_latency / self.nr_processed * 1000,
+                  latencies[len(latencies) // 2] * 1000, self.max_latency * 1000)
+
+
+def main():
+    "Command-line function."
+    parser = ArgumentParser(description="Watch a directory and run a comma-separated "
+                                        "chain of filters on each complete segment. "
+                                        "Stages are %s." % filter_chain.stage_help())
+    filter_chain.add_stage_arguments(parser)
+    parser.add_argument("watch_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--tfdt-offset-seconds", dest="tfdt_offset_seconds", type=float,
+                        help="tfdt offset in seconds, converted with the init timescale")
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="seconds between polls (default %(default)s)")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_TIME,
+                        help="seconds a file must stay unchanged to be complete "
+                             "(default %(default)s)")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args()
+
+    stage_names = filter_chain.parse_chain(parser, args.chain)
+    watch_dir = os.path.join(os.path.abspath(args.watch_dir), "")
+    if os.path.join(os.path.abspath(args.output_dir), "").startswith(watch_dir):
+        parser.error("The output directory must be outside the watch directory")
+    watcher = SegmentWatcher(args.watch_dir, args.output_dir, stage_names, args,
+                             args.settle, args.quiet)
+    watcher.run(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -35,33 +35,29 @@ import shutil
 from argparse import ArgumentParser
 
 from mp4filter import ShiftCompositionTimeOffset
-from backup_handler import make_backup, BackupError
+from backup_handler import BackupError, JOURNAL_FILE_SUFFIX
 
 
 def process_files(files):
     for f in files:
-        f_backup = f + '_bup'
-        if os.path.exists(f_backup):
+        f_journal = f + JOURNAL_FILE_SUFFIX
+        if os.path.exists(f_journal):
             print("%s already exists, will not process %s" %
-                  (f_backup, f))
+                  (f_journal, f))
             continue
         sto = ShiftCompositionTimeOffset(f)
-        output = sto.filter_top_boxes()
-        input = open(f, 'rb').read()
-        if output != input:
-            assert len(output) == len(input)
-            print("Change in file %s. Make backup %s" % (f, f_backup))
-            try:
-                make_backup(f)
-            except BackupError:
-                print("Cannot make backup for %s. Skipping it" % f)
-                return
-            with open(f, 'wb') as ofh:
-                ofh.write(output)
+        try:
+            patches = sto.patch_file(journal=True)
+        except BackupError:
+            print("Cannot make journal for %s. Skipping it" % f)
+            return
+        assert patches is not None
+        if patches:
+            print("Changed file %s. Journal in %s" % (f, f_journal))
 
 
 def main():
-    "Shift presentation time to decode time, and make backup of old file."
+    "Shift presentation time to decode time, and journal the changed bytes."
     parser = ArgumentParser(usage='Shift presentation time to decode time in trun')
 
     parser.add_argument('files', metavar='N', type=str, nargs='+',
@@ -32,9 +32,12 @@
 
 import sys
 import os
+from argparse import ArgumentParser
 from structops import uint32_to_str, str_to_uint32
+from batch_runner import add_batch_arguments, run_batch
 from mp4filter import MP4Filter
-from backup_handler import make_backup, BackupError
+from trun_codec import TrunCodec
+from backup_handler import make_backup, BackupError, BACKUP_FILE_SUFFIX
 
 REPLACE_STRING = """</div>
  </body>
@@ -56,49 +59,19 @@ class STPPFixerFilter(MP4Filter):
     """Process a media segment file. Drop skip, free, and sidx boxes on top level.
     """
 
+    box_handlers = {"skip": "remove_box",
+                    "free": "remove_box",
+                    "sidx": "remove_box",
+                    "moof.traf.tfhd": "process_tfhd",  # Set default sample duration
+                    "moof.traf.trun": "process_trun",  # Set sample count
+                    "mdat": "process_mdat"}  # Fix TTML data
+
     def __init__(self, file_name=None, data=None, new_track_id=None, new_default_sample_duration=None):
         MP4Filter.__init__(self, file_name, data)
         self.new_track_id = new_track_id
         self.new_default_sample_duration = new_default_sample_duration
-        self.relevant_boxes = ['styp', 'moof', 'free', 'skip', 'sidx', 'mdat']
-        self.composite_boxes = ['moof', 'moof.traf']
         self.ttml_length = None
 
-    def filterbox(self, box_type, data, file_pos, path=""):
-        "Filter box or tree of boxes recursively."
-        if path == "":
-            path = box_type
-        else:
-            path = "%s.%s" % (path, box_type)
-        output = ""
-        if path in ("skip", "free", "sidx"):
-            print "Removing %s box" % box_type # Just let output="" to drop these boxes
-        elif path in self.composite_boxes:
-            output = self.process_composite_box(path, data)
-        elif path == "moof.traf.tfhd": # Set movie duration
-            output = self.process_tfhd(data)
-        elif path == "moof.traf.trun": # Set sample count and offset
-            output = self.process_trun(data)
-        elif path == "mdat": # Fix TTML data
-            output = self.process_mdat(data)
-        else:
-            output = data
-        return output
-
-    def process_composite_box(self, path, data):
-        "Process composite boxes."
-        container_size, container_box_type = self.check_box(data[0:8])
-        inner_data = ""
-        pos = 8
-        while pos < len(data):
-            size, box_type = self.check_box(data[pos:pos + 8])
-            inner_data += self.filterbox(box_type, data[pos:pos+size], None, path)
-            #print "Box:",box_type,", size:",size,", newsize:",len(inner_data)
-            pos += size
-        new_container_size = 8 + len(inner_data)
-        #TODO. If this has changed, make sure that offsets are changes appropriately
-        return uint32_to_str(new_container_size) + container_box_type + inner_data
-
     def process_tfhd(self, data):
         "Process the mvhd box and set timescale."
         tf_flags = str_to_uint32(data[8:12]) & 0xffffff
@@ -127,25 +100,15 @@ class STPPFixerFilter(MP4Filter):
         return output
 
     def process_trun(self, data):
-        tf_flags = str_to_uint32(data[8:12]) & 0xffffff
-
-        output = data[0:8]
-        output += uint32_to_str(tf_flags)
-
+        "Merge all samples into one, since process_mdat merges the TTML."
+        trun = TrunCodec(data)
         print "Changing trun sample count"
-        output += uint32_to_str(1)
-
-        if tf_flags & 1:
-            data_offset = str_to_uint32(data[16:20])
-            if self.new_default_sample_duration is not None:
-                print "Changing trun data offset: %d to %d"%(data_offset, data_offset + 4)
-                data_offset += 4
-
-            output += uint32_to_str(data_offset)
-
-            output += data[20:]
-
-        return output
+        trun.merge_samples()
+        # process_mdat shrinks the TTML, so the size of the merged sample is
+        # left to the tfhd default that finalize sets
+        trun.sizes = None
+        # The data offset is fixed by MP4Filter for the size changes of trun and tfhd
+        return trun.encode()
 
     def process_mdat(self, data):
         print "Merging all ttml samples into one"
@@ -185,31 +148,33 @@ class STPPFixerFilter(MP4Filter):
         self.output = newoutput
 
 
+def fix_file(file_name, track_id=None, dur=None):
+    "Make a backup of file_name and filter the backup into file_name."
+    try:
+        make_backup(file_name)
+    except BackupError:
+        print "Backup-file already exists. Skipping file %s" % file_name
+        return
+    stpp_cleaner = STPPFixerFilter(new_track_id=track_id,
+                                   new_default_sample_duration=dur)
+    print "Processing %s" % file_name
+    with open(file_name + BACKUP_FILE_SUFFIX, "rb") as ifh:
+        with open(file_name, "wb") as ofh:
+            stpp_cleaner.filter_stream(ifh, ofh)
+
+
 def main():
     "Command-line function."
-    from optparse import OptionParser
-    parser = OptionParser()
-    parser.add_option("--id", dest="track_id", type="int", help="set new trackID")
-    parser.add_option("--dur", dest="dur", type="int", help="set new default_sample_duration")
-
-    (options, args) = parser.parse_args()
-
-    if len(args) < 1:
-        parser.error("Wrong number of arguments")
-        sys.exit(1)
-    for file_name in args:
-        try:
-            make_backup(file_name)
-        except BackupError:
-            print("Backup-file already exists. Skipping file %s" % file_name)
-            continue
-        stpp_cleaner = STPPFixerFilter(file_name, new_track_id=options.track_id,
-                                       new_default_sample_duration=options.dur)
-        print "Processing %s" % file_name
-        output = stpp_cleaner.filter_top_boxes()
-        os.rename(file_name, bup_name)
-        with open(file_name, "wb") as ofh:
-            ofh.write(output)
+    parser = ArgumentParser()
+    parser.add_argument("--id", dest="track_id", type=int, help="set new trackID")
+    parser.add_argument("--dur", dest="dur", type=int, help="set new default_sample_duration")
+    parser.add_argument("files", nargs="+")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+
+    batch = run_batch(fix_file, [(file_name, args.track_id, args.dur) for file_name in args.files],
+                      args.jobs, args.chunk_size, args.quiet)
+    sys.exit(len(batch.failures) > 0)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
-"""Simple struct operations to pack and unpack numbers to strings."""
+"""Simple struct operations to pack and unpack numbers to strings, and
+arrays of 64-bit numbers."""
 
 # The copyright in this software is being made available under the BSD License,
 # included below. This software may be subject to other third party and contributor
@@ -29,8 +30,28 @@
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+from array import array
+from itertools import count as count_from, islice
 from struct import pack, unpack
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _uint64_typecode():
+    "Return an array typecode that holds 64-bit unsigned numbers."
+    for typecode in ('Q', 'L'):  # 'Q' is Python 3 only, 'L' is 64 bits on LP64
+        try:
+            if array(typecode).itemsize >= 8:
+                return typecode
+        except ValueError:
+            pass
+    return 'd'  # Exact up to 2 ** 53
+
+UINT64_TYPECODE = _uint64_typecode()
+
 
 def str_to_uint16(string2):
     "2-character string to unsigned int16."
@@ -70,3 +91,44 @@ def sint32_to_str(sint32):
 def uint64_to_str(uint64):
     "Unsigned int64 to string."
     return pack(">Q", uint64)
+
+
+def uint64_array(values=()):
+    "Return an array of 64-bit numbers (decode times, file offsets) with values."
+    return array(UINT64_TYPECODE, values)
+
+
+def running_sums(first, values, nr_values, inclusive=False):
+    """Return a uint64_array of first plus the sums of values before (or with
+    inclusive, up to and including) each of nr_values items.
+
+    values is a sequence, or a number that all items have. For a number, the
+    sums are made in C. For a sequence they are made with numpy.cumsum if
+    NumPy is available, and otherwise take one Python addition per value."""
+    if isinstance(values, (int, long)):
+        if inclusive:
+            first += values
+        return uint64_array(islice(count_from(first, values), nr_values))
+    if numpy is not None and nr_values:
+        if hasattr(values, 'typecode'):
+            values = numpy.frombuffer(values, dtype=values.typecode)
+        sums = numpy.cumsum(values, dtype=numpy.uint64)
+        if not inclusive:
+            sums = numpy.concatenate((numpy.zeros(1, numpy.uint64), sums[:-1]))
+        sums += numpy.uint64(first)
+        if UINT64_TYPECODE == 'd':
+            return uint64_array(sums.tolist())
+        result = uint64_array()
+        result.fromstring(sums.tostring())  # Both native 64-bit unsigned
+        return result
+    sums = uint64_array()
+    total = first
+    if inclusive:
+        for value in values:
+            total += value
+            sums.append(total)
+    else:
+        for value in values:
+            sums.append(total)
+            total += value
+    return sums
@@ -0,0 +1,264 @@
+"""Synthesize fragmented and progressive MP4 files.
+
+The files are structurally valid and parse with mp4.py and the filters, but
+the sample data is zeros. They are meant for tests and benchmarks at sizes
+and shapes that the files under test/data do not cover.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+import struct
+
+# trun flags
+DATA_OFFSET_PRESENT = 0x000001
+FIRST_SAMPLE_FLAGS_PRESENT = 0x000004
+SAMPLE_DURATION_PRESENT = 0x000100
+SAMPLE_SIZE_PRESENT = 0x000200
+SAMPLE_FLAGS_PRESENT = 0x000400
+SAMPLE_CTO_PRESENT = 0x000800
+
+# tfhd flags
+DEFAULT_SAMPLE_DURATION_PRESENT = 0x000008
+DEFAULT_SAMPLE_SIZE_PRESENT = 0x000010
+DEFAULT_SAMPLE_FLAGS_PRESENT = 0x000020
+DEFAULT_BASE_IS_MOOF = 0x020000
+
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+KID = '\x01' * 16
+CENC_SYSTEM_ID = '\x10\x77\xef\xec\xc0\xb2\x4d\x02\xac\xe3\x3c\x1e\x52\xe2\xfb\x4b'
+SPS = '\x67\x64\x00\x1f\xac\xd9\x40\x50\x05\xbb\x01\x10\x00\x00\x03\x00\x10\x00\x00\x03\x03\xc0'
+PPS = '\x68\xeb\xe3\xcb\x22\xc0'
+
+
+def make_box(box_type, *payloads):
+    "Return a box with the concatenated payloads."
+    payload = ''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def make_full_box(box_type, version, flags, *payloads):
+    "Return a full box with the concatenated payloads."
+    return make_box(box_type, struct.pack('>I', version << 24 | flags), *payloads)
+
+
+def make_sample_entry(width, height, encrypted):
+    "Return an avc1 (or encv) sample entry with avcC (and sinf)."
+    avcc = make_box('avcC', struct.pack('>BBBBBB', 1, 100, 0, 31, 0xff, 0xe1),
+                    struct.pack('>H', len(SPS)), SPS,
+                    struct.pack('>BH', 1, len(PPS)), PPS)
+    children = [avcc]
+    if encrypted:
+        tenc = make_full_box('tenc', 0, 0, struct.pack('>BBBB', 0, 0, 1, 8), KID)
+        children.append(make_box('sinf', make_box('frma', 'avc1'),
+                                 make_full_box('schm', 0, 0, 'cenc', struct.pack('>I', 0x10000)),
+                                 make_box('schi', tenc)))
+    return make_box(encrypted and 'encv' or 'avc1',
+                    '\x00' * 6, struct.pack('>H', 1),  # data_reference_index
+                    '\x00' * 16,
+                    struct.pack('>HHIII', width, height, 0x480000, 0x480000, 0),
+                    struct.pack('>H', 1), '\x00' * 32,  # frame_count, compressor
+                    struct.pack('>Hh', 0x18, -1),
+                    *children)
+
+
+def make_moov(track_id, timescale, duration, stbl_tables, mvex, encrypted,
+              width=640, height=360):
+    "Return a moov with one video track."
+    mvhd = make_full_box('mvhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, duration),
+                         struct.pack('>IH', 0x10000, 0x100), '\x00' * 10,
+                         struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000),
+                         '\x00' * 24, struct.pack('>I', track_id + 1))
+    tkhd = make_full_box('tkhd', 0, 7, struct.pack('>IIIII', 0, 0, track_id, 0, duration),
+                         '\x00' * 16,
+                         struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000),
+                         struct.pack('>II', width << 16, height << 16))
+    mdhd = make_full_box('mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, duration, 0x55c4, 0))
+    hdlr = make_full_box('hdlr', 0, 0, struct.pack('>I', 0), 'vide', '\x00' * 12, 'Synthetic\x00')
+    vmhd = make_full_box('vmhd', 0, 1, '\x00' * 8)
+    dinf = make_box('dinf', make_full_box('dref', 0, 0, struct.pack('>I', 1),
+                                          make_full_box('url ', 0, 1)))
+    stsd = make_full_box('stsd', 0, 0, struct.pack('>I', 1),
+                         make_sample_entry(width, height, encrypted))
+    stbl = make_box('stbl', stsd, *stbl_tables)
+    trak = make_box('trak', tkhd, make_box('mdia', mdhd, hdlr, make_box('minf', vmhd, dinf, stbl)))
+    children = [mvhd, trak]
+    if mvex:
+        children.append(mvex)
+    if encrypted:
+        children.append(make_full_box('pssh', 0, 0, CENC_SYSTEM_ID, struct.pack('>I', 0)))
+    return make_box('moov', *children)
+
+
+def make_table(box_type, rows, row_format, version=0):
+    "Return a sample table box with entry_count followed by rows."
+    return make_full_box(box_type, version, 0, struct.pack('>I', len(rows)),
+                         *[struct.pack('>' + row_format, *row) for row in rows])
+
+
+def make_init(track_id=1, timescale=90000, sample_duration=3000, encrypted=False):
+    "Return ftyp and moov of a fragmented track."
+    ftyp = make_box('ftyp', 'iso6', struct.pack('>I', 0), 'iso6', 'dash')
+    empty_tables = [make_table('stts', [], 'II'), make_table('stsc', [], 'III'),
+                    make_full_box('stsz', 0, 0, struct.pack('>II', 0, 0)), make_table('stco', [], 'I')]
+    mvex = make_box('mvex', make_full_box('trex', 0, 0, struct.pack('>5I', track_id, 1, sample_duration,
+                                                                    0, 0)))
+    return ftyp + make_moov(track_id, timescale, 0, empty_tables, mvex, encrypted)
+
+
+def make_emsg(number, timescale):
+    "Return an emsg box."
+    return make_full_box('emsg', 0, 0, 'urn:synthetic:event\x00', '%d\x00' % number,
+                         struct.pack('>IIII', timescale, 0, timescale, number), 'event data')
+
+
+def make_fragment(seq_nr, track_id, decode_time, sample_sizes, sample_duration,
+                  trun_flags, gop_length=30, encrypted=False):
+    "Return moof and mdat of one fragment."
+    nr_samples = len(sample_sizes)
+    flags = [i % gop_length and NON_SYNC_SAMPLE_FLAGS or SYNC_SAMPLE_FLAGS
+             for i in range(nr_samples)]
+    # B-frame like composition offsets
+    ctos = [(i % 3 == 1) and 2 * sample_duration or sample_duration for i in range(nr_samples)]
+
+    tfhd_flags = DEFAULT_BASE_IS_MOOF
+    tfhd_fields = ''
+    if not trun_flags & SAMPLE_DURATION_PRESENT:
+        tfhd_flags |= DEFAULT_SAMPLE_DURATION_PRESENT
+        tfhd_fields += struct.pack('>I', sample_duration)
+    if not trun_flags & SAMPLE_SIZE_PRESENT:
+        tfhd_flags |= DEFAULT_SAMPLE_SIZE_PRESENT
+        tfhd_fields += struct.pack('>I', sample_sizes[0])
+        sample_sizes = [sample_sizes[0]] * nr_samples
+    if not trun_flags & SAMPLE_FLAGS_PRESENT:
+        tfhd_flags |= DEFAULT_SAMPLE_FLAGS_PRESENT
+        tfhd_fields += struct.pack('>I', NON_SYNC_SAMPLE_FLAGS)
+    tfhd = make_full_box('tfhd', 0, tfhd_flags, struct.pack('>I', track_id), tfhd_fields)
+    tfdt = make_full_box('tfdt', 1, 0, struct.pack('>Q', decode_time))
+
+    row_format = ''
+    columns = []
+    for flag, column in ((SAMPLE_DURATION_PRESENT, [sample_duration] * nr_samples),
+                         (SAMPLE_SIZE_PRESENT, sample_sizes),
+                         (SAMPLE_FLAGS_PRESENT, flags),
+                         (SAMPLE_CTO_PRESENT, ctos)):
+        if trun_flags & flag:
+            row_format += 'I'
+            columns.append(column)
+    rows = ''.join(struct.pack('>' + row_format, *row) for row in zip(*columns)) if columns else ''
+
+    encryption_boxes = []
+    if encrypted:
+        encryption_boxes.append(make_full_box('saiz', 0, 0, struct.pack('>BI', 8, nr_samples)))
+        encryption_boxes.append(None)  # saio, once the senc position is known
+        encryption_boxes.append(make_full_box('senc', 0, 0, struct.pack('>I', nr_samples),
+                                              *[struct.pack('>Q', seq_nr << 32 | i)
+                                                for i in range(nr_samples)]))
+
+    def make_moof(data_offset, senc_offset):
+        trun_fields = struct.pack('>I', nr_samples)
+        if trun_flags & DATA_OFFSET_PRESENT:
+            trun_fields += struct.pack('>i', data_offset)
+        if trun_flags & FIRST_SAMPLE_FLAGS_PRESENT:
+            trun_fields += struct.pack('>I', SYNC_SAMPLE_FLAGS)
+        trun = make_full_box('trun', 0, trun_flags, trun_fields, rows)
+        traf_children = [tfhd, tfdt, trun]
+        if encrypted:
+            saio = make_full_box('saio', 0, 0, struct.pack('>II', 1, senc_offset))
+            traf_children += [encryption_boxes[0], saio, encryption_boxes[2]]
+        return make_box('moof', make_full_box('mfhd', 0, 0, struct.pack('>I', seq_nr)),
+                        make_box('traf', *traf_children))
+
+    # Sizes do not depend on the offsets, so a first pass gives them
+    moof = make_moof(0, 0)
+    senc_offset = len(moof) - len(encrypted and encryption_boxes[2] or '') + 16
+    moof = make_moof(len(moof) + 8, senc_offset)
+    mdat = make_box('mdat', '\x00' * sum(sample_sizes))
+    return moof + mdat
+
+
+def make_fragmented(nr_fragments=10, samples_per_fragment=60, sample_size=200,
+                    trun_flags=0xf01, encrypted=False, emsg_per_fragment=0,
+                    sidx=True, track_id=1, timescale=90000, sample_duration=3000):
+    """Return a fragmented track: init, optional sidx and fragments.
+
+    trun_flags selects which per-sample fields are in the trun. Absent
+    durations, sizes and flags are given as tfhd defaults. The sample sizes
+    vary around sample_size unless they come from tfhd."""
+    fragments = []
+    for nr in range(nr_fragments):
+        sample_sizes = [sample_size + (i * 37) % 64 for i in range(samples_per_fragment)]
+        fragment = ''.join(make_emsg(nr * emsg_per_fragment + i, timescale)
+                           for i in range(emsg_per_fragment))
+        fragment += make_fragment(nr + 1, track_id, nr * samples_per_fragment * sample_duration,
+                                  sample_sizes, sample_duration, trun_flags, encrypted=encrypted)
+        fragments.append(fragment)
+    init = make_init(track_id, timescale, sample_duration, encrypted)
+    if not sidx:
+        return init + ''.join(fragments)
+    fragment_duration = samples_per_fragment * sample_duration
+    references = ''.join(struct.pack('>III', len(fragment), fragment_duration, 0x90000000)
+                         for fragment in fragments)
+    sidx_box = make_full_box('sidx', 0, 0, struct.pack('>IIII', track_id, timescale, 0, 0),
+                             struct.pack('>HH', 0, nr_fragments), references)
+    return init + sidx_box + ''.join(fragments)
+
+
+def make_progressive(nr_samples=3000, samples_per_chunk=30, sample_size=200, gop_length=30,
+                     track_id=1, timescale=90000, sample_duration=3000):
+    "Return a progressive (non-fragmented) track with ftyp, moov and mdat."
+    sample_sizes = [sample_size + (i * 37) % 64 for i in range(nr_samples)]
+    nr_chunks = (nr_samples + samples_per_chunk - 1) // samples_per_chunk
+    stsc_rows = [(1, samples_per_chunk, 1)]
+    if nr_samples % samples_per_chunk:
+        stsc_rows.append((nr_chunks, nr_samples % samples_per_chunk, 1))
+    ctts_rows = [(1, (i % 3 == 1) and 2 * sample_duration or sample_duration)
+                 for i in range(nr_samples)]
+
+    def make_tables(chunk_offsets):
+        return [make_table('stts', [(nr_samples, sample_duration)], 'II'),
+                make_table('ctts', ctts_rows, 'II'),
+                make_table('stss', [(i + 1,) for i in range(0, nr_samples, gop_length)], 'I'),
+                make_table('stsc', stsc_rows, 'III'),
+                make_full_box('stsz', 0, 0, struct.pack('>II', 0, nr_samples),
+                              struct.pack('>%dI' % nr_samples, *sample_sizes)),
+                make_table('stco', [(offset,) for offset in chunk_offsets], 'I')]
+
+    ftyp = make_box('ftyp', 'isom', struct.pack('>I', 0), 'isom', 'avc1')
+    duration = nr_samples * sample_duration
+    header_size = len(ftyp) + len(make_moov(track_id, timescale, duration,
+                                             make_tables([0] * nr_chunks), None, False)) + 8
+    chunk_offsets = []
+    offset = header_size
+    for chunk in range(nr_chunks):
+        chunk_offsets.append(offset)
+        offset += sum(sample_sizes[chunk * samples_per_chunk:(chunk + 1) * samples_per_chunk])
+    moov = make_moov(track_id, timescale, duration, make_tables(chunk_offsets), None, False)
+    return ftyp + moov + make_box('mdat', '\x00' * sum(sample_sizes))
@@ -0,0 +1,91 @@
+"""
+Test the parallel batch runner
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import test_utils
+from test_utils import read_tfdt
+import batch_runner
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(5):
+            path = os.path.join(self.tmp_dir, '%d.m4s' % i)
+            shutil.copyfile(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), path)
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_chunk_size(self):
+        self.assertEquals(batch_runner.chunk_size_for(10, 4), 1)
+        self.assertEquals(batch_runner.chunk_size_for(800, 4), 50)
+        self.assertEquals(batch_runner.chunk_size_for(40000, 32), batch_runner.MAX_CHUNK_SIZE)
+
+    def test_chunk_size_argument(self):
+        parser = argparse.ArgumentParser()
+        batch_runner.add_batch_arguments(parser)
+        self.assertEquals(parser.parse_args(['--chunk-size', '3']).chunk_size, 3)
+        for value in ('0', '-2'):
+            self.assertRaises(SystemExit, parser.parse_args, ['--chunk-size', value])
+        self.assertRaises(AssertionError, batch_runner.run_batch, read_tfdt,
+                          [(path,) for path in self.files], chunk_size=0, quiet=True)
+
+    def test_run_batch(self):
+        tasks = [(path,) for path in self.files + [os.path.join(self.tmp_dir, 'missing.m4s')]]
+        for jobs, chunk_size in ((1, None), (3, None), (3, 2), (2, 4)):
+            batch = batch_runner.run_batch(read_tfdt, tasks, jobs=jobs, chunk_size=chunk_size,
+                                           quiet=True)
+            self.assertEquals(len(batch), 6)
+            self.assertEquals(sorted(batch.results),
+                              [((path,), 0) for path in self.files])
+            self.assertEquals(len(batch.failures), 1)
+            self.assertEquals(batch.failures[0][0], tasks[-1])
+            self.assertTrue('IOError' in batch.failures[0][1])
+            self.assertEquals(batch.nr_bytes, 5 * os.path.getsize(self.files[0]))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBatchRunner)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
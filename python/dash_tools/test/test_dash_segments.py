@@ -32,11 +32,15 @@ Test parsing of MPEG-DASH Segments
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import shutil
+import struct
 import sys
+import tempfile
 import unittest
 
 import test_utils
 import mp4
+import synthetic_mp4
 
 class TestDASHSegments(unittest.TestCase):
 
@@ -170,6 +174,231 @@ class TestDASHSegments(unittest.TestCase):
         self.assertTrue(trun)
         self.assertEquals(trun.sample_count, 180)
 
+    def test_open_memory_mapped_lazy(self):
+
+        root = mp4.open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'))
+
+        # only top-level boxes are known until a container is touched
+        self.assertEquals([b.type for b in root.children], ['styp', 'moof', 'mdat'])
+        moof = root.children[1]
+        self.assertTrue(moof.is_unparsed)
+
+        trun = root.find('moof.traf.trun')
+        self.assertFalse(moof.is_unparsed)
+        self.assertEquals(trun.sample_count, 180)
+        self.assertEquals(trun.total_duration, 540000)
+        self.assertEquals(root.find('moof.traf.tfhd').track_id, 5)
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+        self.assertEquals(root.description(), mp4.mp4(data).description())
+        root.close()
+
+    def test_trun_columns(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+
+        trun = mp4.mp4(data).find('moof.traf.trun')
+        self.assertEquals(trun._columns, None)  # Nothing decoded before use
+        self.assertEquals(trun.total_duration, 540000)
+        self.assertEquals(len(trun.durations), 180)
+        self.assertEquals(sum(trun.durations), trun.total_duration)
+        self.assertEquals(sum(trun.sizes), 24956 - 8)
+        self.assertEquals(trun.decode_times[0], 0)
+        self.assertEquals(trun.decode_times[-1], 540000 - 3000)
+        self.assertEquals(trun.composition_offsets[0], trun.first_cto)
+
+        entry = trun.sample_entry(1)
+        self.assertEquals(entry['duration'], 3000)
+        self.assertEquals(entry['size'], 13)
+        self.assertEquals(entry['flags'], '0x1000000')
+        self.assertEquals(entry['time_offset'], 15000)
+
+    def test_trun_64_bit_decode_times(self):
+        decode_time = 2 ** 40 + 1
+        data = synthetic_mp4.make_fragment(1, 1, decode_time, [100] * 4, 3000, 0x301)
+        trun = mp4.mp4(data).find('moof.traf.trun')
+        self.assertEquals(list(trun.decode_times),
+                          [decode_time, decode_time + 3000, decode_time + 6000, decode_time + 9000])
+
+    def test_find_compiled_paths(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+
+        root = mp4.mp4(data)
+        trun = root.find('moof.traf.tfhd[track_id=5]..trun')
+        self.assertEquals(trun.sample_count, 180)
+        self.assertFalse(root.find('moof.traf.tfhd[track_id=1]..trun'))
+        self.assertTrue(mp4.compile_path('moof.traf.tfhd[track_id=5]..trun') is
+                        mp4.compile_path('moof.traf.tfhd[track_id=5]..trun'))
+
+        mfhd = root.find('moof.mfhd')
+        self.assertTrue(mfhd.find('.traf.trun') is trun)
+        self.assertEquals(root.find('moof.traf', return_first=False), [trun.parent])
+        self.assertEquals([b.type for b in root.find('moof.traf.*', return_first=False)], [])
+
+        for track_id in range(mp4.MAX_COMPILED_PATHS + 10):
+            mp4.compile_path('moof.traf.tfhd[track_id=%d]..trun' % track_id)
+            self.assertTrue(len(mp4.COMPILED_PATHS) <= mp4.MAX_COMPILED_PATHS)
+        self.assertTrue(root.find('moof.traf.tfhd[track_id=5]..trun') is trun)
+
+    def test_box_index(self):
+
+        def walk(a_box, depth, rows):
+            for child in a_box.children:
+                rows.append((child.offset, child.size, child.type, depth))
+                walk(child, depth + 1, rows)
+            return rows
+
+        for name in ('data/video_init.mp4', 'data/video_segment.m4s'):
+            path = os.path.join(test_utils.TEST_PATH, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            index = mp4.BoxIndex.from_file(path)
+            rows = [(index.offsets[i], index.sizes[i], index.box_type(i), index.depths[i])
+                    for i in range(len(index))]
+            self.assertEquals(rows, walk(mp4.mp4(data), 0, []))
+            index.close()
+
+        index = mp4.BoxIndex(data)
+        self.assertEquals([index.box_type(i) for i in index.children()], ['styp', 'moof', 'mdat'])
+        trun_index = index.find('moof.traf.trun')
+        self.assertEquals(index.box_type(index.parents[trun_index]), 'traf')
+        self.assertEquals(index.find('moof.traf.xxxx'), None)
+        self.assertEquals(index.find('styp'), 0)
+        trun = index.get(trun_index)
+        self.assertEquals(trun.sample_count, 180)
+        self.assertEquals(trun.parent.type, 'traf')
+        self.assertTrue(index.get(trun_index) is trun)
+
+    def test_box_index_cache(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'track.mp4')
+            with open(path, 'wb') as ofh:
+                for name in ('data/video_init.mp4', 'data/video_segment.m4s'):
+                    with open(os.path.join(test_utils.TEST_PATH, name), 'rb') as ifh:
+                        ofh.write(ifh.read())
+
+            index = mp4.BoxIndex.cached(path, write=True)
+            index.close()
+            self.assertTrue(os.path.exists(path + mp4.INDEX_CACHE_SUFFIX))
+
+            fmap = mp4.map_file(path)
+            cached = mp4.BoxIndex.load(path, fmap)
+            self.assertEquals(list(cached.offsets), list(index.offsets))
+            self.assertEquals(list(cached.types), list(index.types))
+            self.assertEquals(cached.summaries, index.summaries)
+            fragment = cached.summaries['fragments'][0]
+            self.assertEquals(fragment['duration'], 540000)
+            self.assertEquals(fragment['nr_truns'], 1)
+            self.assertEquals(cached.summaries['timescale'], 90000)
+
+            root = mp4.open(path)
+            self.assertEquals(root.find('moof.traf.trun').sample_count, 180)
+            with open(path, 'rb') as ifh:
+                self.assertEquals(root.description(), mp4.mp4(ifh.read()).description())
+            root.close()
+
+            # A changed file invalidates the cache
+            with open(path, 'ab') as ofh:
+                ofh.write(struct.pack('>I4s', 8, 'free'))
+            self.assertEquals(mp4.BoxIndex.load(path, mp4.map_file(path)), None)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_stream_parser(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+
+        payload = []
+        parser = mp4.StreamParser(payload_callback=lambda b, chunk: payload.append(chunk))
+        boxes = []
+        for offset in range(0, len(data), 1000):
+            boxes.extend(parser.feed(data[offset:offset + 1000]))
+        boxes.extend(parser.close())
+
+        self.assertEquals([b.type for b in boxes], ['styp', 'moof', 'mdat'])
+        self.assertEquals([b.stream_offset for b in boxes], [0, 24, 2988])
+        self.assertEquals(boxes[1].find('traf.trun').sample_count, 180)
+        self.assertEquals(boxes[2].size, len(data) - 2988)
+        self.assertEquals(''.join(payload), data[2988 + 8:])
+
+        # no passthrough, byte by byte, and a last box of size 0
+        parser = mp4.StreamParser(passthrough=())
+        stream = data[:2988] + '\0\0\0\0' + data[2992:]
+        boxes = []
+        for offset in range(len(stream)):
+            boxes.extend(parser.feed(stream[offset]))
+        self.assertEquals([b.type for b in boxes], ['styp', 'moof'])
+        boxes.extend(parser.close())
+        self.assertEquals(boxes[2].type, 'mdat')
+        self.assertEquals(boxes[2].size, len(data) - 2988)
+
+    def test_stream_parser_split_points(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+        # a small last box must not be held back waiting for a largesize header
+        stream = data[:2988] + struct.pack('>I4s', 8, 'free')
+        largesize = struct.pack('>I4sQ', 1, 'free', 20) + 'abcd'
+
+        for tail in ('', largesize):
+            for split in range(len(stream + tail) + 1):
+                parser = mp4.StreamParser(passthrough=())
+                boxes = parser.feed((stream + tail)[:split])
+                boxes.extend(parser.feed((stream + tail)[split:]))
+                boxes.extend(parser.close())
+                types = ['styp', 'moof', 'free'] + (['free'] if tail else [])
+                self.assertEquals([b.type for b in boxes], types)
+                self.assertEquals(boxes[2].stream_offset, 2988)
+                if tail:
+                    self.assertEquals(boxes[3].size, 20)
+
+    def test_stream_parser_faulty_size(self):
+        free = struct.pack('>I4s', 8, 'free')
+        for passthrough in (('mdat',), ()):
+            parser = mp4.StreamParser(passthrough=passthrough)
+            self.assertRaises(ValueError, parser.feed, struct.pack('>I4s', 4, 'mdat') + free)
+            # and with the header split over two chunks
+            parser = mp4.StreamParser(passthrough=passthrough)
+            self.assertEquals(parser.feed(struct.pack('>I4s', 4, 'mdat')[:6]), [])
+            self.assertRaises(ValueError, parser.feed, 'at' + free)
+
+        # An empty mdat does not swallow the boxes after it
+        parser = mp4.StreamParser()
+        boxes = parser.feed(struct.pack('>I4s', 8, 'mdat') + free)
+        boxes.extend(parser.close())
+        self.assertEquals([(b.type, b.size) for b in boxes], [('mdat', 8), ('free', 8)])
+
+    def test_synthetic_fragmented(self):
+        data = synthetic_mp4.make_fragmented(nr_fragments=3, samples_per_fragment=20,
+                                             trun_flags=0x205, encrypted=True,
+                                             emsg_per_fragment=1)
+        root = mp4.mp4(data)
+        self.assertEquals([b.type for b in root.children],
+                          ['ftyp', 'moov', 'sidx'] + ['emsg', 'moof', 'mdat'] * 3)
+        self.assertEquals(root.find('moov.trak.mdia.mdhd').timescale, 90000)
+        self.assertTrue(root.find('moov.trak.mdia.minf.stbl.stsd.encv.sinf.schi.tenc'))
+        sidx = root.find('sidx')
+        for i, moof in enumerate(root.find_all('moof')):
+            trun = moof.find('traf.trun')
+            mdat = moof.get_mdat()
+            self.assertEquals(moof.offset + trun.data_offset, mdat.offset + 8)
+            self.assertEquals(sum(trun.sizes), mdat.size - 8)
+            self.assertEquals(moof.find('traf.tfdt').decode_time, i * 20 * 3000)
+            senc = moof.find('traf.senc')
+            self.assertEquals(moof.offset + moof.find('traf.saio').entry_offset(0),
+                              senc.offset + 16)
+            emsg = root.find_all('emsg')[i]
+            self.assertEquals(sidx.reference_entry(i)['referenced-size'],
+                              mdat.offset + mdat.size - emsg.offset)
+        root.description()
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestDASHSegments)
     result = unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,112 @@
+"""
+Test the init segment info cache
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import test_utils
+import init_info
+import mp4filter
+import synthetic_mp4
+from init_info import get_init_info
+
+VIDEO_INIT = os.path.join(test_utils.TEST_PATH, 'data/video_init.mp4')
+AUDIO_INIT = os.path.join(test_utils.TEST_PATH, 'data/audio_init.mp4')
+
+
+class TestInitInfo(unittest.TestCase):
+
+    def setUp(self):
+        init_info.clear_init_cache()
+
+    def test_tracks(self):
+        info = get_init_info(VIDEO_INIT)
+        self.assertEquals(info.track_ids, [5])
+        self.assertEquals((info.timescale, info.handler_type), (90000, 'vide'))
+        self.assertEquals(info.first_track.default_sample_description_index, 1)
+        self.assertTrue(info.first_track.protection is None)
+        info = get_init_info(AUDIO_INIT)
+        self.assertEquals((info.timescale, info.handler_type), (48000, 'soun'))
+        self.assertEquals(mp4filter.get_timescale(AUDIO_INIT), 48000)
+
+    def test_protection(self):
+        data = synthetic_mp4.make_init(2, 25000, 1000, True)
+        info = get_init_info(data=data)
+        track = info.tracks[2]
+        self.assertEquals((track.timescale, track.default_sample_duration), (25000, 1000))
+        self.assertEquals(track.protection['scheme'], 'cenc')
+        self.assertEquals(track.protection['format'], 'avc1')
+        self.assertEquals(track.protection['kid'], synthetic_mp4.KID.encode('hex').upper())
+        self.assertEquals([pssh['system_id'] for pssh in info.pssh],
+                          [synthetic_mp4.CENC_SYSTEM_ID.encode('hex').upper()])
+
+    def test_cached_per_file_version(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'init.mp4')
+            shutil.copyfile(VIDEO_INIT, path)
+            info = get_init_info(path)
+            self.assertTrue(get_init_info(path) is info)
+            shutil.copyfile(AUDIO_INIT, path)
+            os.utime(path, (0, 0))
+            self.assertEquals(get_init_info(path).handler_type, 'soun')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cached_per_content(self):
+        with open(VIDEO_INIT, 'rb') as ifh:
+            data = ifh.read()
+        info = get_init_info(data=data)
+        self.assertTrue(get_init_info(data=data[:]) is info)
+
+    def test_lru_eviction(self):
+        cache_size = init_info.INIT_CACHE_SIZE
+        init_info.INIT_CACHE_SIZE = 2
+        try:
+            video = get_init_info(VIDEO_INIT)
+            get_init_info(AUDIO_INIT)
+            get_init_info(VIDEO_INIT)  # Now most recently used
+            get_init_info(data=synthetic_mp4.make_init(1, 90000, 3000, False))
+            self.assertTrue(get_init_info(VIDEO_INIT) is video)
+            self.assertEquals(len(init_info._init_cache), 2)
+        finally:
+            init_info.INIT_CACHE_SIZE = cache_size
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestInitInfo)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,208 @@
+"""
+Test MP4 filters
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import test_utils
+import backup_handler
+import mp4
+import mp4filter
+import mediacleaner
+import synthetic_mp4
+
+
+class TestMP4Filter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'segment.m4s')
+        shutil.copyfile(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_output_plan(self):
+        source = '0123456789'
+        plan = mp4filter.OutputPlan()
+        plan.add_range(0, 2)
+        plan.add_range(2, 3)
+        plan.add_bytes('ab')
+        plan.add_bytes('')
+        plan.add_range(7, 3)
+        self.assertEquals(plan.fragments, [(0, 5), 'ab', (7, 3)])
+        self.assertEquals(plan.size, 10)
+        self.assertEquals(plan.tostring(source), '01234ab789')
+
+    def test_plan_keeps_mdat_as_range(self):
+        tfilter = mp4filter.TfdtFilter(self.path, offset=1000)
+        plan = tfilter.filter_plan()
+        # styp is copied, moof is rewritten and mdat is copied
+        self.assertEquals(plan.fragments[0], (0, 24))
+        self.assertEquals(len(plan.fragments[1]), 2964)
+        self.assertEquals(plan.fragments[2], (2988, len(tfilter.data) - 2988))
+
+    def test_filter_to_file(self):
+        expected = mp4filter.TfdtFilter(self.path, offset=1000).filter_top_boxes()
+        out_path = os.path.join(self.tmp_dir, 'out.m4s')
+        size = mp4filter.TfdtFilter(self.path, offset=1000).filter_to_file(out_path)
+        self.assertEquals(size, len(expected))
+        with open(out_path, 'rb') as ifh:
+            self.assertEquals(ifh.read(), expected)
+
+        # in place, with a large mdat copied in blocks
+        data = synthetic_mp4.make_fragmented(nr_fragments=2, sample_size=20000, sidx=False)
+        with open(self.path, 'wb') as ofh:
+            ofh.write(data)
+        expected = mp4filter.SidxFilter(self.path).filter_top_boxes()
+        self.assertEquals(expected, data)
+        mp4filter.TfdtFilter(self.path, offset=1000).filter_to_file(self.path)
+        tfilter = mp4filter.TfdtFilter(self.path)
+        tfilter.filter_top_boxes()
+        self.assertEquals(tfilter.get_tfdt_value(), 1000 + 60 * 3000)
+        self.assertEquals(len(tfilter.data), len(data))
+
+    def test_filter_stream(self):
+        data = synthetic_mp4.make_fragmented(nr_fragments=2, sample_size=20000)
+        with open(self.path, 'wb') as ofh:
+            ofh.write(data)
+        expected = mp4filter.TfdtFilter(self.path, offset=1000).filter_top_boxes()
+        ofh = io.BytesIO()
+        size = mp4filter.TfdtFilter(None, offset=1000).filter_stream(io.BytesIO(data), ofh)
+        self.assertEquals(size, len(expected))
+        self.assertEquals(ofh.getvalue(), expected)
+
+        # sidx is dropped, everything else is copied
+        cleaner = mediacleaner.MediaCleanFilter(new_track_id=2)
+        ofh = io.BytesIO()
+        cleaner.filter_stream(io.BytesIO(data), ofh)
+        self.assertEquals([box_type for _, box_type in cleaner.top_level_boxes],
+                          ['ftyp', 'moov', 'sidx', 'moof', 'mdat', 'moof', 'mdat'])
+        sidx_size = cleaner.top_level_boxes[2][0]
+        self.assertEquals(len(ofh.getvalue()), len(data) - sidx_size)
+
+    def test_filter_stream_finalize(self):
+
+        class HeaderFilter(mp4filter.MP4Filter):
+            "Overwrite the first four bytes after filtering."
+
+            def finalize(self):
+                self.output = 'abcd' + self.output[4:]
+
+        with open(self.path, 'rb') as ifh:
+            data = ifh.read()
+        ofh = io.BytesIO()
+        with open(self.path, 'rb') as ifh:
+            HeaderFilter().filter_stream(ifh, ofh)
+        self.assertEquals(ofh.getvalue(), 'abcd' + data[4:])
+
+    def test_patch_file(self):
+        with open(self.path, 'rb') as ifh:
+            original = ifh.read()
+        expected = mp4filter.TfdtFilter(self.path, offset=1000, seq_nr=7).filter_top_boxes()
+        patches = mp4filter.TfdtFilter(self.path, offset=1000, seq_nr=7).patch_file(journal=True)
+        # 16-byte blocks with the mfhd sequence number and the tfdt
+        self.assertEquals([(offset, len(data)) for offset, data in patches], [(40, 16), (72, 16)])
+        with open(self.path, 'rb') as ifh:
+            self.assertEquals(ifh.read(), expected)
+        self.assertTrue(os.path.exists(self.path + backup_handler.JOURNAL_FILE_SUFFIX))
+        self.assertRaises(backup_handler.BackupError,
+                          mp4filter.TfdtFilter(self.path, offset=1000).patch_file, True)
+
+        backup_handler.restore_from_journal(self.path)
+        with open(self.path, 'rb') as ifh:
+            self.assertEquals(ifh.read(), original)
+        self.assertFalse(os.path.exists(self.path + backup_handler.JOURNAL_FILE_SUFFIX))
+
+        # Unchanged and size-changing edits leave the file alone
+        self.assertEquals(mp4filter.TfdtFilter(self.path).patch_file(), [])
+        data = synthetic_mp4.make_fragmented(nr_fragments=2)
+        with open(self.path, 'wb') as ofh:
+            ofh.write(data)
+        self.assertEquals(mp4filter.SidxFilter(self.path).patch_file(), None)
+        with open(self.path, 'rb') as ifh:
+            self.assertEquals(ifh.read(), data)
+
+    def test_patch_init_file(self):
+        shutil.copyfile(os.path.join(test_utils.TEST_PATH, 'data/video_init.mp4'), self.path)
+        expected = mp4filter.InitLiveFilter(self.path).filter_top_boxes()
+        self.assertTrue(mp4filter.InitLiveFilter(self.path).patch_file())
+        with open(self.path, 'rb') as ifh:
+            self.assertEquals(ifh.read(), expected)
+
+    def test_filter_pipeline(self):
+        data = synthetic_mp4.make_fragmented(nr_fragments=3)
+        # One filter at a time
+        expected = data
+        for stage in (mediacleaner.MediaCleanFilter(new_track_id=2),
+                      mp4filter.TfdtFilter(None, offset=1000, seq_nr=5)):
+            stage.data = expected
+            expected = stage.filter_top_boxes()
+
+        stages = [mediacleaner.MediaCleanFilter(new_track_id=2),
+                  mp4filter.TfdtFilter(None, offset=1000, seq_nr=5),
+                  mp4filter.SidxFilter()]
+        pipeline = mp4filter.FilterPipeline(stages, data=data)
+        self.assertEquals(pipeline.relevant_boxes, ['free', 'moof', 'sidx', 'skip'])
+        self.assertEquals(pipeline.filter_top_boxes(), expected)
+        self.assertEquals(stages[1].get_tfdt_value(), 1000 + 2 * 60 * 3000)
+
+    def test_box_handlers(self):
+
+        class DropTfdt(mp4filter.MP4Filter):
+            "Drop tfdt."
+            box_handlers = {'moof.traf.tfdt': 'drop_box'}
+
+        tree = DropTfdt.handler_tree()
+        self.assertEquals(sorted(tree.children), ['moof'])
+        self.assertEquals(tree.children['moof'].children['traf'].children['tfdt'].handler,
+                          'drop_box')
+        tfilter = DropTfdt(self.path)
+        self.assertEquals(tfilter.relevant_boxes, ['moof'])
+        output = tfilter.filter_top_boxes()
+        self.assertEquals(len(output), len(tfilter.data) - 16)
+        root = mp4.mp4(output)
+        self.assertEquals([b.type for b in root.find('moof.traf').children], ['tfhd', 'trun'])
+        self.assertEquals(root.find('moof').size, 2964 - 16)
+        self.assertEquals(root.find('mdat').size, len(tfilter.data) - 2988)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMP4Filter)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
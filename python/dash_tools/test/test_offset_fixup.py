@@ -0,0 +1,127 @@
+"""
+Test the offset fix-ups after size-changing filter edits
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import unittest
+from cStringIO import StringIO
+
+import test_utils
+import mp4
+import synthetic_mp4
+from mp4filter import MP4Filter, SidxFilter
+from offset_fixup import PositionMap
+from trun_codec import TrunCodec
+
+
+class ShortenFilter(MP4Filter):
+    "Keep half of the samples in each trun and drop saiz, leaving mdat as it is."
+
+    box_handlers = {"moof.traf.trun": "process_trun",
+                    "moof.traf.saiz": "drop_box"}
+
+    def process_trun(self, data):
+        trun = TrunCodec(data)
+        trun.keep_samples(0, trun.sample_count // 2)
+        return trun.encode()
+
+
+class TestOffsetFixup(unittest.TestCase):
+
+    def get_data(self):
+        return synthetic_mp4.make_fragmented(nr_fragments=3, samples_per_fragment=6,
+                                             encrypted=True)
+
+    def check_offsets(self, data, check_sidx=True):
+        root = mp4.mp4(data)
+        boxes = root.children
+        for i, box in enumerate(boxes):
+            if box.type != 'moof':
+                continue
+            mdat = boxes[i + 1]
+            self.assertEquals(mdat.type, 'mdat')
+            self.assertEquals(box.size, sum(child.size for child in box.children) + 8)
+            traf = box.find('traf')
+            self.assertEquals(traf.size, sum(child.size for child in traf.children) + 8)
+            self.assertEquals(box.offset + traf.find('trun').data_offset, mdat.offset + 8)
+            self.assertEquals(box.offset + traf.find('saio').entry_offset(0),
+                              traf.find('senc').offset + 16)
+        if check_sidx:
+            sidx = root.find('sidx')
+            moofs = [box for box in boxes if box.type == 'moof']
+            self.assertEquals(sidx.offset + sidx.size + sidx.first_offset, moofs[0].offset)
+            for i, reference in enumerate(sidx.references):
+                end = moofs[i + 1].offset if i + 1 < len(moofs) else len(data)
+                self.assertEquals(reference['referenced-size'], end - moofs[i].offset)
+
+    def test_input_is_consistent(self):
+        self.check_offsets(self.get_data())
+
+    def test_size_changes_are_fixed(self):
+        data = self.get_data()
+        output = ShortenFilter(data=data).filter_top_boxes()
+        self.assertTrue(len(output) < len(data))
+        self.check_offsets(output)
+
+    def test_unchanged_sizes_keep_output(self):
+        data = self.get_data()
+        filt = SidxFilter(data=data)
+        filt.relevant_boxes = []
+        self.assertEquals(filt.filter_top_boxes(), data)
+
+    def test_dropped_sidx(self):
+        data = self.get_data()
+        output = SidxFilter(data=data).filter_top_boxes()
+        self.assertEquals(len(output), len(data) - mp4.mp4(data).find('sidx').size)
+        self.check_offsets(output, check_sidx=False)
+
+    def test_stream_fixes_moof(self):
+        data = self.get_data()
+        ofh = StringIO()
+        ShortenFilter().filter_stream(StringIO(data), ofh)
+        self.check_offsets(ofh.getvalue(), check_sidx=False)
+
+    def test_position_map(self):
+        position_map = PositionMap()
+        position_map.add(0, 100, 0, 100)
+        position_map.add(100, 50, 100, 20)  # Shortened box
+        position_map.add(150, 10, 120, 0)  # Dropped box
+        position_map.add(160, 40, 120, 40)
+        self.assertTrue(position_map.moved)
+        self.assertEquals([position_map.map(pos) for pos in (50, 100, 110, 149, 155, 160, 200, 210)],
+                          [50, 100, 110, 120, 120, 120, 160, 170])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestOffsetFixup)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
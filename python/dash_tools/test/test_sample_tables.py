@@ -0,0 +1,126 @@
+"""
+Test progressive MP4 sample tables
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import struct
+import sys
+import unittest
+
+import test_utils
+import mp4
+import sample_tables
+from synthetic_mp4 import make_full_box, make_table
+
+
+class TestSampleTables(unittest.TestCase):
+
+    def setUp(self):
+        self.stts = mp4.mp4(make_table('stts', [(3, 100), (0, 7), (2, 50)], 'II')).children[0]
+        self.ctts = mp4.mp4(make_table('ctts', [(1, 200), (2, -100), (2, 0)], 'Ii', 1)).children[0]
+        self.stsc = mp4.mp4(make_table('stsc', [(1, 2, 1), (3, 1, 1), (4, 3, 1)], 'III')).children[0]
+
+    def test_stts_runs(self):
+        stts = self.stts
+        self.assertEquals(stts.sample_count, 5)
+        self.assertEquals(stts.total_duration, 400)
+        self.assertEquals([stts.time_for_sample(i) for i in range(1, 6)], [0, 100, 200, 300, 350])
+        self.assertEquals(stts.delta_for_sample(4), 50)
+        self.assertEquals([stts.sample_for_time(t) for t in (0, 99, 100, 299, 300, 349, 350, 1000)],
+                          [1, 1, 2, 3, 4, 4, 5, 5])
+        self.assertRaises(IndexError, stts.time_for_sample, 6)
+        self.assertEquals(stts.entry(2), {'sample_count': 2, 'sample_delta': 50})
+
+        stts.unroll()
+        for i in range(1, 6):
+            self.assertEquals(stts.array[i], {'time': stts.time_for_sample(i),
+                                              'delta': stts.delta_for_sample(i)})
+
+    def test_ctts_signed_runs(self):
+        ctts = self.ctts
+        self.assertEquals([ctts.cto_for_sample(i) for i in range(1, 6)], [200, -100, -100, 0, 0])
+        self.assertEquals(sample_tables.sample_offset(ctts, 2), -100)
+        ctts.unroll()
+        self.assertEquals(ctts.array, [0, 200, -100, -100, 0, 0])
+
+    def test_stsc_runs(self):
+        stsc = self.stsc
+        expected = [(1, 0), (1, 1), (2, 0), (2, 1), (3, 0), (4, 0), (4, 1), (4, 2), (5, 0)]
+        self.assertEquals([stsc.chunk_for_sample(i) for i in range(1, 10)], expected)
+        self.assertEquals([stsc.first_sample_of_chunk(c) for c in range(1, 6)], [1, 3, 5, 6, 9])
+        self.assertEquals(sample_tables.sample_to_chunk_and_index(stsc, 7), (4, 1))
+
+        stsc.unroll()
+        self.assertEquals([stsc.get_unrolled(i) for i in range(1, 10)], expected)
+
+    def test_sample_index(self):
+        sizes = [10 * i for i in range(1, 12)]
+        tables = (make_full_box('stsz', 0, 0, struct.pack('>II', 0, 11) + struct.pack('>11I', *sizes)) +
+                  make_table('co64', [(1000,), (2000,), (3000,), (4000,), (5000,)], 'Q') +
+                  make_table('stsc', [(1, 2, 1), (3, 1, 1), (4, 3, 1)], 'III') +
+                  make_table('stts', [(6, 10), (5, 20)], 'II') +
+                  make_table('ctts', [(1, 20), (10, 10)], 'II') +
+                  make_table('stss', [(1,), (6,)], 'I'))
+        stbl = mp4.mp4(struct.pack('>I4s', 8 + len(tables), 'stbl') + tables).children[0]
+
+        index = sample_tables.SampleIndex(stbl)
+        self.assertEquals(index.sample_count, 11)
+        for idx in range(1, 12):
+            self.assertEquals(index.offset(idx), sample_tables.offset_from_sample(stbl, idx))
+            self.assertEquals(index.size(idx), sizes[idx - 1])
+            self.assertEquals(index.dts(idx), stbl.find('stts').time_for_sample(idx))
+            self.assertEquals(index.cts(idx) - index.dts(idx), stbl.find('ctts').cto_for_sample(idx))
+        self.assertEquals([index.offset(i) for i in (1, 2, 3, 5, 6, 9)], [1000, 1010, 2000, 3000, 4000, 5000])
+        self.assertEquals([i for i in range(1, 12) if index.is_sync(i)], [1, 6])
+        self.assertTrue(stbl.find('stss').has_index(6))
+        self.assertFalse(stbl.find('stss').has_index(7))
+        self.assertEquals(index.sample_for_time(65), 7)
+        self.assertEquals(index.seek(65), 6)
+        self.assertEquals(index.seek(49), 1)
+
+    def test_64_bit_chunk_offsets(self):
+        big = 2 ** 33 + 5
+        co64 = mp4.mp4(make_table('co64', [(1000,), (big,)], 'Q')).children[0]
+        self.assertEquals(list(co64.chunk_offsets), [1000, big])
+        tables = (make_full_box('stsz', 0, 0, struct.pack('>II', 10, 4)) +
+                  make_table('co64', [(1000,), (big,)], 'Q') +
+                  make_table('stsc', [(1, 2, 1)], 'III') +
+                  make_table('stts', [(4, 2 ** 31)], 'II'))
+        stbl = mp4.mp4(struct.pack('>I4s', 8 + len(tables), 'stbl') + tables).children[0]
+        index = sample_tables.SampleIndex(stbl)
+        self.assertEquals([index.offset(i) for i in range(1, 5)], [1000, 1010, big, big + 10])
+        self.assertEquals(index.dts(4), 3 * 2 ** 31)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSampleTables)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,156 @@
+"""
+Test the segment watcher
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from argparse import Namespace
+
+import test_utils
+from test_utils import read_tfdt
+import mp4filter
+from segment_watcher import SegmentWatcher
+
+INIT = os.path.join(test_utils.TEST_PATH, 'data/video_init.mp4')
+SEGMENT = os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s')
+
+
+class TestSegmentWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.watch_dir = os.path.join(self.tmp_dir, 'live')
+        self.output_dir = os.path.join(self.tmp_dir, 'out')
+        os.makedirs(os.path.join(self.watch_dir, 'video'))
+        self.options = Namespace(track_id=None, tfdt_offset=None, seq_nr=None,
+                                 tfdt_offset_seconds=2.0)
+        self.now = time.time() + 10
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def add(self, source, name):
+        shutil.copyfile(source, os.path.join(self.watch_dir, 'video', name))
+
+    def make_watcher(self):
+        return SegmentWatcher(self.watch_dir, self.output_dir, ['tfdt'], self.options,
+                              settle_time=1.0, quiet=True)
+
+    def test_segments_are_processed_once(self):
+        self.add(INIT, 'v_init.mp4')
+        self.add(SEGMENT, 'v_1.m4s')
+        watcher = self.make_watcher()
+        self.assertEquals(watcher.poll(self.now), 0)
+        self.assertEquals(watcher.poll(self.now + 1), 2)
+        self.assertEquals(watcher.poll(self.now + 2), 0)
+        self.assertEquals(len(watcher.latencies), 2)
+        out_path = os.path.join(self.output_dir, 'video', 'v_1.m4s')
+        timescale = mp4filter.get_timescale(INIT)
+        self.assertEquals(read_tfdt(out_path), read_tfdt(SEGMENT) + 2 * timescale)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'video', 'v_init.mp4')))
+
+    def test_growing_segment_is_not_complete(self):
+        self.add(INIT, 'v_init.mp4')
+        path = os.path.join(self.watch_dir, 'video', 'v_1.m4s')
+        with open(SEGMENT, 'rb') as ifh:
+            data = ifh.read()
+        with open(path, 'wb') as ofh:
+            ofh.write(data[:1000])
+        watcher = self.make_watcher()
+        watcher.poll(self.now)
+        with open(path, 'ab') as ofh:
+            ofh.write(data[1000:])
+        self.assertEquals(watcher.poll(self.now + 1), 1)  # Only the init
+        self.assertEquals(watcher.poll(self.now + 2), 1)
+        self.assertEquals(read_tfdt(os.path.join(self.output_dir, 'video', 'v_1.m4s')),
+                          read_tfdt(SEGMENT) + 2 * mp4filter.get_timescale(INIT))
+
+    def test_segment_waits_for_init(self):
+        self.add(SEGMENT, 'v_1.m4s')
+        watcher = self.make_watcher()
+        watcher.poll(self.now)
+        self.assertEquals(watcher.poll(self.now + 1), 0)
+        self.add(INIT, 'v_init.mp4')
+        self.assertEquals(watcher.poll(self.now + 2), 0)
+        self.assertEquals(watcher.poll(self.now + 3), 2)
+
+    def test_init_info_is_cached(self):
+        self.add(INIT, 'v_init.mp4')
+        for i in range(3):
+            self.add(SEGMENT, 'v_%d.m4s' % i)
+        watcher = self.make_watcher()
+        watcher.poll(self.now)
+        watcher.poll(self.now + 1)
+        init_path = os.path.join(self.watch_dir, 'video', 'v_init.mp4')
+        info = watcher.get_init_info(init_path)
+        self.assertTrue(watcher.get_init_info(init_path) is info)
+        self.assertEquals(info.timescale, mp4filter.get_timescale(INIT))
+
+    def test_restart_skips_processed_segments(self):
+        self.add(INIT, 'v_init.mp4')
+        self.add(SEGMENT, 'v_1.m4s')
+        watcher = self.make_watcher()
+        watcher.poll(self.now)
+        watcher.poll(self.now + 1)
+        watcher = self.make_watcher()
+        watcher.poll(self.now + 2)
+        self.assertEquals(watcher.poll(self.now + 3), 0)
+
+    def test_state_is_bounded(self):
+        self.add(INIT, 'v_init.mp4')
+        self.add(SEGMENT, 'v_1.m4s')
+        watcher = self.make_watcher()
+        watcher.poll(self.now)
+        self.assertEquals(watcher.poll(self.now + 1), 2)
+        self.assertEquals(len(watcher.done), 2)
+        # Done entries expire, but the files are not taken for new ones
+        self.assertEquals(watcher.poll(self.now + 1 + watcher.done_window + 1), 0)
+        self.assertEquals(watcher.done, {})
+        # Removed files are forgotten
+        self.add(SEGMENT, 'v_2.m4s')
+        watcher.poll(self.now + 100)
+        os.remove(os.path.join(self.watch_dir, 'video', 'v_2.m4s'))
+        self.assertEquals(watcher.poll(self.now + 101), 0)
+        self.assertEquals(watcher.pending, {})
+        self.assertEquals(watcher.listings[os.path.join(self.watch_dir, 'video')][2],
+                          set(['v_init.mp4', 'v_1.m4s']))
+        self.assertEquals(watcher.nr_processed, 2)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSegmentWatcher)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,101 @@
+"""
+Test merging of TTML samples with STPPFixerFilter
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+
+
+import struct
+import sys
+import unittest
+
+import test_utils
+import mp4
+from synthetic_mp4 import make_box, make_full_box
+from stppfixer import STPPFixerFilter, REPLACE_STRING
+from trun_codec import TrunCodec
+
+TTML_START = '<tt xmlns="http://www.w3.org/ns/ttml">\n <body>\n    <div region="region1" >'
+TTML_END = '</div>\n </body>\n</tt>'
+
+
+def make_stpp_segment(track_id=1, sample_duration=90000):
+    "Return a TTML segment with two samples, which are joined by REPLACE_STRING."
+    ttml = TTML_START + '<p>One</p>' + REPLACE_STRING + '<p>Two</p>' + TTML_END
+    sizes = [len(ttml) / 2, len(ttml) - len(ttml) / 2]
+    styp = make_box('styp', 'msdh', struct.pack('>I', 0), 'msdh', 'msix')
+    tfhd = make_full_box('tfhd', 0, 0x020010, struct.pack('>II', track_id, sizes[0]))
+    tfdt = make_full_box('tfdt', 1, 0, struct.pack('>Q', 0))
+
+    def make_moof(data_offset):
+        trun = make_full_box('trun', 0, 0x301, struct.pack('>Ii', 2, data_offset),
+                             *[struct.pack('>II', sample_duration, size) for size in sizes])
+        return make_box('moof', make_full_box('mfhd', 0, 0, struct.pack('>I', 1)),
+                        make_box('traf', tfhd, tfdt, trun))
+
+    moof = make_moof(len(make_moof(0)) + 8)
+    return styp + moof + make_box('mdat', ttml), ttml
+
+
+class TestSTPPFixer(unittest.TestCase):
+
+    def check_output(self, output, ttml, track_id, default_sample_duration):
+        merged_ttml = ttml.replace(REPLACE_STRING, '')
+        root = mp4.mp4(output)
+        self.assertEquals([b.type for b in root.children], ['styp', 'moof', 'mdat'])
+        tfhd = root.find('moof.traf.tfhd')
+        self.assertEquals(tfhd.track_id, track_id)
+        self.assertEquals(tfhd.default_sample_size, len(merged_ttml))
+        self.assertEquals(tfhd.default_sample_duration, default_sample_duration)
+        trun_box = root.find('moof.traf.trun')
+        trun = TrunCodec(output[trun_box.offset:trun_box.offset + trun_box.size])
+        self.assertEquals(trun.sample_count, 1)
+        self.assertEquals(trun.sizes, None)
+        self.assertEquals(list(trun.durations), [180000])
+        mdat = root.find('mdat')
+        self.assertEquals(root.find('moof').offset + trun.data_offset, mdat.offset + 8)
+        self.assertEquals(output[mdat.offset + 8:], merged_ttml)
+
+    def test_merge_samples(self):
+        data, ttml = make_stpp_segment()
+        output = STPPFixerFilter(data=data).filter_top_boxes()
+        self.assertEquals(len(output), len(data) - len(REPLACE_STRING) - 12)
+        self.check_output(output, ttml, 1, 0)
+
+    def test_merge_samples_new_track_id_and_duration(self):
+        data, ttml = make_stpp_segment()
+        output = STPPFixerFilter(data=data, new_track_id=3,
+                                 new_default_sample_duration=1000).filter_top_boxes()
+        self.check_output(output, ttml, 3, 1000)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSTPPFixer)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,235 @@
+"""
+Test resegmentation of CMAF tracks
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from array import array
+
+import test_utils
+import mp4
+import synthetic_mp4
+from track_data_extractor import SampleStore
+from batch_runner import run_batch
+from track_resegmenter import SegmentInfo, TrackResegmenter, resegment_file
+
+
+def mdat_payload(data):
+    "Return the concatenated mdat payloads of a track."
+    root = mp4.mp4(data)
+    return ''.join(data[box.offset + 8:box.offset + box.size]
+                   for box in root.children if box.type == 'mdat')
+
+
+def reference_segments(samples, duration_ms, timescale):
+    "Map samples to segments with a per-sample loop over SampleData."
+    segments = []
+    segment_nr = 1
+    acc_time = 0
+    start_nr = 0
+    start_sample = samples[0]
+    for i, sample in enumerate(samples):
+        acc_time += sample.dur
+        if acc_time * 1000 > segment_nr * duration_ms * timescale:
+            end_sample = samples[i - 1]
+            segments.append(SegmentInfo(start_nr, i, start_sample.start,
+                                        end_sample.start + end_sample.dur - start_sample.start))
+            start_nr = i
+            start_sample = sample
+            segment_nr += 1
+    if start_nr != len(samples) - 1:
+        segments.append(SegmentInfo(start_nr, len(samples), start_sample.start,
+                                    samples[-1].start + samples[-1].dur - start_sample.start))
+    return segments
+
+
+class TrackData(object):
+    "The TrackDataExtractor attributes used for segment planning."
+
+    def __init__(self, samples, timescale):
+        self.samples = samples
+        self.track_timescale = timescale
+        self.input_segments = [None]
+
+
+class TestSampleStore(unittest.TestCase):
+
+    def test_runs(self):
+        store = SampleStore()
+        store.add_run(1000, 500, 3, 1024, array('I', [10, 20, 30]), 0x2000000, 0)
+        store.add_run(4072, 560, 2, array('I', [1000, 1048]), 40, 0, array('i', [-5, 5]))
+        self.assertEquals(len(store), 5)
+        self.assertTrue(store.contiguous)
+        self.assertEquals(list(store.starts), [1000, 2024, 3048, 4072, 5072])
+        self.assertEquals(list(store.offsets), [500, 510, 530, 560, 600])
+        self.assertEquals(store[4], (5072, 1048, 40, 600, 0, 5))
+        self.assertEquals(store.end, 6120)
+        ends, base = store.cumulative_ends()
+        self.assertEquals([end - base for end in ends], [1024, 2048, 3072, 4072, 5120])
+        store.add_run(9000, 640, 1, 1000, 40, 0, 0)
+        self.assertFalse(store.contiguous)
+        ends, base = store.cumulative_ends()
+        self.assertEquals([end - base for end in ends][-2:], [5120, 6120])
+
+    def test_64_bit_times_and_offsets(self):
+        store = SampleStore()
+        start, offset = 2 ** 40 + 7, 2 ** 33
+        store.add_run(start, offset, 3, array('I', [1000, 1024, 1000]), array('I', [10, 20, 30]),
+                      0, 0)
+        self.assertEquals(list(store.starts), [start, start + 1000, start + 2024])
+        self.assertEquals(list(store.offsets), [offset, offset + 10, offset + 30])
+        self.assertEquals(store.end, start + 3024)
+        self.assertEquals(store.byte_ranges(0, 3), [(offset, 60)])
+
+    def test_byte_ranges(self):
+        store = SampleStore()
+        store.add_run(0, 100, 3, 1000, 10, 0, 0)  # 100-130
+        store.add_run(3000, 130, 2, 1000, 20, 0, 0)  # 130-170, follows
+        store.add_run(5000, 500, 2, 1000, 5, 0, 0)  # 500-510, other track in between
+        self.assertEquals(store.byte_ranges(0, 7), [(100, 70), (500, 10)])
+        self.assertEquals(store.byte_ranges(1, 4), [(110, 40)])
+        self.assertEquals(store.byte_ranges(4, 6), [(150, 20), (500, 5)])
+        self.assertEquals(store.byte_ranges(2, 2), [])
+
+    def test_planning_matches_per_sample_loop(self):
+        rnd = random.Random(17)
+        for contiguous in (True, False):
+            store = SampleStore()
+            start = 0
+            for _ in range(50):
+                durs = array('I', [rnd.choice((1000, 1001, 1024, 2000)) for _ in range(40)])
+                store.add_run(start, 0, len(durs), durs, 100, 0, 0)
+                start += sum(durs) + (0 if contiguous else rnd.randint(0, 3000))
+            for duration_ms in (500, 1000, 1920, 3333.3):
+                resegmenter = TrackResegmenter(None, duration_ms, None)
+                resegmenter.input_parser = TrackData(store, 48000)
+                self.assertEquals(resegmenter._map_samples_to_new_segments(duration_ms),
+                                  reference_segments(list(store), duration_ms, 48000))
+
+
+class TestTrackResegmenter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.tmp_dir, 'track.mp4')
+        self.data = synthetic_mp4.make_fragmented(nr_fragments=5, samples_per_fragment=47)
+        with open(self.input_file, 'wb') as ofh:
+            ofh.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_output(self, output, sidx_range):
+        root = mp4.mp4(output)
+        sidx = root.find('sidx')
+        self.assertEquals(sidx_range, "%d-%d" % (sidx.offset, sidx.offset + sidx.size - 1))
+        moofs = [box for box in root.children if box.type == 'moof']
+        self.assertEquals(len(moofs), len(sidx.references))
+        for i, reference in enumerate(sidx.references):
+            end = moofs[i + 1].offset if i + 1 < len(moofs) else len(output)
+            self.assertEquals(reference['referenced-size'], end - moofs[i].offset)
+            mdat = root.children[root.children.index(moofs[i]) + 1]
+            self.assertEquals(moofs[i].offset + moofs[i].find('traf.trun').data_offset,
+                              mdat.offset + 8)
+        self.assertEquals(mdat_payload(output), mdat_payload(self.data))
+
+    def test_resegment(self):
+        output_file = os.path.join(self.tmp_dir, 'out.mp4')
+        resegmenter = TrackResegmenter(self.input_file, 700, output_file)
+        resegmenter.resegment()
+        with open(output_file, 'rb') as ifh:
+            output = ifh.read()
+        self.assertEquals(len(mp4.mp4(output).find('sidx').references), 12)
+        self.check_output(output, resegmenter.sidx_range)
+
+    def test_resegment_in_place(self):
+        resegmenter = TrackResegmenter(self.input_file, 1000, self.input_file)
+        resegmenter.resegment()
+        with open(self.input_file, 'rb') as ifh:
+            output = ifh.read()
+        self.check_output(output, resegmenter.sidx_range)
+        self.assertTrue(os.path.exists(self.input_file + '_bup'))
+        self.assertFalse(os.path.exists(self.input_file + '.tmp'))
+
+    def test_plan_matches_output(self):
+        output_file = os.path.join(self.tmp_dir, 'out.mp4')
+        resegmenter = TrackResegmenter(self.input_file, 700, output_file)
+        plan = resegmenter.plan()
+        resegmenter.resegment()
+        with open(output_file, 'rb') as ifh:
+            output = ifh.read()
+        root = mp4.mp4(output)
+        sidx = root.find('sidx')
+        self.assertEquals(plan.sidx, output[sidx.offset:sidx.offset + sidx.size])
+        self.assertEquals(plan.sidx_range, resegmenter.sidx_range)
+        self.assertEquals(plan.segment_sizes,
+                          [ref['referenced-size'] for ref in sidx.references])
+        self.assertEquals(len(plan.drift_ms), len(plan.segment_info))
+        self.assertTrue(all(abs(drift) < 700 for drift in plan.drift_ms))
+
+    def test_plan_drift(self):
+        resegmenter = TrackResegmenter(self.input_file, 1000, None)
+        plan = resegmenter.plan()
+        timescale = resegmenter.input_parser.track_timescale
+        first = plan.segment_info[0]
+        self.assertEquals(plan.drift_ms[0], first.dur * 1000.0 / timescale - 1000)
+        nr_segments = len(resegmenter.plan(500).segment_info)
+        self.assertRaises(ValueError, resegmenter.plan, 500, [400] * (nr_segments - 1))
+        plan = resegmenter.plan(500, reference_ms=[400] * (nr_segments + 1))
+        self.assertEquals(len(plan.drift_ms), nr_segments)
+        first, second = plan.segment_info[:2]
+        self.assertEquals(plan.drift_ms[1],
+                          (first.dur + second.dur) * 1000.0 / timescale - 800)
+
+    def test_resegment_parallel(self):
+        tasks = []
+        for duration_ms in (500, 700, 1000):
+            output_file = os.path.join(self.tmp_dir, 'out_%d.mp4' % duration_ms)
+            tasks.append((self.input_file, duration_ms, output_file))
+        batch = run_batch(resegment_file, tasks, jobs=2, quiet=True)
+        self.assertEquals(batch.failures, [])
+        self.assertEquals(len(batch.results), 3)
+        for (_, _, output_file), sidx_range in batch.results:
+            with open(output_file, 'rb') as ifh:
+                self.check_output(ifh.read(), sidx_range)
+
+
+if __name__ == '__main__':
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite([loader.loadTestsFromTestCase(TestSampleStore),
+                                loader.loadTestsFromTestCase(TestTrackResegmenter)])
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,94 @@
+"""
+Test trick mode segments with only the first sample
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import test_utils
+import mp4
+import synthetic_mp4
+from trick_mode_segment_creator import TrickFilter
+from trun_codec import TrunCodec
+
+
+class TestTrickFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.segment_file = os.path.join(self.tmp_dir, '1.m4s')
+        data = synthetic_mp4.make_fragmented(nr_fragments=1, samples_per_fragment=30,
+                                             sidx=False)
+        self.moof_pos = mp4.mp4(data).find('moof').offset
+        self.data = data[self.moof_pos:]
+        with open(self.segment_file, 'wb') as ofh:
+            ofh.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_keep_first_sample(self):
+        in_trun_box = mp4.mp4(self.data).find('moof.traf.trun')
+        in_trun = TrunCodec(self.data[in_trun_box.offset:in_trun_box.offset + in_trun_box.size])
+        output = TrickFilter(self.segment_file).filter_top_boxes()
+
+        root = mp4.mp4(output)
+        self.assertEquals([b.type for b in root.children], ['moof', 'mdat'])
+        trun_box = root.find('moof.traf.trun')
+        trun = TrunCodec(output[trun_box.offset:trun_box.offset + trun_box.size])
+        self.assertEquals(trun.sample_count, 1)
+        self.assertEquals(list(trun.durations), [sum(in_trun.durations)])
+        self.assertEquals(list(trun.sizes), [in_trun.sizes[0]])
+        self.assertEquals(trun.sample_flags[0], in_trun.sample_flags[0])
+        mdat = root.find('mdat')
+        self.assertEquals(trun.data_offset, mdat.offset + 8)
+        self.assertEquals(mdat.size, 8 + in_trun.sizes[0])
+        self.assertEquals(output[mdat.offset + 8:],
+                          self.data[in_trun.data_offset:in_trun.data_offset + in_trun.sizes[0]])
+
+    def test_stream_matches_in_memory(self):
+        output = TrickFilter(self.segment_file).filter_top_boxes()
+        out_file = os.path.join(self.tmp_dir, 'out.m4s')
+        with open(self.segment_file, 'rb') as ifh:
+            with open(out_file, 'wb') as ofh:
+                TrickFilter(self.segment_file).filter_stream(ifh, ofh)
+        with open(out_file, 'rb') as ifh:
+            self.assertEquals(ifh.read(), output)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTrickFilter)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,111 @@
+"""
+Test the trun codec
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import struct
+import sys
+import unittest
+
+import test_utils
+import mp4
+import synthetic_mp4
+from trun_codec import TrunCodec
+
+
+class TestTrunCodec(unittest.TestCase):
+
+    def get_trun_data(self, **kwargs):
+        data = synthetic_mp4.make_fragmented(nr_fragments=1, samples_per_fragment=6, **kwargs)
+        trun = mp4.mp4(data).find('moof.traf.trun')
+        return data[trun.offset:trun.offset + trun.size]
+
+    def test_new(self):
+        data = self.get_trun_data(trun_flags=0xb05)
+        trun = TrunCodec(data)
+        new_trun = TrunCodec.new(0, trun.data_offset, trun.first_sample_flags,
+                                 durations=trun.durations, sizes=trun.sizes,
+                                 composition_offsets=trun.composition_offsets)
+        self.assertEquals(new_trun.flags, 0xb05)
+        self.assertEquals(new_trun.encode(), data)
+
+    def test_round_trip(self):
+        for trun_flags in (0xf01, 0xb05, 0x301, 0x001, 0x000):
+            data = self.get_trun_data(trun_flags=trun_flags)
+            trun = TrunCodec(data)
+            self.assertEquals(trun.flags, trun_flags)
+            self.assertEquals(trun.sample_count, 6)
+            self.assertEquals(trun.size(), len(data))
+            self.assertEquals(trun.encode(), data)
+
+    def test_columns(self):
+        data = synthetic_mp4.make_fragmented(nr_fragments=1, samples_per_fragment=6, sidx=False)
+        moof = mp4.mp4(data).find('moof')
+        trun = moof.find('traf.trun')
+        trun = TrunCodec(data[trun.offset:trun.offset + trun.size])
+        self.assertEquals(trun.data_offset, moof.size + 8)
+        self.assertEquals(list(trun.durations), [3000] * 6)
+        self.assertEquals(list(trun.sizes), [200, 237, 210, 247, 220, 257])
+        self.assertEquals(list(trun.sample_flags), [0x2000000] + [0x1010000] * 5)
+        self.assertEquals(list(trun.composition_offsets), [3000, 6000, 3000, 3000, 6000, 3000])
+
+    def test_transforms(self):
+        data = self.get_trun_data(trun_flags=0xf01)
+        trun = TrunCodec(data)
+        trun.shift_cto()
+        self.assertEquals(trun.version, 1)
+        self.assertEquals(list(trun.composition_offsets), [0, 3000, 0, 0, 3000, 0])
+        trun.shift_cto(-3000)
+        self.assertEquals(TrunCodec(trun.encode()).composition_offsets[0], -3000)
+
+        trun = TrunCodec(data)
+        trun.sample_flags[1] = 0x0
+        trun.mark_non_sync_samples()
+        self.assertEquals(list(trun.sample_flags), [0x2000000, 0x10000] + [0x1010000] * 4)
+
+        trun.keep_samples(1, 3)
+        self.assertEquals(trun.sample_count, 2)
+        self.assertEquals(list(trun.sizes), [237, 210])
+        encoded = trun.encode()
+        self.assertEquals(len(encoded), len(data) - 4 * 16)
+        self.assertEquals(struct.unpack('>I', encoded[:4])[0], len(encoded))
+
+        trun = TrunCodec(data)
+        trun.merge_samples()
+        self.assertEquals((trun.sample_count, trun.durations[0], trun.sizes[0]), (1, 18000, 1371))
+        self.assertEquals(trun.size(), 20 + 16)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTrunCodec)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
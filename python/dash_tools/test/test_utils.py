@@ -38,3 +38,12 @@ from os.path import dirname, abspath
 
 TEST_PATH = abspath(dirname(__file__))
 sys.path.append(os.path.join(TEST_PATH, "../"))
+
+import mp4filter
+
+
+def read_tfdt(file_name):
+    "Return the tfdt of a segment, or fail for a missing file."
+    tfilter = mp4filter.TfdtFilter(file_name)
+    tfilter.filter_plan()
+    return tfilter.get_tfdt_value()
@@ -30,15 +30,113 @@
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
 
 from structops import str_to_uint16, uint32_to_str
 from structops import str_to_uint32, str_to_uint64
+from structops import UINT64_TYPECODE, uint64_array, running_sums
+from init_info import get_init_info
 from mp4filter import MP4Filter
+from trun_codec import TrunCodec
 
 SampleData = namedtuple("SampleData", "start dur size offset flags cto")
 
 
+class SampleStore(object):
+    """The samples of a track as parallel typed arrays.
+
+    Item i of starts, durs, sizes, offsets, flags and ctos are the fields of
+    sample i. Indexing the store gives a SampleData, but bulk work on
+    segments is meant to use slices of the columns. run_starts has the
+    index of the first sample of each run; the samples of a run are
+    contiguous in the input."""
+
+    columns = (('starts', UINT64_TYPECODE), ('durs', 'I'), ('sizes', 'I'),
+               ('offsets', UINT64_TYPECODE), ('flags', 'I'), ('ctos', 'l'))
+
+    def __init__(self):
+        for name, typecode in self.columns:
+            setattr(self, name, array(typecode))
+        self.run_starts = array('L')
+        self.contiguous = True  # Every run starts where the previous one ended
+
+    def __len__(self):
+        return len(self.durs)
+
+    def __getitem__(self, idx):
+        return SampleData(self.starts[idx], self.durs[idx], self.sizes[idx],
+                          self.offsets[idx], self.flags[idx], self.ctos[idx])
+
+    def __iter__(self):
+        for idx in xrange(len(self)):
+            yield self[idx]
+
+    @property
+    def end(self):
+        "Return the end time of the last sample, or None if there are no samples."
+        if not self.durs:
+            return None
+        return self.starts[-1] + self.durs[-1]
+
+    def add_run(self, start, offset, count, durs, sizes, flags, ctos):
+        """Add count samples starting at time start and byte offset offset.
+
+        Each of durs, sizes, flags and ctos is an array with one value per
+        sample, or a number that all samples have."""
+        if self.durs and start != self.end:
+            self.contiguous = False
+        self.run_starts.append(len(self))
+        self.starts.extend(running_sums(start, durs, count))
+        self.offsets.extend(running_sums(offset, sizes, count))
+        for name, values in (('durs', durs), ('sizes', sizes), ('flags', flags),
+                             ('ctos', ctos)):
+            column = getattr(self, name)
+            if isinstance(values, (int, long)):
+                column.extend(array(column.typecode, [values]) * count)
+            elif getattr(values, 'typecode', None) == column.typecode:
+                column.extend(values)
+            else:
+                column.fromlist(list(values))
+
+    def byte_ranges(self, start_nr, end_nr):
+        """Return the input data of samples start_nr to end_nr-1 as a list of
+        (offset, size) ranges.
+
+        Runs that follow each other in the input are merged, so there is one
+        range per stretch of contiguous data, not one per sample."""
+        ranges = []
+        pos = start_nr
+        while pos < end_nr:
+            next_run = bisect_right(self.run_starts, pos)
+            if next_run < len(self.run_starts):
+                stop = min(self.run_starts[next_run], end_nr)
+            else:
+                stop = end_nr
+            offset = self.offsets[pos]
+            size = self.offsets[stop - 1] + self.sizes[stop - 1] - offset
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + size)
+            else:
+                ranges.append((offset, size))
+            pos = stop
+        return ranges
+
+    def cumulative_ends(self):
+        """Return (ends, base), where ends[i] - base is the summed duration of
+        samples 0 to i.
+
+        For contiguous samples, ends is made from starts without a loop."""
+        if not self.durs:
+            return uint64_array(), 0
+        if self.contiguous:
+            ends = self.starts[1:]
+            ends.append(self.end)
+            return ends, self.starts[0]
+        return running_sums(0, self.durs, len(self.durs), True), 0
+
+
 class TrackDataExtractor(MP4Filter):
     "Extract data from DASH Ondemand/CMAF Track. "
 
@@ -52,7 +150,7 @@ class TrackDataExtractor(MP4Filter):
         self.default_sample_flags = None
         self.default_sample_size = None
         self.input_segments = []
-        self.samples = []
+        self.samples = SampleStore()
         self.last_moof_start = 0
         self.segment_start = None
         self.styp = ""  # styp box, if any
@@ -64,8 +162,7 @@ class TrackDataExtractor(MP4Filter):
 
     def filterbox(self, box_type, data, file_pos, path=""):
         "Filter box or tree of boxes recursively."
-        containers = ("moov", "moov.trak", "moov.trak.mdia", "moov.mvex",
-                      "moof", "moof.traf")
+        containers = ("moof", "moof.traf")
         if path == "":
             path = box_type
         else:
@@ -89,10 +186,8 @@ class TrackDataExtractor(MP4Filter):
                 output += self.filterbox(box_type, data[pos:pos+size],
                                          file_pos + len(output), path)
                 pos += size
-        elif path == "moov.mvex.trex":
-            output = self.process_trex(data)
-        elif path == "moov.trak.mdia.mdhd":
-            output = self.process_mdhd(data)
+        elif path == "moov":
+            output = self.process_moov(data)
         elif path == "moof.mfhd":
             output = self.process_mfhd(data)
         elif path == "moof.traf.tfhd":
@@ -111,23 +206,17 @@ class TrackDataExtractor(MP4Filter):
             output = data
         return output
 
-    def process_trex(self, data):
-        "Get potential default values."
-        self.track_id = str_to_uint32(data[12:16])
-        self.default_sample_description_index = str_to_uint32(data[16:20])
-        self.default_sample_duration = str_to_uint32(data[20:24])
-        self.default_sample_size = str_to_uint32(data[24:28])
-        self.default_sample_flags = str_to_uint32(data[28:32])
-        return data
-
-    def process_mdhd(self, data):
-        "Extract track timescale."
-        version = ord(data[8])
-        if version == 1:
-            offset = 28
-        else:
-            offset = 20
-        self.track_timescale = str_to_uint32(data[offset:offset+4])
+    def process_moov(self, data):
+        "Get track timescale and potential default values from the shared init info."
+        track = get_init_info(data=data).first_track
+        if track is None:
+            raise ValueError("No track in moov")
+        self.track_id = track.track_id
+        self.track_timescale = track.timescale
+        self.default_sample_description_index = track.default_sample_description_index
+        self.default_sample_duration = track.default_sample_duration
+        self.default_sample_size = track.default_sample_size
+        self.default_sample_flags = track.default_sample_flags
         return data
 
     def process_sidx(self, data, file_pos):
@@ -227,55 +316,39 @@ class TrackDataExtractor(MP4Filter):
 
     def process_trun(self, data):
         """Extract trun information into self.segments[-1] and self.samples"""
-        version_and_flags = str_to_uint32(data[8:12])
-        # version = version_and_flags >> 24
-        flags = version_and_flags & 0xffffff
-        sample_count = str_to_uint32(data[12:16])
-        first_sample_flags = None
-        pos = 16
+        trun = TrunCodec(data)
         start = self.base_media_decode_time
-        data_offset = self.last_moof_start
-        if flags & 0x1:  # data_offset_present
-            data_offset += str_to_uint32(data[pos:pos+4])
-            pos += 4
-        else:
+        if trun.data_offset is None:
             raise ValueError("Cannot handle case without data_offset")
-        if flags & 0x4:  # first_sample_flags
-            first_sample_flags = str_to_uint32(data[pos:pos+4])
-            pos += 4
-            if flags & 0x400:  # sample_flags present
-                raise ValueError("Sample flags are not allowed with first")
-        self.trun_base_size = pos  # How many bytes this far
+        data_offset = self.last_moof_start + trun.data_offset
+        if trun.first_sample_flags is not None and trun.sample_flags is not None:
+            raise ValueError("Sample flags are not allowed with first")
+        self.trun_base_size = trun.sample_array_offset  # How many bytes this far
         if self.trun_sample_flags is None:
-            self.trun_sample_flags = flags
-        for i in range(sample_count):
-            sample_duration = self.default_sample_duration
-            sample_size = self.default_sample_size
-            sample_flags = self.default_sample_flags
-            if i == 0 and first_sample_flags is not None:
-                sample_flags = first_sample_flags
-            cto = self.default_sample_cto
-            if flags & 0x100:  # sample_duration present
-                sample_duration = str_to_uint32(data[pos:pos + 4])
-                pos += 4
-            if flags & 0x200:  # sample_size present
-                sample_size = str_to_uint32(data[pos:pos + 4])
-                pos += 4
-            if flags & 0x400:  # sample_flags present
-                sample_flags = str_to_uint32(data[pos:pos + 4])
-                pos += 4
-            if flags & 0x800:  # composition_time_offset present
-                cto = str_to_uint32(data[pos:pos + 4])
-                pos += 4
-            if cto is None:
-                cto = 0
-            sample = SampleData(start, sample_duration, sample_size,
-                                data_offset, sample_flags, cto)
-            self.samples.append(sample)
-            start += sample_duration
-            data_offset += sample_size
+            self.trun_sample_flags = trun.flags
+        count = trun.sample_count
+        durations = trun.durations
+        if durations is None:
+            durations = self.default_sample_duration
+        sizes = trun.sizes
+        if sizes is None:
+            sizes = self.default_sample_size
+        if durations is None or sizes is None:
+            raise ValueError("Sample durations and sizes are neither in trun nor defaulted")
+        flags = trun.sample_flags
+        if flags is None:
+            flags = self.default_sample_flags or 0
+        if trun.first_sample_flags is not None and count > 0:
+            flags = array('I', [trun.first_sample_flags]) + array('I', [flags]) * (count - 1)
+        ctos = trun.composition_offsets
+        if ctos is None:
+            ctos = self.default_sample_cto or 0
+        self.samples.add_run(start, data_offset, count, durations, sizes, flags, ctos)
         seg = self.input_segments[-1]
-        seg['duration'] = start - self.base_media_decode_time
+        if isinstance(durations, (int, long)):
+            seg['duration'] = count * durations
+        else:
+            seg['duration'] = sum(durations)
         return data
 
     def find_header_end(self):
@@ -287,14 +360,16 @@ class TrackDataExtractor(MP4Filter):
             header_end += size
         return header_end
 
-    def construct_new_mdat(self, media_info):
-        "Return an mdat box with data for samples in media_info."
-        start_nr = media_info.start_nr
-        end_nr = media_info.end_nr
-        sample_data = []
-        for i in range(media_info.start_nr, media_info.end_nr):
-            sample = self.samples[i]
-            sample_data.append(self.data[sample.offset:sample.offset +
-                                                       sample.size])
-        combined_data = "".join(sample_data)
-        return uint32_to_str(8 + len(combined_data)) + 'mdat' + combined_data
+    def mdat_ranges(self, media_info):
+        "Return the (offset, size) input ranges of the samples in media_info."
+        return self.samples.byte_ranges(media_info.start_nr, media_info.end_nr)
+
+    def write_mdat(self, ofh, media_info):
+        """Write an mdat box with data for samples in media_info to ofh.
+
+        Each contiguous range of samples is written straight from the input
+        with one write, without copying it into a string first."""
+        ranges = self.mdat_ranges(media_info)
+        ofh.write(uint32_to_str(8 + sum(size for _, size in ranges)) + 'mdat')
+        for offset, size in ranges:
+            ofh.write(buffer(self.data, offset, size))
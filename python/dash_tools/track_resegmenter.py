@@ -33,112 +33,182 @@ Useful to get audio segments with a specified average duration."""
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import sys
 from argparse import ArgumentParser
+from bisect import bisect_right
 from collections import namedtuple
 
-from structops import str_to_uint16, uint16_to_str, uint32_to_str, sint32_to_str
+from structops import str_to_uint16, uint16_to_str, uint32_to_str
 from structops import str_to_uint32, str_to_uint64, uint64_to_str
 from track_data_extractor import TrackDataExtractor
+from trun_codec import TrunCodec
 from backup_handler import make_backup, BackupError
+from batch_runner import add_batch_arguments, run_batch
 
 SegmentData = namedtuple("SegmentData", "nr start dur size data")
 SegmentInfo = namedtuple("SegmentInfo", "start_nr end_nr start_time dur")
+SegmentLayout = namedtuple("SegmentLayout",
+                           "tfhd_flags tfhd_data sample_flags moof_size mdat_size")
+ResegmentPlan = namedtuple("ResegmentPlan",
+                           "segment_info segment_sizes sidx sidx_range drift_ms")
+
+
+def common_value(values):
+    "Return the value all items of the array values have, or None if they differ."
+    if values and values.count(values[0]) == len(values):
+        return values[0]
+    return None
+
+
+def nr_sample_bytes(sample_flags):
+    "Return the number of bytes per sample in a trun with sample_flags."
+    nr_bytes = 0
+    for pattern in (0x100, 0x200, 0x400, 0x800):
+        if sample_flags & pattern != 0:
+            nr_bytes += 4
+    return nr_bytes
 
 
 class TrackResegmenter(object):
     "Resegment an OnDemand/CMAF track into a new output track."
 
     def __init__(self, input_file, duration_ms, output_file,
-                 skip_sidx=False, verbose=False):
+                 skip_sidx=False, verbose=False, quiet=False):
         self.input_file = input_file
         self.duration_ms = duration_ms
         self.output_file = output_file
         self.verbose = verbose
+        self.quiet = quiet
         self.input_parser = None
         self.skip_sidx = skip_sidx
         self.sidx_range = ""
 
-    def resegment(self):
-        "Resegment the track with new duration."
-
-        self.input_parser = TrackDataExtractor(self.input_file,
-                                               self.verbose)
+    def plan(self, duration_ms=None, reference_ms=None):
+        """Plan the resegmentation from the sample table, without writing output.
+
+        Return a ResegmentPlan with the new segments, their sizes in bytes,
+        the sidx box and its byte range, exactly as resegment() would write
+        them. drift_ms is the end time of each new segment minus the end
+        time of the corresponding reference segment, where reference_ms are
+        the reference (e.g. video) segment durations in milliseconds and
+        default to duration_ms repeated. A reference with fewer segments
+        than the plan raises ValueError, and extra reference segments are
+        ignored. duration_ms defaults to the one given at construction. The
+        input is parsed once, so several durations can be planned cheaply."""
+        return self._plan(duration_ms, reference_ms)[0]
+
+    def _plan(self, duration_ms=None, reference_ms=None):
+        "Return the ResegmentPlan and the SegmentLayout of each new segment."
+        if duration_ms is None:
+            duration_ms = self.duration_ms
+        if self.input_parser is None:
+            self.input_parser = TrackDataExtractor(self.input_file,
+                                                   self.verbose)
+            self.input_parser.filter_plan()  # Only the extracted data is needed
         ip = self.input_parser
-        ip.filter_top_boxes()
         if len(ip.input_segments) == 0:
             raise ValueError("No fragments found in input file. Progressive "
                              "file?")
         timescale = ip.track_timescale
+        self.track_id = ip.track_id
+        segment_info = self._map_samples_to_new_segments(duration_ms)
+        layouts = [self._layout(seg_info) for seg_info in segment_info]
+        segment_sizes = [len(ip.styp) + layout.moof_size + layout.mdat_size
+                         for layout in layouts]
+        sidx = self._generate_sidx(segment_info, segment_sizes, timescale)
+        sidx_start = ip.find_header_end()
+        sidx_range = "%d-%d" % (sidx_start, sidx_start + len(sidx) - 1)
+        if reference_ms is None:
+            reference_ms = [duration_ms] * len(segment_info)
+        elif len(reference_ms) < len(segment_info):
+            raise ValueError("%d reference segments for %d new segments" %
+                             (len(reference_ms), len(segment_info)))
+        drift_ms = []
+        start_time = segment_info[0].start_time
+        reference_end = 0
+        for info, reference_dur in zip(segment_info, reference_ms):
+            reference_end += reference_dur
+            end = (info.start_time + info.dur - start_time) * 1000.0 / timescale
+            drift_ms.append(end - reference_end)
+        return ResegmentPlan(segment_info, segment_sizes, sidx, sidx_range,
+                             drift_ms), layouts
+
+    def resegment(self):
+        "Resegment the track with new duration."
+
+        plan, layouts = self._plan()
+        ip = self.input_parser
         if self.verbose:
             for i, segment in enumerate(ip.input_segments):
                 print("Input segment %d: dur=%d" % (i + 1,
                                                     segment['duration']))
-
-        segment_info = self._map_samples_to_new_segments()
-        self.track_id = ip.track_id
-        output_segments = []
-        segment_sizes = []
-        for i, seg_info in enumerate(segment_info):
-            output_segment = ""
-            if ip.styp:
-                output_segment += ip.styp
-            output_segment += self._generate_moof(i+1, seg_info)
-            output_segment += ip.construct_new_mdat(seg_info)
-            output_segments.append(output_segment)
-            segment_sizes.append(len(output_segment))
-        if self.output_file:
-            if self.output_file == self.input_file:
-                try:
-                    make_backup(self.input_file)
-                except BackupError:
-                    print("Backup file for %s already exists" %
-                          self.input_file)
-                    return
-            with open(self.output_file, "wb") as ofh:
-                input_header_end = self.input_parser.find_header_end()
-                ofh.write(ip.data[:input_header_end])
-                if not self.skip_sidx:
-                    sidx = self._generate_sidx(segment_info, segment_sizes,
-                                               timescale)
-                    ofh.write(sidx)
-                    sidx_start = input_header_end
-                    self.sidx_range = "%d-%d" % (sidx_start,
-                                                 sidx_start + len(sidx) - 1)
-                for output_segment in output_segments:
-                    ofh.write(output_segment)
-
-    def _map_samples_to_new_segments(self):
-        "Calculate which samples go into which segments."
+            for i, info in enumerate(plan.segment_info):
+                print("Output segment %d: dur=%d" % (i +1, info.dur))
+        if not self.quiet:
+            print("Generating %d segments from %d" %
+                  (len(plan.segment_info),  len(ip.input_segments)))
+        if not self.output_file:
+            return
+        if self.output_file == self.input_file:
+            try:
+                make_backup(self.input_file)
+            except BackupError:
+                print("Backup file for %s already exists" %
+                      self.input_file)
+                return
+
+        # Write one segment at a time, with samples copied from the input.
+        # The input stays mapped while the output replaces it.
+        tmp_name = self.output_file + ".tmp"
+        with open(tmp_name, "wb") as ofh:
+            ofh.write(ip.data[:ip.find_header_end()])
+            if not self.skip_sidx:
+                ofh.write(plan.sidx)
+                self.sidx_range = plan.sidx_range
+            for i, (seg_info, layout) in enumerate(zip(plan.segment_info, layouts)):
+                if ip.styp:
+                    ofh.write(ip.styp)
+                ofh.write(self._generate_moof(i + 1, seg_info, layout))
+                ip.write_mdat(ofh, seg_info)
+        os.rename(tmp_name, self.output_file)
+
+    def _map_samples_to_new_segments(self, duration_ms):
+        """Calculate which samples go into which segments.
+
+        A segment ends before the first sample whose accumulated end time
+        passes the next multiple of the duration. That sample is found by
+        bisection in the cumulative end times."""
+        samples = self.input_parser.samples
+        starts, durs = samples.starts, samples.durs
+        timescale = self.input_parser.track_timescale
+        nr_samples = len(samples)
+        ends, base = samples.cumulative_ends()
         new_segment_info = []
         segment_nr = 1
-        acc_time = 0
         start_nr = 0
-        start_sample = self.input_parser.samples[0]
-        timescale = self.input_parser.track_timescale
-        nr_samples = len(self.input_parser.samples)
-        for i, sample in enumerate(self.input_parser.samples):
-            acc_time += sample.dur
-            if acc_time * 1000  > segment_nr * self.duration_ms * timescale:
-                end_sample = self.input_parser.samples[i-1]
-                end_time = end_sample.start + end_sample.dur
-                seg_dur = end_time - start_sample.start
-                info = SegmentInfo(start_nr, i, start_sample.start, seg_dur)
-                new_segment_info.append(info)
-                start_nr = i
-                start_sample = sample
-                segment_nr += 1
+        search_nr = 0
+        while True:
+            limit = segment_nr * duration_ms * timescale
+            i = bisect_right(ends, base + limit / 1000.0, search_nr)
+            # Make the float bisection exact: (ends[i] - base) * 1000 > limit
+            while i > search_nr and (ends[i - 1] - base) * 1000 > limit:
+                i -= 1
+            while i < nr_samples and not (ends[i] - base) * 1000 > limit:
+                i += 1
+            if i >= nr_samples:
+                break
+            end_time = starts[i - 1] + durs[i - 1]
+            info = SegmentInfo(start_nr, i, starts[start_nr], end_time - starts[start_nr])
+            new_segment_info.append(info)
+            start_nr = i
+            search_nr = i + 1
+            segment_nr += 1
 
         if start_nr != nr_samples - 1:
-            end_sample = self.input_parser.samples[-1]
-            end_time = end_sample.start + end_sample.dur
-            info = SegmentInfo(start_nr, nr_samples, start_sample.start,
-                               end_time - start_sample.start)
+            end_time = samples.end
+            info = SegmentInfo(start_nr, nr_samples, starts[start_nr],
+                               end_time - starts[start_nr])
             new_segment_info.append(info)
-        if self.verbose:
-            for i, info in enumerate(new_segment_info):
-                print("Output segment %d: dur=%d" % (i +1, info.dur))
-        print("Generating %d segments from %d" %
-              (len(new_segment_info),  len(self.input_parser.input_segments)))
         return new_segment_info
 
     def _generate_sidx(self, segment_info, segment_sizes, timescale):
@@ -161,44 +231,18 @@ class TrackResegmenter(object):
         output = uint32_to_str(size) + output
         return output
 
-    def _generate_moof(self, sequence_nr, seg_info):
-        "Generate a moof box with the correct sample entries"
-        mfhd = self._generate_mfhd(sequence_nr)
-        offset = 8 + len(mfhd)
-        traf = self._generate_traf(seg_info, offset)
-        size = 8 + len(mfhd) + len(traf)
-        return uint32_to_str(size) + 'moof' + mfhd + traf
-
-    def _generate_mfhd(self, sequence_nr):
-        return (uint32_to_str(16) +  # size
-                'mfhd' +
-                uint32_to_str(0) +  # version_and_flags
-                uint32_to_str(sequence_nr))
-
-    def _generate_traf(self, seg_info, offset):
-        tfhd = self._generate_tfhd(seg_info, self.track_id)
-        tfdt = self._generate_tfdt(seg_info)
-        offset += 8 + len(tfhd) + len(tfdt)
-        trun = self._generate_trun(seg_info, offset)
-        size = 8 + len(tfhd) + len(tfdt) + len(trun)
-        return uint32_to_str(size) + 'traf' + tfhd + tfdt + trun
-
-    def _generate_tfhd(self, seg_info, track_id):
-        ip = self.input_parser
-        first_sample = ip.samples[seg_info.start_nr]
-        common_size = first_sample.size
-        common_dur = first_sample.dur
-        common_flags = first_sample.flags
-        common_cto = first_sample.cto
-        for sample in ip.samples[seg_info.start_nr + 1:seg_info.end_nr]:
-            if sample.dur != common_dur:
-                common_dur = None
-            if sample.size != common_size:
-                common_size = None
-            if sample.flags != common_flags:
-                common_flags = None
-            if sample.cto != common_cto:
-                common_cto = None
+    def _layout(self, seg_info):
+        """Return the SegmentLayout of a segment.
+
+        Values common to all samples go into tfhd, the others are per sample
+        in trun."""
+        samples = self.input_parser.samples
+        start_nr, end_nr = seg_info.start_nr, seg_info.end_nr
+        common_dur = common_value(samples.durs[start_nr:end_nr])
+        common_size = common_value(samples.sizes[start_nr:end_nr])
+        common_flags = common_value(samples.flags[start_nr:end_nr])
+        common_cto = common_value(samples.ctos[start_nr:end_nr])
+        data_size = sum(samples.sizes[start_nr:end_nr])
         flags = 0x020000
         data = ""
         sample_flags = 0  # Which individual sample data is needed
@@ -219,13 +263,44 @@ class TrackResegmenter(object):
             sample_flags |= 0x400
         if common_cto is None or common_cto != 0:
             sample_flags |= 0x800
-        size = 16 + len(data)
-        self.sample_flags = sample_flags
+        sample_count = seg_info.end_nr - seg_info.start_nr
+        moof_size = (8 + 16 +  # moof header, mfhd
+                     8 + 16 + len(data) +  # traf header, tfhd
+                     self._tfdt_size(seg_info) +
+                     20 + sample_count * nr_sample_bytes(sample_flags))
+        return SegmentLayout(flags, data, sample_flags, moof_size, 8 + data_size)
+
+    def _generate_moof(self, sequence_nr, seg_info, layout):
+        "Generate a moof box with the correct sample entries"
+        mfhd = self._generate_mfhd(sequence_nr)
+        offset = 8 + len(mfhd)
+        traf = self._generate_traf(seg_info, layout, offset)
+        size = 8 + len(mfhd) + len(traf)
+        return uint32_to_str(size) + 'moof' + mfhd + traf
+
+    def _generate_mfhd(self, sequence_nr):
+        return (uint32_to_str(16) +  # size
+                'mfhd' +
+                uint32_to_str(0) +  # version_and_flags
+                uint32_to_str(sequence_nr))
+
+    def _generate_traf(self, seg_info, layout, offset):
+        tfhd = self._generate_tfhd(layout, self.track_id)
+        tfdt = self._generate_tfdt(seg_info)
+        offset += 8 + len(tfhd) + len(tfdt)
+        trun = self._generate_trun(seg_info, layout, offset)
+        size = 8 + len(tfhd) + len(tfdt) + len(trun)
+        return uint32_to_str(size) + 'traf' + tfhd + tfdt + trun
 
-        version_and_flags = flags
+    def _generate_tfhd(self, layout, track_id):
+        size = 16 + len(layout.tfhd_data)
+        version_and_flags = layout.tfhd_flags
         return (uint32_to_str(size) + 'tfhd' +
                 uint32_to_str(version_and_flags) +
-                uint32_to_str(track_id) + data)
+                uint32_to_str(track_id) + layout.tfhd_data)
+
+    def _tfdt_size(self, seg_info):
+        return 20 if seg_info.start_time > 2 ** 30 else 16
 
     def _generate_tfdt(self, seg_info):
         if seg_info.start_time > 2 ** 30:
@@ -243,46 +318,45 @@ class TrackResegmenter(object):
                 seg_info.start_time)
         return output
 
-    def _generate_trun(self, seg_info, offset):
+    def _generate_trun(self, seg_info, layout, offset):
         "Generate trun box with correct sample data for segment."
-
-        def nr_sample_bytes(sample_flags):
-            nr_bytes = 0
-            for pattern in (0x100, 0x200, 0x400, 0x800):
-                if sample_flags & pattern != 0:
-                    nr_bytes += 4
-            return nr_bytes
         version = 1  # Allow for signed cto
         ip = self.input_parser
-        sample_data_size = nr_sample_bytes(self.sample_flags)
+        sample_flags = layout.sample_flags
+        sample_data_size = nr_sample_bytes(sample_flags)
         sample_count = seg_info.end_nr - seg_info.start_nr
         trun_size = 20 + sample_count * sample_data_size
-        output = uint32_to_str(trun_size) + 'trun'
-        flags = self.sample_flags | 0x01  # offset present
-        version_and_flags = (version << 24) | flags
-        output += uint32_to_str(version_and_flags)
-        output += uint32_to_str(sample_count)
-        output += uint32_to_str(offset + trun_size + 8)  # 8 bytes into mdat
-        for sample in ip.samples[seg_info.start_nr:seg_info.end_nr]:
-            if self.sample_flags & 0x100:
-                output += uint32_to_str(sample.dur)
-            if self.sample_flags & 0x200:
-                output += uint32_to_str(sample.size)
-            if self.sample_flags & 0x400:
-                output += uint32_to_str(sample.flags)
-            if self.sample_flags & 0x800:
-                output += sint32_to_str(sample.cto)
-        return output
+        start_nr, end_nr = seg_info.start_nr, seg_info.end_nr
+        columns = {}
+        for flag, name, column in ((0x100, 'durations', ip.samples.durs),
+                                   (0x200, 'sizes', ip.samples.sizes),
+                                   (0x400, 'sample_flags', ip.samples.flags),
+                                   (0x800, 'composition_offsets', ip.samples.ctos)):
+            if sample_flags & flag:
+                columns[name] = column[start_nr:end_nr]
+        trun = TrunCodec.new(version, offset + trun_size + 8,  # 8 bytes into mdat
+                             **columns)
+        trun.sample_count = sample_count
+        return trun.encode()
+
+
+def resegment_file(input_file, duration_ms, output_file, skip_sidx=False, verbose=False,
+                   quiet=False):
+    "Resegment input_file into output_file and return the sidx byte range."
+    resegmenter = TrackResegmenter(input_file, duration_ms, output_file,
+                                   skip_sidx, verbose, quiet)
+    resegmenter.resegment()
+    return resegmenter.sidx_range
 
 
 def main():
     parser = ArgumentParser(usage="usage: %(prog)s [options]")
 
     parser.add_argument("-i", "--input-file",
-                        action="store",
-                        dest="input_file",
-                        default="",
-                        help="Input CMAF track file",
+                        action="append",
+                        dest="input_files",
+                        help="Input CMAF track file. Repeat for several tracks, "
+                             "which are resegmented in parallel",
                         required=True)
 
     parser.add_argument("-d", "--duration",
@@ -296,7 +370,8 @@ def main():
                         action="store",
                         dest="output_file",
                         default="",
-                        help="Output CMAF track file")
+                        help="Output CMAF track file, or output directory "
+                             "for several input files")
 
     parser.add_argument("-v", "--verbose",
                         action="store_true",
@@ -308,12 +383,25 @@ def main():
                         dest="skip_sidx",
                         help="Do not write sidx box to output")
 
+    add_batch_arguments(parser)
     args = parser.parse_args()
 
-    resegmenter = TrackResegmenter(args.input_file, args.duration,
-                                   args.output_file, args.skip_sidx,
-                                   args.verbose)
-    resegmenter.resegment()
+    if len(args.input_files) == 1 or not args.output_file:
+        output_files = [args.output_file] * len(args.input_files)
+    elif os.path.isdir(args.output_file):
+        output_files = [os.path.join(args.output_file, os.path.basename(input_file))
+                        for input_file in args.input_files]
+    else:
+        parser.error("The output must be a directory for several input files")
+    tasks = [(input_file, args.duration, output_file, args.skip_sidx, args.verbose,
+              args.quiet)
+             for input_file, output_file in zip(args.input_files, output_files)]
+    batch = run_batch(resegment_file, tasks, args.jobs, args.chunk_size, args.quiet)
+    if not args.quiet:
+        for task, sidx_range in sorted(batch.results):
+            if sidx_range:
+                print "%s: sidx range %s" % (task[2] or task[0], sidx_range)
+    sys.exit(len(batch.failures) > 0)
 
 
 if __name__ == "__main__":
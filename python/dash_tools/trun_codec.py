@@ -0,0 +1,213 @@
+"""Bulk decoding and encoding of trun boxes.
+
+TrunCodec decodes the sample rows of a trun into one array per field with a
+single struct unpack, and encodes them back with a single pack. The filters
+that rewrite trun boxes do their edits on the columns.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import struct
+from array import array
+
+DATA_OFFSET_PRESENT = 0x000001
+FIRST_SAMPLE_FLAGS_PRESENT = 0x000004
+SAMPLE_DURATION_PRESENT = 0x000100
+SAMPLE_SIZE_PRESENT = 0x000200
+SAMPLE_FLAGS_PRESENT = 0x000400
+SAMPLE_CTO_PRESENT = 0x000800
+
+SYNC_SAMPLE_FLAGS = 0x2000000
+NON_SYNC_SAMPLE = 0x10000
+
+# Sample row fields in box order: (attribute, flag)
+COLUMNS = (('durations', SAMPLE_DURATION_PRESENT),
+           ('sizes', SAMPLE_SIZE_PRESENT),
+           ('sample_flags', SAMPLE_FLAGS_PRESENT),
+           ('composition_offsets', SAMPLE_CTO_PRESENT))
+COLUMN_FLAGS = (SAMPLE_DURATION_PRESENT | SAMPLE_SIZE_PRESENT |
+                SAMPLE_FLAGS_PRESENT | SAMPLE_CTO_PRESENT)
+
+
+class TrunCodec(object):
+    """A trun box as column arrays.
+
+    durations, sizes, sample_flags and composition_offsets are arrays with
+    one entry per sample, or None if the field is not in the box (the value
+    then comes from tfhd or trex). composition_offsets are signed for
+    version 1. data_offset and first_sample_flags are None if absent.
+    Removing or adding columns changes the flags on encode()."""
+
+    def __init__(self, data):
+        version_and_flags, self.sample_count = struct.unpack_from('>II', data, 8)
+        self.version = version_and_flags >> 24
+        flags = version_and_flags & 0xffffff
+        self.other_flags = flags & ~(COLUMN_FLAGS | DATA_OFFSET_PRESENT |
+                                     FIRST_SAMPLE_FLAGS_PRESENT)
+        pos = 16
+        self.data_offset = None
+        if flags & DATA_OFFSET_PRESENT:
+            self.data_offset = struct.unpack_from('>i', data, pos)[0]
+            pos += 4
+        self.first_sample_flags = None
+        if flags & FIRST_SAMPLE_FLAGS_PRESENT:
+            self.first_sample_flags = struct.unpack_from('>I', data, pos)[0]
+            pos += 4
+        self.sample_array_offset = pos
+
+        present = [(name, self._typecode(name)) for name, flag in COLUMNS if flags & flag]
+        width = len(present)
+        values = ()
+        if width and self.sample_count:
+            row_format = ''.join(typecode for _, typecode in present)
+            values = struct.unpack_from('>' + row_format * self.sample_count, data, pos)
+        for name, _ in COLUMNS:
+            setattr(self, name, None)
+        for col, (name, typecode) in enumerate(present):
+            setattr(self, name, array(typecode, values[col::width]))
+
+    @classmethod
+    def new(cls, version=0, data_offset=None, first_sample_flags=None, durations=None,
+            sizes=None, sample_flags=None, composition_offsets=None):
+        """Return a TrunCodec for a new trun with the given columns.
+
+        The columns can be any sequences of equal length; absent ones are None."""
+        trun = cls.__new__(cls)
+        trun.version = version
+        trun.other_flags = 0
+        trun.data_offset = data_offset
+        trun.first_sample_flags = first_sample_flags
+        trun.sample_array_offset = (16 + 4 * (data_offset is not None) +
+                                    4 * (first_sample_flags is not None))
+        trun.durations = durations
+        trun.sizes = sizes
+        trun.sample_flags = sample_flags
+        trun.composition_offsets = composition_offsets
+        trun.sample_count = max([len(column) for _, column in trun._columns()] or [0])
+        return trun
+
+    def _typecode(self, name):
+        "Return the array typecode of a column."
+        if name == 'composition_offsets' and self.version == 1:
+            return 'i'
+        return 'I'
+
+    def _columns(self):
+        "Return the present (name, column) pairs in box order."
+        return [(name, getattr(self, name)) for name, _ in COLUMNS
+                if getattr(self, name) is not None]
+
+    @property
+    def flags(self):
+        "The trun flags matching the present fields."
+        flags = self.other_flags
+        if self.data_offset is not None:
+            flags |= DATA_OFFSET_PRESENT
+        if self.first_sample_flags is not None:
+            flags |= FIRST_SAMPLE_FLAGS_PRESENT
+        for name, flag in COLUMNS:
+            if getattr(self, name) is not None:
+                flags |= flag
+        return flags
+
+    def size(self):
+        "Return the size of the encoded box."
+        return (16 + 4 * (self.data_offset is not None) +
+                4 * (self.first_sample_flags is not None) +
+                4 * len(self._columns()) * self.sample_count)
+
+    def encode(self):
+        "Return the trun box with the current fields."
+        columns = self._columns()
+        width = len(columns)
+        parts = [struct.pack('>I4sII', self.size(), 'trun',
+                             self.version << 24 | self.flags, self.sample_count)]
+        if self.data_offset is not None:
+            parts.append(struct.pack('>i', self.data_offset))
+        if self.first_sample_flags is not None:
+            parts.append(struct.pack('>I', self.first_sample_flags))
+        if width and self.sample_count:
+            values = [0] * (width * self.sample_count)
+            for col, (_, column) in enumerate(columns):
+                if len(column) != self.sample_count:
+                    raise ValueError("trun column length %d != sample count %d" %
+                                     (len(column), self.sample_count))
+                values[col::width] = column
+            row_format = ''.join(self._typecode(name) for name, _ in columns)
+            parts.append(struct.pack('>' + row_format * self.sample_count, *values))
+        return ''.join(parts)
+
+    def keep_samples(self, start, end):
+        "Keep only samples start to end-1 (0-based)."
+        end = min(end, self.sample_count)
+        for name, column in self._columns():
+            setattr(self, name, column[start:end])
+        if start > 0:
+            self.first_sample_flags = None
+        self.sample_count = max(0, end - start)
+
+    def merge_samples(self):
+        """Merge all samples into one with the summed duration and size.
+
+        The flags and composition offset of the first sample are kept."""
+        if self.durations is not None:
+            self.durations = array('I', [sum(self.durations)])
+        if self.sizes is not None:
+            self.sizes = array('I', [sum(self.sizes)])
+        if self.sample_flags is not None:
+            self.sample_flags = self.sample_flags[:1]
+        if self.composition_offsets is not None:
+            self.composition_offsets = self.composition_offsets[:1]
+        self.sample_count = min(1, self.sample_count)
+
+    def shift_cto(self, shift=None):
+        """Add shift to all composition offsets and switch to version 1 (signed).
+
+        Without shift, the offsets are shifted so that the first one is 0.
+        Version 0 offsets are read as signed, since that is what encoders
+        mean when they write negative values into a version 0 box."""
+        if self.composition_offsets is None:
+            return
+        offsets = array('i', [(cto - 0x100000000) if cto > 0x7fffffff else cto
+                              for cto in self.composition_offsets])
+        if shift is None:
+            shift = -offsets[0] if offsets else 0
+        self.composition_offsets = array('i', [cto + shift for cto in offsets])
+        self.version = 1
+
+    def mark_non_sync_samples(self):
+        """Set sample_is_non_sync_sample for all samples with other flags than sync.
+
+        Only the per-sample flags column is changed."""
+        if self.sample_flags is None:
+            return
+        self.sample_flags = array('I', [flags if flags == SYNC_SAMPLE_FLAGS
+                                        else flags | NON_SYNC_SAMPLE
+                                        for flags in self.sample_flags])